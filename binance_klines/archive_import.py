@@ -0,0 +1,188 @@
+import datetime
+import io
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from http_client import request
+from columnar import array_frame, ingest_frame, volume_filter
+from metrics import BACKFILL_SKIPPED
+from spool import flush_or_spool
+
+# ============================================================
+# Bulk import from Binance kline archives (data.binance.vision)
+#
+# Complete months come from monthly ZIPs, the current month from
+# daily ZIPs; a monthly file that is not published yet falls back to
+# its daily files. Each CSV is decompressed as a stream, parsed
+# straight into float64 columns and written as one frame, through
+# the same masks and table layout as the REST backfill. Anything no
+# archive covers is left for the REST backfill, and so is every archive
+# that failed to load: its range is returned for the REST plan.
+#
+# The source is the public mirror or a local directory with the same
+# layout, e.g. <dir>/data/spot/monthly/klines/BTCUSDT/1m/...
+# ============================================================
+
+ARCHIVE_SOURCE = "https://data.binance.vision"
+ARCHIVE_PREFIX = {"spot": "data/spot", "futures": "data/futures/um"}
+WORKERS = 8  # concurrent downloads / CSV parses
+PREFETCH = 4  # archives loaded ahead per worker, bounds memory
+DOWNLOAD_TIMEOUT = 120
+
+DAY_MS = 86_400_000
+
+
+def _utc(ms):
+    return datetime.datetime.fromtimestamp(ms / 1000, tz=datetime.timezone.utc)
+
+
+def _ms(dt):
+    return int(dt.timestamp() * 1000)
+
+
+def _next_month(dt):
+    return dt.replace(year=dt.year + dt.month // 12, month=dt.month % 12 + 1)
+
+
+def daily_files(market, symbol, interval, start, end):
+    """Daily archives (path, covered_from, covered_to) for [start, end]."""
+    files = []
+    day = _utc(start).replace(hour=0, minute=0, second=0, microsecond=0)
+    while _ms(day) <= end:
+        name = f"{symbol}-{interval}-{day:%Y-%m-%d}.zip"
+        path = f"{ARCHIVE_PREFIX[market]}/daily/klines/{symbol}/{interval}/{name}"
+        files.append((path, max(_ms(day), start), min(_ms(day) + DAY_MS - 1, end)))
+        day += datetime.timedelta(days=1)
+    return files
+
+
+def archive_files(market, symbol, interval, start, end, now=None):
+    """
+    Archives covering [start, end] that can exist by now: monthly files for
+    complete months, daily files up to yesterday for the current month.
+    Each entry is (path, covered_from, covered_to, fallback); for last month,
+    whose monthly file may not be published yet, fallback lists its daily
+    files. Older months have no fallback: a missing file there means the
+    symbol was not listed.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    today = _ms(now.replace(hour=0, minute=0, second=0, microsecond=0))
+    end = min(end, today - 1)
+
+    files = []
+    month = _utc(start).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    while _ms(month) <= end:
+        month_end = _ms(_next_month(month)) - 1
+        covered = (max(_ms(month), start), min(month_end, end))
+        if month_end < today:
+            name = f"{symbol}-{interval}-{month:%Y-%m}.zip"
+            path = f"{ARCHIVE_PREFIX[market]}/monthly/klines/{symbol}/{interval}/{name}"
+            last_month = _next_month(month) == now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            fallback = daily_files(market, symbol, interval, *covered) if last_month else []
+            files.append((path, *covered, fallback))
+        else:
+            files.extend((*f, []) for f in daily_files(market, symbol, interval, *covered))
+        month = _next_month(month)
+    return files
+
+
+def open_archive(source, path):
+    """A ZipFile source for path under source (URL or directory), or None if absent."""
+    if source.startswith(("http://", "https://")):
+        r = request("GET", f"{source}/{path}", timeout=DOWNLOAD_TIMEOUT, label=path)
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        return io.BytesIO(r.content)
+    full = os.path.join(source, path)
+    return full if os.path.exists(full) else None
+
+
+def read_archive(src):
+    """Parse the CSV inside a kline ZIP into an (11, n) float64 column array (ms timestamps)."""
+    with zipfile.ZipFile(src) as zf:
+        with zf.open(zf.namelist()[0]) as f:
+            # newer files start with a header row
+            header = not f.peek(1)[:1].isdigit()
+            df = pd.read_csv(
+                f, header=None, skiprows=1 if header else 0,
+                usecols=range(11), dtype=np.float64, engine="c",
+            )
+    a = df.to_numpy().T
+    # spot archives switched to microsecond timestamps in 2025
+    if a.shape[1] and a[0, 0] > 1e14:
+        a[0] //= 1000
+        a[6] //= 1000
+    return a
+
+
+def import_archives(sink, market, symbols, interval, start, end, table,
+                    source=ARCHIVE_SOURCE, min_volume=None, store=None, spool=None,
+                    workers=WORKERS, starts=None, rollup=None):
+    """
+    Import every available archive for symbols in [start, end] into table;
+    starts optionally maps symbols to a later start (e.g. their listing).
+    With a CheckpointStore, ranges already completed are skipped and imported
+    ranges are recorded. With a FrameRollup, bars are built from each file's
+    unfiltered rows. Returns the number of 1m rows written and the
+    (symbol, covered_from, covered_to) ranges of archives that failed.
+    """
+    tasks = []
+    for symbol in symbols:
+        symbol_start = max(start, starts.get(symbol, start)) if starts else start
+        for path, covered_from, covered_to, fallback in archive_files(
+                market, symbol, interval, symbol_start, end):
+            if store is not None:
+                if not store.missing(market, symbol, interval, covered_from, covered_to):
+                    continue
+                fallback = [f for f in fallback if store.missing(market, symbol, interval, f[1], f[2])]
+            tasks.append((symbol, path, covered_from, covered_to, fallback))
+    print(f"[ARCHIVE] {len(tasks)} {market} archives to import from {source}")
+
+    def load(task):
+        symbol, path, covered_from, covered_to, fallback = task
+        src = open_archive(source, path)
+        if src is not None:
+            return [(symbol, read_archive(src), covered_from, covered_to)]
+        # monthly file not published yet: its days may be
+        loaded = []
+        for day_path, day_from, day_to in fallback:
+            src = open_archive(source, day_path)
+            if src is not None:
+                loaded.append((symbol, read_archive(src), day_from, day_to))
+        return loaded
+
+    total = 0
+    failed = []
+    chunk = workers * PREFETCH
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i in range(0, len(tasks), chunk):
+            batch = tasks[i:i + chunk]
+            futures = [pool.submit(load, task) for task in batch]
+            # downloads and parses run in parallel, the sink is used from here only
+            for task, future in zip(batch, futures):
+                try:
+                    loaded = future.result()
+                except Exception as e:
+                    failed.append((task[0], task[2], task[3]))
+                    print(f"[ARCHIVE] {task[1]} failed, left for REST: {e}")
+                    continue
+                for symbol, a, covered_from, covered_to in loaded:
+                    buf = sink.new_buffer()
+                    if rollup is None:
+                        df, skipped = array_frame(a, symbol, interval, covered_from, covered_to, min_volume)
+                    else:
+                        df, _ = array_frame(a, symbol, interval, covered_from, covered_to)
+                        ingest_frame(buf, table, rollup.add(df))
+                        df, skipped = volume_filter(df, min_volume)
+                    BACKFILL_SKIPPED.labels(table).inc(skipped)
+                    total += ingest_frame(buf, table, df)
+                    delivered = flush_or_spool(sink, buf, spool)
+                    if store is not None:
+                        store.add(market, symbol, interval, covered_from, covered_to)
+                        store.commit_delivered(delivered, spool)
+
+    print(f"[ARCHIVE] Imported {total} rows ({len(failed)} archives failed)")
+    return total, failed
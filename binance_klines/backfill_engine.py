@@ -0,0 +1,184 @@
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http_client import last_request_seconds
+from rate_limit import klines_limits, klines_weight
+
+# ============================================================
+# Shared backfill engine
+#
+# A job is one (symbol, start_time, end_time) window. Jobs are
+# fetched concurrently by a thread pool; pacing is left to the
+# fetcher's WeightLimiter, so there are no fixed sleeps here.
+#
+# Page size: the limit is either fixed or chosen per request by a
+# PageTuner, which weighs rows per unit of request weight against
+# the measured latency of each limit. Window size: window_span()
+# cuts a long history into whole pages so every worker gets several
+# windows, which turns one symbol's hours of sequential paging into
+# minutes of parallel fetching.
+# ============================================================
+
+DAY_MS = 24 * 60 * 60 * 1000
+MINUTE_MS = 60 * 1000
+JOBS_PER_WORKER = 4  # windows per worker when a plan is split for parallelism
+MIN_WINDOW_PAGES = 5  # below this, per-window overhead outweighs the parallelism
+MAX_WINDOW_PAGES = 200  # cap on one window, so checkpoints advance steadily
+LATENCY_DECAY = 0.2  # weight of the newest request in each limit's latency average
+TUNE_SAMPLES = 3  # requests timed at every candidate limit before choosing
+RETUNE_EVERY = 200  # afterwards one request in this many re-times another candidate
+
+
+def split_windows(start_time, end_time, span_ms):
+    """Split [start_time, end_time] into consecutive windows of span_ms."""
+    windows = []
+    while start_time <= end_time:
+        windows.append((start_time, min(start_time + span_ms - 1, end_time)))
+        start_time += span_ms
+    return windows
+
+
+def window_span(plan, limit, workers, step_ms=MINUTE_MS):
+    """
+    Window length for make_jobs(): a whole number of `limit`-row pages,
+    sized so `workers` threads get about JOBS_PER_WORKER windows each.
+    """
+    total_pages = sum((end - start) // step_ms // limit + 1 for _, start, end in plan)
+    pages = total_pages // max(1, workers * JOBS_PER_WORKER)
+    pages = min(MAX_WINDOW_PAGES, max(MIN_WINDOW_PAGES, pages))
+    return pages * limit * step_ms
+
+
+def make_jobs(plan, span_ms):
+    """Turn [(symbol, start, end), ...] into ordered per-window jobs."""
+    jobs = []
+    for symbol, start_time, end_time in plan:
+        for w_start, w_end in split_windows(start_time, end_time, span_ms):
+            jobs.append((symbol, w_start, w_end))
+    return jobs
+
+
+class PageTuner:
+    """
+    Picks the klines limit of each request. At limit L, throughput is
+    bounded by the weight budget (limiter.rate * L / weight(L) rows/s)
+    and by latency (workers * L / seconds per request at L); the tuner
+    uses the L with the higher bound of the two. Every candidate is
+    timed TUNE_SAMPLES times first, then re-timed now and then, since
+    latency drifts with load.
+    """
+
+    def __init__(self, market, limiter=None, workers=8, step_ms=MINUTE_MS):
+        self.market = market
+        self.limiter = limiter
+        self.workers = workers
+        self.step_ms = step_ms
+        self.limits = klines_limits(market)
+        self.seconds = dict.fromkeys(self.limits)  # latency average per limit
+        self.issued = dict.fromkeys(self.limits, 0)
+        self.requests = 0
+        self.best = max(self.limits)
+        self._lock = threading.Lock()
+
+    def rows_per_second(self, limit):
+        """Estimated backfill throughput at `limit`."""
+        bound = float("inf")
+        if self.limiter is not None:
+            bound = self.limiter.rate * limit / klines_weight(self.market, limit)
+        seconds = self.seconds[limit]
+        if seconds:
+            bound = min(bound, self.workers * limit / seconds)
+        return bound
+
+    def limit(self, start_time=None, end_time=None):
+        """The limit for the next page of [start_time, end_time]."""
+        with self._lock:
+            self.requests += 1
+            limit = self._pick()
+            self.issued[limit] += 1
+        if start_time is not None and end_time is not None:
+            # the last page of a window: the smallest tier that still
+            # covers it costs no more weight, and often less
+            remaining = (end_time - start_time) // self.step_ms + 1
+            fits = [L for L in self.limits if remaining <= L < limit]
+            if fits:
+                limit = fits[0]
+        return limit
+
+    def _pick(self):
+        for limit in self.limits:
+            if self.issued[limit] < TUNE_SAMPLES:
+                return limit
+        if self.requests % RETUNE_EVERY == 0:
+            others = [L for L in self.limits if L != self.best]
+            if others:
+                return others[self.requests // RETUNE_EVERY % len(others)]
+        return self.best
+
+    def observe(self, limit, seconds):
+        """Record the network time of one request made at `limit`."""
+        if seconds is None or limit not in self.seconds:
+            return
+        with self._lock:
+            previous = self.seconds[limit]
+            self.seconds[limit] = seconds if previous is None else \
+                previous + LATENCY_DECAY * (seconds - previous)
+            if any(self.seconds[L] is None for L in self.limits):
+                return
+            best = max(self.limits, key=lambda L: (self.rows_per_second(L), L))
+            if best != self.best:
+                print(f"[TUNE] {self.market} klines: limit {best} "
+                      f"(~{self.rows_per_second(best):,.0f} rows/s, was {self.best})")
+                self.best = best
+
+
+def _run_job(job, fetch_page, on_page, limit):
+    tuner = limit if isinstance(limit, PageTuner) else None
+    symbol, start_time, end_time = job
+    while start_time <= end_time:
+        if tuner is not None:
+            limit = tuner.limit(start_time, end_time)
+        rows = fetch_page(symbol, start_time, end_time, limit)
+        if tuner is not None:
+            tuner.observe(limit, last_request_seconds())
+
+        # A short (or empty) page means nothing is left in the window
+        if len(rows) < limit:
+            on_page(symbol, rows, start_time, end_time)
+            return
+
+        # Next start based on close_time + 1 ms
+        next_start = rows[-1][6] + 1
+        on_page(symbol, rows, start_time, min(next_start - 1, end_time))
+        start_time = next_start
+
+
+def run_backfill(jobs, fetch_page, on_page, limit, workers=8):
+    """
+    Fetch every job with a pool of `workers` threads.
+
+    fetch_page(symbol, start_time, end_time, limit) returns one page of
+    raw kline arrays; `limit` is an int or a PageTuner that chooses it
+    per page. on_page(symbol, rows, covered_from, covered_to)
+    consumes it together with the time range the page is known to
+    cover completely; it is called from worker threads and must do its
+    own locking.
+
+    Returns the list of jobs that failed.
+    """
+    failed = []
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_run_job, job, fetch_page, on_page, limit): job
+            for job in jobs
+        }
+        for future, job in futures.items():
+            try:
+                future.result()
+            except Exception:
+                print(f"[{job[0]}] window {job[1]}-{job[2]} failed:")
+                traceback.print_exc()
+                failed.append(job)
+
+    return failed
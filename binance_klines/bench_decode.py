@@ -0,0 +1,128 @@
+import json
+import random
+import sys
+import time
+from decoders import Kline, make_decoder, msgspec, orjson
+from questdb.ingress import TimestampNanos
+from stream_modes import kline_row
+
+# ============================================================
+# Benchmark: per-message CPU cost of the stream decode path
+#
+# Measures raw frame -> (symbols, columns, at) for each installed
+# decoder. Frames are read from a file (one frame per line, as
+# recorded off the socket) or generated to look like futures frames.
+#
+#   python bench_decode.py [frames.jsonl]
+# ============================================================
+
+FRAMES = 50_000
+ROUNDS = 5
+
+
+def make_frames(n):
+    frames = []
+    symbols = [f"SYM{i}USDT" for i in range(300)]
+    price = 30000.0
+    for i in range(n):
+        symbol = random.choice(symbols)
+        open_time = 1_700_000_000_000 + (i // 300) * 60_000
+        price += random.uniform(-5, 5)
+        frames.append(json.dumps({
+            "stream": f"{symbol.lower()}@kline_1m",
+            "data": {
+                "e": "kline",
+                "E": open_time + 1234,
+                "s": symbol,
+                "k": {
+                    "t": open_time,
+                    "T": open_time + 59_999,
+                    "s": symbol,
+                    "i": "1m",
+                    "f": 100,
+                    "L": 200,
+                    "o": f"{price:.2f}",
+                    "c": f"{price + 1:.2f}",
+                    "h": f"{price + 3:.2f}",
+                    "l": f"{price - 3:.2f}",
+                    "v": f"{random.uniform(0, 1000):.3f}",
+                    "n": random.randint(0, 5000),
+                    "x": random.random() < 0.02,
+                    "q": f"{random.uniform(0, 1e7):.4f}",
+                    "V": f"{random.uniform(0, 500):.3f}",
+                    "Q": f"{random.uniform(0, 5e6):.4f}",
+                    "B": "0",
+                },
+            },
+        }, separators=(",", ":")).encode())
+    return frames
+
+
+def load_frames(path):
+    with open(path, "rb") as f:
+        return [line.rstrip(b"\n") for line in f if line.strip()]
+
+
+def legacy_path(raw):
+    """The original handler: json.loads, dict walk, per-field conversion."""
+    data = json.loads(raw)
+    if "data" in data and "k" in data["data"]:
+        k = data["data"]["k"]
+        return (
+            {"symbol": k["s"], "interval": k["i"]},
+            {
+                "open": float(k["o"]),
+                "high": float(k["h"]),
+                "low": float(k["l"]),
+                "close": float(k["c"]),
+                "volume": float(k["v"]),
+                "close_time": TimestampNanos(int(k["T"] * 1_000_000)),
+                "quote_volume": float(k["q"]),
+                "trades": int(k["n"]),
+                "taker_base_volume": float(k["V"]),
+                "taker_quote_volume": float(k["Q"]),
+            },
+            TimestampNanos(int(k["t"] * 1_000_000)),
+        )
+
+
+def decoder_path(decode):
+    def run(raw):
+        k = decode(raw)
+        if k is not None:
+            return kline_row(k)
+    return run
+
+
+def as_tuple(k):
+    return None if k is None else tuple(getattr(k, f) for f in Kline._fields)
+
+
+def bench(fn, frames):
+    best = float("inf")
+    for _ in range(ROUNDS):
+        t0 = time.perf_counter()
+        for raw in frames:
+            fn(raw)
+        best = min(best, time.perf_counter() - t0)
+    return best / len(frames) * 1e6
+
+
+if __name__ == "__main__":
+    frames = load_frames(sys.argv[1]) if len(sys.argv) > 1 else make_frames(FRAMES)
+    print(f"{len(frames)} frames, best of {ROUNDS} rounds")
+
+    # every backend must produce the same records
+    names = ["json"] + (["orjson"] if orjson else []) + (["msgspec"] if msgspec else [])
+    sample = frames[:1000]
+    reference = [as_tuple(make_decoder("json")(raw)) for raw in sample]
+    for name in names:
+        decode = make_decoder(name)
+        got = [as_tuple(decode(raw)) for raw in sample]
+        assert got == reference, f"{name} decoder disagrees with stdlib json"
+
+    baseline = bench(legacy_path, frames)
+    print(f"{'legacy json + dicts':<22}{baseline:8.2f} µs/msg")
+    for name in names:
+        cost = bench(decoder_path(make_decoder(name)), frames)
+        print(f"{name + ' decoder':<22}{cost:8.2f} µs/msg  ({baseline / cost:.2f}x)")
@@ -0,0 +1,161 @@
+import argparse
+import json
+import random
+import sys
+import time
+from questdb.ingress import Buffer, TimestampNanos
+from capture import capture_files, read_frames
+from event_streams import EventWriter
+from sinks import get_sink
+
+# ============================================================
+# Benchmark: replayed aggTrade / depth load through the batch writer
+#
+# Frames (synthetic, or recorded: a capture directory or a file with
+# one frame per line) are replayed as fast as possible through
+#   legacy - json.loads + one buffer.row() per row, as the kline
+#            handler did per message
+#   batch  - EventWriter.write(): batch decode, column arrays, one
+#            dataframe() call and one flush per FLUSH_FRAMES frames
+# into a sink ("null" by default: ILP is serialized and dropped, so
+# only client CPU is measured; pass --sink questdb or a Sender conf to
+# include the flush). Exits 1 if the batch path stays below
+# --target msgs/s.
+#
+#   python bench_events.py [--frames capture/] [--sink null] [--target 50000]
+# ============================================================
+
+FRAMES = 200_000
+FLUSH_FRAMES = 12_500  # one FLUSH_INTERVAL at 50k msgs/s
+SYMBOLS = 300
+TARGET = 50_000  # msgs/s per process
+ROUNDS = 3
+
+
+def make_frames(kind, n):
+    symbols = [f"SYM{i}USDT" for i in range(SYMBOLS)]
+    price = 30000.0
+    frames = []
+    for i in range(n):
+        symbol = random.choice(symbols)
+        t = 1_700_000_000_000 + i
+        price += random.uniform(-5, 5)
+        if kind == "aggTrade":
+            data = {
+                "e": "aggTrade", "E": t + 3, "s": symbol, "a": 1_000_000 + i,
+                "p": f"{price:.2f}", "q": f"{random.uniform(0, 10):.3f}",
+                "f": 5_000_000 + 2 * i, "l": 5_000_001 + 2 * i, "T": t,
+                "m": random.random() < 0.5,
+            }
+            stream = f"{symbol.lower()}@aggTrade"
+        else:
+            data = {
+                "e": "depthUpdate", "E": t, "T": t - 2, "s": symbol,
+                "U": 10_000 + 8 * i, "u": 10_007 + 8 * i, "pu": 10_000 + 8 * i - 1,
+                "b": [[f"{price - j * 0.1:.2f}", f"{random.uniform(0, 5):.3f}"]
+                      for j in range(random.randint(0, 8))],
+                "a": [[f"{price + j * 0.1:.2f}", f"{random.uniform(0, 5):.3f}"]
+                      for j in range(random.randint(0, 8))],
+            }
+            stream = f"{symbol.lower()}@depth@100ms"
+        frames.append(json.dumps({"stream": stream, "data": data}, separators=(",", ":")))
+    return frames
+
+
+def load_frames(path):
+    """Recorded frames by kind (from the "e" of their payload)."""
+    if path.endswith(".jsonl") or path.endswith(".txt"):
+        with open(path) as f:
+            raws = [line.strip() for line in f if line.strip()]
+    else:
+        raws = [raw for _, raw in read_frames(capture_files(path))]
+    by_kind = {"aggTrade": [], "depth": []}
+    for raw in raws:
+        event = json.loads(raw).get("data", {}).get("e")
+        if event == "aggTrade":
+            by_kind["aggTrade"].append(raw)
+        elif event == "depthUpdate":
+            by_kind["depth"].append(raw)
+    return by_kind
+
+
+def legacy(kind, frames, table):
+    """Per-message json.loads + row(); returns rows."""
+    buf = Buffer(protocol_version=2)
+    rows = 0
+    for raw in frames:
+        if len(buf) > 4 * 1024 * 1024:
+            buf.clear()
+        d = json.loads(raw)["data"]
+        if kind == "aggTrade":
+            buf.row(table, symbols={"symbol": d["s"]}, columns={
+                "agg_id": d["a"], "price": float(d["p"]), "qty": float(d["q"]),
+                "first_id": d["f"], "last_id": d["l"], "buyer_maker": d["m"],
+                "event_time": TimestampNanos(d["E"] * 1_000_000),
+            }, at=TimestampNanos(d["T"] * 1_000_000))
+            rows += 1
+            continue
+        for side, levels in (("bid", d["b"]), ("ask", d["a"])):
+            for price, qty in levels:
+                buf.row(table, symbols={"symbol": d["s"], "side": side}, columns={
+                    "price": float(price), "qty": float(qty), "first_update_id": d["U"],
+                    "final_update_id": d["u"], "prev_update_id": d.get("pu", -1),
+                }, at=TimestampNanos(d["E"] * 1_000_000))
+                rows += 1
+    return rows
+
+
+def batched(writer, frames):
+    rows = 0
+    for i in range(0, len(frames), FLUSH_FRAMES):
+        rows += writer.write(frames[i:i + FLUSH_FRAMES])
+    return rows
+
+
+def bench(fn, frames):
+    """Best (wall, cpu, rows) of ROUNDS."""
+    best = None
+    for _ in range(ROUNDS):
+        wall, cpu = time.perf_counter(), time.process_time()
+        rows = fn(frames)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        if best is None or wall < best[0]:
+            best = (wall, cpu, rows)
+    return best
+
+
+def line(name, frames, wall, cpu, rows):
+    print(f"{name:<22}{len(frames) / wall:>12,.0f} msgs/s {rows / wall:>12,.0f} rows/s "
+          f"{cpu / len(frames) * 1e6:8.2f} us CPU/msg")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replayed aggTrade / depth load benchmark")
+    parser.add_argument("--frames", help="recorded frames: a capture, or a .jsonl with one frame per line")
+    parser.add_argument("--count", type=int, default=FRAMES, help="synthetic frames per kind")
+    parser.add_argument("--sink", default="null", help="sink target (see sinks.py)")
+    parser.add_argument("--target", type=int, default=TARGET, help="required batch msgs/s")
+    args = parser.parse_args()
+
+    if args.frames:
+        by_kind = load_frames(args.frames)
+    else:
+        by_kind = {kind: make_frames(kind, args.count) for kind in ("aggTrade", "depth")}
+    sink = get_sink(args.sink)
+    print(f"=== Event stream benchmark: sink {args.sink}, best of {ROUNDS} rounds ===")
+
+    slow = []
+    for kind, frames in by_kind.items():
+        if not frames:
+            continue
+        table = f"bench_{kind.lower()}"
+        writer = EventWriter(kind, table, sink)
+        print(f"{kind}: {len(frames)} frames")
+        line("  legacy per-message", frames, *bench(lambda f: legacy(kind, f, table), frames))
+        wall, cpu, rows = bench(lambda f: batched(writer, f), frames)
+        line("  batch", frames, wall, cpu, rows)
+        if len(frames) / wall < args.target:
+            slow.append(kind)
+    if slow:
+        print(f"Below {args.target:,} msgs/s: {', '.join(slow)}")
+        sys.exit(1)
@@ -0,0 +1,107 @@
+import random
+import time
+from questdb.ingress import Buffer, TimestampNanos
+from columnar import KlineFrameBuffer
+
+# ============================================================
+# Benchmark: per-row sender.row() vs columnar dataframe ingest
+#
+# Both paths serialize into an in-memory ILP buffer, so only the
+# client-side CPU cost is measured (no network, no QuestDB).
+# ============================================================
+
+PAGE_SIZE = 1000
+PAGES = 200
+PAGES_PER_FLUSH = 20  # same cadence as the backfill modules
+ROUNDS = 5
+
+
+def new_buffer():
+    try:
+        return Buffer(protocol_version=2)
+    except TypeError:
+        # questdb < 3 has no protocol versions
+        return Buffer()
+
+
+def make_page(start_time):
+    rows = []
+    price = 30000.0
+    for i in range(PAGE_SIZE):
+        open_time = start_time + i * 60_000
+        price += random.uniform(-5, 5)
+        rows.append([
+            open_time,
+            f"{price:.2f}",
+            f"{price + 3:.2f}",
+            f"{price - 3:.2f}",
+            f"{price + 1:.2f}",
+            f"{random.uniform(0, 100000):.3f}",
+            open_time + 59_999,
+            f"{random.uniform(0, 1e8):.4f}",
+            random.randint(0, 5000),
+            f"{random.uniform(0, 50000):.3f}",
+            f"{random.uniform(0, 5e7):.4f}",
+            "0",
+        ])
+    return rows
+
+
+def ingest_rows(buf, rows, symbol, interval):
+    """The original per-kline ingest_batch() loop."""
+    for r in rows:
+        buf.row(
+            "spot_klines",
+            symbols={"symbol": symbol, "interval": interval},
+            columns={
+                "open": float(r[1]),
+                "high": float(r[2]),
+                "low": float(r[3]),
+                "close": float(r[4]),
+                "volume": float(r[5]),
+                "close_time": TimestampNanos(int(r[6] * 1_000_000)),
+                "quote_volume": float(r[7]),
+                "trades": int(r[8]),
+                "taker_base_volume": float(r[9]),
+                "taker_quote_volume": float(r[10]),
+            },
+            at=TimestampNanos(int(r[0] * 1_000_000)),
+        )
+
+
+def bench_rows(buf, pages):
+    for i, page in enumerate(pages, 1):
+        ingest_rows(buf, page, "BTCUSDT", "1m")
+        if i % PAGES_PER_FLUSH == 0:
+            buf.clear()
+
+
+def bench_columnar(buf, pages):
+    frames = KlineFrameBuffer("spot_klines", "1m")
+    for i, page in enumerate(pages, 1):
+        frames.add("BTCUSDT", page)
+        if i % PAGES_PER_FLUSH == 0:
+            frames.write(buf)
+            buf.clear()
+
+
+def run(name, fn, pages):
+    best = None
+    for _ in range(ROUNDS):
+        buf = new_buffer()
+        t0 = time.perf_counter()
+        fn(buf, pages)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+
+    total = PAGE_SIZE * len(pages)
+    print(f"{name:<10} {total / best:>12,.0f} rows/s  {best / total * 1e6:6.2f} us/row")
+    return total / best
+
+
+if __name__ == "__main__":
+    pages = [make_page(1_672_531_200_000 + p * PAGE_SIZE * 60_000) for p in range(PAGES)]
+    print(f"=== Ingest benchmark: {PAGES} pages x {PAGE_SIZE} klines ===")
+    before = run("row()", bench_rows, pages)
+    after = run("columnar", bench_columnar, pages)
+    print(f"speedup    {after / before:.1f}x")
@@ -0,0 +1,273 @@
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+import aiohttp
+import requests
+import fake_exchange
+import future_stream
+from fake_exchange import percentiles, symbol_names
+from backfill_engine import DAY_MS, PageTuner, make_jobs, run_backfill, window_span
+from columnar import KlineFrameBuffer
+from rollups import ROLLUP_INTERVALS, FrameRollup
+from rate_limit import WeightLimiter, best_klines_limit
+from sinks import get_sink
+from spool import flush_or_spool
+from stream_modes import KlineRouter
+from stream_writer import StreamWriter
+from utils import future_fetch_klines
+from ws_manager import StreamManager
+from metrics import BACKFILL_ROWS, WRITER_DROPPED, WRITER_ROWS
+
+# ============================================================
+# Benchmark: end-to-end backfill and stream paths, fully local
+#
+# Runs the real pipeline code against fake_exchange.py (Binance and
+# the ILP sink, each in its own process) and reports rows/s,
+# p50/p99 latency and client CPU per row:
+#   backfill - run_backfill + limiter + KlineFrameBuffer/rollups +
+#              flushes; latency is page received -> flush acked
+#   stream   - StreamManager + handle_message + KlineRouter +
+#              StreamWriter; latency is frame sent -> row at the sink.
+#              Throughput follows the offered --rate; raise it until
+#              frames_per_s stops following or rows are dropped
+# Every row is validated by the sink. --save writes the results as
+# JSON, --compare fails (exit 1) if rows/s or CPU per row regressed by
+# more than REGRESSION_TOLERANCE against a saved run.
+#
+#   python bench_pipeline.py [backfill] [stream] [--symbols 50] ...
+# ============================================================
+
+BINANCE_PORT = 8765
+QUESTDB_PORT = 8766
+BINANCE_URL = f"http://127.0.0.1:{BINANCE_PORT}"
+QUESTDB_CONF = f"http::addr=127.0.0.1:{QUESTDB_PORT};"
+TABLE = "bench_klines"
+INTERVAL = "1m"
+PAGES_PER_FLUSH = 20  # same cadence as the backfill modules
+VOLUME_THRESHOLD = 50000
+REGRESSION_TOLERANCE = 0.10
+
+
+def fake_stats():
+    """Counters of both fakes merged into one dict."""
+    stats = {}
+    for port in (BINANCE_PORT, QUESTDB_PORT):
+        stats.update(requests.get(f"http://127.0.0.1:{port}/_stats", timeout=10).json())
+    return stats
+
+
+def reset_fakes():
+    for port in (BINANCE_PORT, QUESTDB_PORT):
+        requests.post(f"http://127.0.0.1:{port}/_reset", timeout=10)
+
+
+def report(name, rows, wall, cpu, pct, **extra):
+    """Print and return one scenario's results; pct is {50: ms, 99: ms}."""
+    result = {
+        "rows": rows,
+        "rows_per_s": rows / wall if wall else 0.0,
+        "p50_ms": pct.get(50),
+        "p99_ms": pct.get(99),
+        "cpu_us_per_row": cpu / rows * 1e6 if rows else None,
+        **extra,
+    }
+    p50 = "-" if result["p50_ms"] is None else f"{result['p50_ms']:.1f}"
+    p99 = "-" if result["p99_ms"] is None else f"{result['p99_ms']:.1f}"
+    cpu_row = "-" if result["cpu_us_per_row"] is None else f"{result['cpu_us_per_row']:.2f}"
+    print(f"{name:<10}{result['rows_per_s']:>12,.0f} rows/s  p50 {p50:>7} ms  p99 {p99:>7} ms"
+          f"  {cpu_row:>7} us CPU/row")
+    for key, value in extra.items():
+        print(f"{'':<10}{key}: {value}")
+    return result
+
+
+# ============================================================
+# Backfill path
+# ============================================================
+def bench_backfill(symbols, days, workers, limit, weight_limit):
+    start = fake_exchange.LISTED_FROM
+    end = start + days * DAY_MS - 1
+    limiter = WeightLimiter(weight_limit)
+    plan = [(s, start, end) for s in symbols]
+    page = limit or PageTuner("futures", limiter, workers)
+    jobs = make_jobs(plan, window_span(plan, limit or best_klines_limit("futures"), workers))
+
+    def fetch_page(symbol, start_time, end_time, page_limit):
+        return future_fetch_klines(symbol, INTERVAL, start_time, end_time, limit=page_limit,
+                                   limiter=limiter, base_url=BINANCE_URL)
+
+    frames = KlineFrameBuffer(TABLE, INTERVAL, start, end, min_volume=VOLUME_THRESHOLD,
+                              rollup=FrameRollup(ROLLUP_INTERVALS))
+    lock = threading.Lock()
+    received = []  # arrival time of every page since the last flush
+    latencies = []
+    pages = 0
+    rows_before = BACKFILL_ROWS.labels(TABLE).value
+
+    sink = get_sink(QUESTDB_CONF)
+
+    def flush():
+        buf = sink.new_buffer()
+        frames.write(buf)
+        flush_or_spool(sink, buf, None)
+        acked = time.perf_counter()
+        latencies.extend((acked - t) * 1000 for t in received)
+        received.clear()
+
+    def on_page(symbol, rows, covered_from, covered_to):
+        nonlocal pages
+        with lock:
+            received.append(time.perf_counter())
+            if rows:
+                frames.add(symbol, rows)
+            pages += 1
+            if pages % PAGES_PER_FLUSH == 0:
+                flush()
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    failed = run_backfill(jobs, fetch_page, on_page, page, workers)
+    flush()
+    buf = sink.new_buffer()
+    frames.drain(buf)
+    flush_or_spool(sink, buf, None)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    written = BACKFILL_ROWS.labels(TABLE).value - rows_before
+    stats = fake_stats()
+    return report(
+        "backfill", stats["rows"], wall, cpu, percentiles(latencies),
+        pages=pages,
+        failed_windows=len(failed),
+        rate_limited=stats["rate_limited"],
+        weight_per_min=round(stats["weight_used"] / wall * 60),
+        rows_written=written,
+        invalid_rows=stats["invalid_rows"],
+        errors=stats["errors"],
+    )
+
+
+# ============================================================
+# Stream path
+# ============================================================
+async def _stream_client(symbols, seconds, mode):
+    ws_url = f"ws://127.0.0.1:{BINANCE_PORT}/stream"
+    counts = {}
+    sink = get_sink(QUESTDB_CONF)
+    writer = StreamWriter(sink)
+    router = KlineRouter(writer, TABLE, mode)
+    background = [asyncio.create_task(writer.run()), asyncio.create_task(router.run())]
+
+    async with aiohttp.ClientSession() as session:
+        manager = StreamManager(
+            session, ws_url, future_stream.stream_name,
+            lambda raw: future_stream.handle_message(router, raw, counts),
+        )
+        wall, cpu = time.perf_counter(), time.process_time()
+        await manager.set_symbols(symbols)
+        await asyncio.sleep(seconds)
+        for task in manager.tasks:
+            task.cancel()
+        await asyncio.gather(*manager.tasks, return_exceptions=True)
+
+    # let the router's last tick and the writer's last batch go out
+    await asyncio.sleep(router.coalesce_ms / 1000)
+    while not writer.queue.empty():
+        await asyncio.sleep(0.01)
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    return sum(counts.values()), wall, cpu
+
+
+def bench_stream(symbols, seconds, mode):
+    rows_before, dropped_before = WRITER_ROWS.value, WRITER_DROPPED.value
+    received, wall, cpu = asyncio.run(_stream_client(symbols, seconds, mode))
+    stats = fake_stats()
+    return report(
+        "stream", stats["rows"], wall, cpu, {int(p): s * 1000 for p, s in stats["latency"].items()},
+        frames_sent=stats["frames_sent"],
+        frames_received=received,
+        frames_per_s=round(received / wall),
+        cpu_us_per_frame=round(cpu / received * 1e6, 2) if received else None,
+        rows_written=WRITER_ROWS.value - rows_before,
+        dropped=WRITER_DROPPED.value - dropped_before,
+        latency_samples=stats["latency_samples"],
+        invalid_rows=stats["invalid_rows"],
+        errors=stats["errors"],
+    )
+
+
+# ============================================================
+# Regression check
+# ============================================================
+def compare(results, baseline):
+    """Print changes against a saved run; returns False on a regression."""
+    ok = True
+    for name, result in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        for key, higher_is_better in (("rows_per_s", True), ("cpu_us_per_row", False)):
+            if not old.get(key) or result.get(key) is None:
+                continue
+            change = result[key] / old[key] - 1
+            worse = -change if higher_is_better else change
+            flag = "REGRESSION" if worse > REGRESSION_TOLERANCE else "ok"
+            ok = ok and flag == "ok"
+            print(f"{name:<10}{key:<16}{old[key]:>12.2f} -> {result[key]:>12.2f}  {change:+.1%}  {flag}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local end-to-end pipeline benchmark")
+    parser.add_argument("scenarios", nargs="*", default=["backfill", "stream"],
+                        help="backfill and/or stream (default: both)")
+    parser.add_argument("--symbols", type=int, default=fake_exchange.SYMBOLS)
+    parser.add_argument("--days", type=int, default=30, help="backfill history per symbol")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=0,
+                        help="klines per REST page (default: chosen per request by PageTuner)")
+    parser.add_argument("--weight-limit", type=int, default=fake_exchange.WEIGHT_LIMIT,
+                        help="per-minute weight enforced by the fake (and the client limiter)")
+    parser.add_argument("--seconds", type=float, default=10, help="stream duration")
+    parser.add_argument("--rate", type=int, default=fake_exchange.FRAME_RATE,
+                        help="frames/s per WebSocket connection")
+    parser.add_argument("--mode", default="all", help="stream mode (see stream_modes.py)")
+    parser.add_argument("--frames", help="serve recorded frames (a capture, or one frame per line) instead of synthetic ones")
+    parser.add_argument("--save", help="write results as JSON")
+    parser.add_argument("--compare", help="JSON from an earlier --save to check against")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - {"backfill", "stream"}
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    fakes = fake_exchange.start(
+        BINANCE_PORT, QUESTDB_PORT, symbols=args.symbols, weight_limit=args.weight_limit,
+        frame_rate=args.rate, frames_path=args.frames,
+    )
+    symbols = symbol_names(args.symbols)
+    print(f"=== Pipeline benchmark: {args.symbols} symbols ===")
+    results = {}
+    try:
+        if "backfill" in args.scenarios:
+            reset_fakes()
+            results["backfill"] = bench_backfill(symbols, args.days, args.workers,
+                                                 args.limit, args.weight_limit)
+        if "stream" in args.scenarios:
+            reset_fakes()
+            results["stream"] = bench_stream(symbols, args.seconds, args.mode)
+    finally:
+        for proc in fakes:
+            proc.terminate()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if not compare(results, json.load(f)):
+                sys.exit(1)
@@ -0,0 +1,155 @@
+import asyncio
+import glob
+import gzip
+import heapq
+import os
+import threading
+import time
+import zlib
+
+# ============================================================
+# Raw WebSocket frame capture
+#
+# With capture on, every frame a stream receives is kept with its
+# receive time (ns) and written to rotating, gzip-compressed segment
+# files, so a misbehaving window can be replayed later (replay.py)
+# or served as load by fake_exchange.py. The hot path only appends to
+# a list. Once per FLUSH_INTERVAL the list is swapped out, and a
+# thread compresses it into one gzip member at the end of the current
+# segment. A crash can therefore lose at most the last unflushed
+# second, and every earlier member stays readable.
+#
+# Segment: <UTC start>-<pid>-<seq>.frames.gz, one "<recv_ns> <frame>" per line.
+# The oldest segments are deleted once the directory exceeds MAX_BYTES.
+# ============================================================
+
+SEGMENT_SECONDS = 3600
+SEGMENT_BYTES = 256 * 1024 * 1024  # compressed
+MAX_BYTES = 20 * 1024 ** 3
+FLUSH_INTERVAL = 1.0
+COMPRESS_LEVEL = 3
+SEGMENT_SUFFIX = ".frames.gz"
+
+
+class FrameCapture:
+
+    def __init__(self, directory, segment_seconds=SEGMENT_SECONDS, segment_bytes=SEGMENT_BYTES,
+                 max_bytes=MAX_BYTES, compresslevel=COMPRESS_LEVEL):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.compresslevel = compresslevel
+        self.pending = []
+        self.lock = threading.Lock()
+        self.file = None
+        self.opened_at = 0.0
+        self.size = 0
+        self.segments = 0
+        self.frames = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, raw):
+        """Record one frame as received (str or bytes)."""
+        self.pending.append((time.time_ns(), raw))
+
+    def _rotate(self):
+        if self.file is not None:
+            self.file.close()
+        name = (time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+                + f"-{os.getpid()}-{self.segments:06d}{SEGMENT_SUFFIX}")
+        self.segments += 1
+        self.file = open(os.path.join(self.directory, name), "ab")
+        self.opened_at = time.monotonic()
+        self.size = 0
+        self._evict()
+
+    def _evict(self):
+        segments = capture_files(self.directory)
+        sizes = {path: os.path.getsize(path) for path in segments}
+        total = sum(sizes.values())
+        for path in segments[:-1]:  # never the active segment
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= sizes[path]
+            print(f"[CAPTURE] Over {self.max_bytes} bytes: removed {os.path.basename(path)}")
+
+    def _write_block(self, frames):
+        lines = "".join(
+            f"{t} {raw if isinstance(raw, str) else raw.decode()}\n" for t, raw in frames
+        )
+        block = gzip.compress(lines.encode(), self.compresslevel)
+        with self.lock:
+            if (self.file is None or self.size >= self.segment_bytes
+                    or time.monotonic() - self.opened_at >= self.segment_seconds):
+                self._rotate()
+            self.file.write(block)
+            self.file.flush()
+            self.size += len(block)
+            self.frames += len(frames)
+
+    def flush(self):
+        frames, self.pending = self.pending, []
+        if frames:
+            self._write_block(frames)
+
+    async def run(self, interval=FLUSH_INTERVAL):
+        """Flush pending frames every `interval` seconds from a worker thread."""
+        while True:
+            await asyncio.sleep(interval)
+            frames, self.pending = self.pending, []
+            if frames:
+                await asyncio.to_thread(self._write_block, frames)
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        print(f"[CAPTURE] {self.frames} frames written to {self.directory}")
+
+
+# ============================================================
+# Reading
+# ============================================================
+def capture_files(path):
+    """Segments under a capture directory (oldest first), or [path] for a single file."""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, "**", "*" + SEGMENT_SUFFIX), recursive=True),
+                      key=os.path.basename)
+    return [path]
+
+
+def _read_segments(paths, since_ns, until_ns):
+    for path in paths:
+        try:
+            with gzip.open(path, "rt") as f:
+                for line in f:
+                    recv_ns, _, raw = line.rstrip("\n").partition(" ")
+                    recv_ns = int(recv_ns)
+                    if since_ns is not None and recv_ns < since_ns:
+                        continue
+                    if until_ns is not None and recv_ns > until_ns:
+                        continue
+                    yield recv_ns, raw
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            print(f"[CAPTURE] {os.path.basename(path)} ends in a torn block ({e}), skipping the rest")
+
+
+def read_frames(paths, since_ns=None, until_ns=None):
+    """
+    Iterate (recv_ns, frame) over capture segments, optionally limited to
+    receive times in [since_ns, until_ns]. Segments in one directory are
+    read in order; directories (e.g. the shards of a sharded run) are
+    merged by receive time. A torn final gzip member (from a crash) ends
+    its segment with a warning.
+    """
+    by_dir = {}
+    for path in paths:
+        by_dir.setdefault(os.path.dirname(path), []).append(path)
+    streams = [_read_segments(group, since_ns, until_ns) for group in by_dir.values()]
+    if len(streams) == 1:
+        return streams[0]
+    return heapq.merge(*streams, key=lambda frame: frame[0])
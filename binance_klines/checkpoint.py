@@ -0,0 +1,132 @@
+import sqlite3
+import threading
+
+# ============================================================
+# Backfill checkpoint store
+#
+# Completed time ranges per (market, symbol, interval), kept in
+# SQLite. Ranges are buffered in memory by add() and written in one
+# transaction by commit(), which the backfill calls right after a
+# successful sender.flush(), so a range is only ever recorded once
+# its rows are in QuestDB. Resume works per symbol and does not
+# depend on the exchangeInfo symbol order.
+# ============================================================
+
+CHECKPOINT_DB = "backfill_checkpoints.db"
+
+
+def merge_ranges(ranges):
+    """Merge inclusive [start, end] ranges that overlap or touch."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def subtract_ranges(start, end, ranges):
+    """Parts of [start, end] not covered by the merged `ranges`."""
+    missing = []
+    for r_start, r_end in ranges:
+        if r_end < start:
+            continue
+        if r_start > end:
+            break
+        if r_start > start:
+            missing.append((start, r_start - 1))
+        start = max(start, r_end + 1)
+        if start > end:
+            return missing
+    if start <= end:
+        missing.append((start, end))
+    return missing
+
+
+class CheckpointStore:
+
+    def __init__(self, path=CHECKPOINT_DB):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS completed ("
+            " market TEXT NOT NULL,"
+            " symbol TEXT NOT NULL,"
+            " interval TEXT NOT NULL,"
+            " start_time INTEGER NOT NULL,"
+            " end_time INTEGER NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS completed_key"
+            " ON completed (market, symbol, interval, start_time)"
+        )
+        self.conn.commit()
+        self.pending = {}
+        self.spool_losses = {}  # Spool directory -> its losses at the last commit_delivered()
+        self.lock = threading.Lock()
+
+    def completed(self, market, symbol, interval):
+        """Committed ranges for one key, merged and sorted."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT start_time, end_time FROM completed"
+                " WHERE market = ? AND symbol = ? AND interval = ?",
+                (market, symbol, interval),
+            ).fetchall()
+        return merge_ranges(rows)
+
+    def missing(self, market, symbol, interval, start_time, end_time):
+        """Windows of [start_time, end_time] that still need fetching."""
+        return subtract_ranges(start_time, end_time, self.completed(market, symbol, interval))
+
+    def add(self, market, symbol, interval, start_time, end_time):
+        """Buffer a completed range; it is persisted by the next commit()."""
+        with self.lock:
+            self.pending.setdefault((market, symbol, interval), []).append((start_time, end_time))
+
+    def commit(self):
+        """Atomically merge all buffered ranges into the store."""
+        with self.lock:
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, {}
+            with self.conn:
+                for (market, symbol, interval), ranges in pending.items():
+                    key = (market, symbol, interval)
+                    existing = self.conn.execute(
+                        "SELECT start_time, end_time FROM completed"
+                        " WHERE market = ? AND symbol = ? AND interval = ?",
+                        key,
+                    ).fetchall()
+                    self.conn.execute(
+                        "DELETE FROM completed WHERE market = ? AND symbol = ? AND interval = ?",
+                        key,
+                    )
+                    self.conn.executemany(
+                        "INSERT INTO completed VALUES (?, ?, ?, ?, ?)",
+                        [key + r for r in merge_ranges(existing + ranges)],
+                    )
+
+    def commit_delivered(self, delivered, spool=None):
+        """
+        Commit the buffered ranges once their rows are in QuestDB. delivered
+        is flush_or_spool()'s result for the batch with the newest of them:
+        while batches wait in the spool the ranges stay buffered. If the
+        spool lost data since the last call (evicted or rejected batches),
+        they are dropped instead, for the next run to fetch again.
+        """
+        if spool is not None and spool.losses != self.spool_losses.get(spool.directory, 0):
+            self.spool_losses[spool.directory] = spool.losses
+            with self.lock:
+                self.pending = {}
+            print("[CHECKPOINT] Spooled rows were lost, their ranges stay unrecorded")
+            return
+        # an empty batch counts as delivered even with older ones spooled
+        if delivered and (spool is None or not spool.pending()):
+            self.commit()
+
+    def close(self):
+        # buffered ranges are dropped: their rows may not have been flushed
+        self.conn.close()
@@ -0,0 +1,137 @@
+import datetime
+import json
+import os
+import time
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11: JSON config files only
+    tomllib = None
+
+# ============================================================
+# Pipeline configuration
+#
+# Settings shared by the entry points (QuestDB address, backfill
+# date ranges, REST weight budgets, orchestrator options). Values
+# are taken from, last one wins:
+#   - DEFAULTS below
+#   - the config file: $KLINES_CONFIG, else klines.toml in the
+#     working directory if it exists (TOML, or JSON for *.json)
+#   - environment variables KLINES_<SECTION>_<KEY>, e.g.
+#     KLINES_QUESTDB_HOST=10.0.0.5, KLINES_SPOT_DATE_FROM=2023-06-01,
+#     KLINES_MAIN_MARKETS=futures,spot
+# Dates are ISO 8601 in UTC or epoch ms; date_to = "now" means the
+# last closed minute when the process starts.
+#
+#   [questdb]
+#   host = "10.0.0.5"
+#   [futures]
+#   date_from = "2023-01-01"
+# ============================================================
+
+CONFIG_FILE = "klines.toml"
+ENV_PREFIX = "KLINES_"
+
+DEFAULTS = {
+    "questdb": {
+        "host": "82.29.166.107",
+        "port": 9000,
+    },
+    "futures": {
+        "date_from": "2023-01-01",
+        "date_to": "2024-12-31T23:59:59",
+    },
+    "spot": {
+        "date_from": "2022-01-01",
+        "date_to": "2024-12-31T23:59:59",
+    },
+    # per-minute request weight per REST API, shared by every job in a process
+    "limits": {
+        "spot_weight": 6000,
+        "futures_weight": 2400,
+        "headroom": 0.9,
+    },
+    # where rows go (see sinks.py)
+    "sink": {
+        "target": "questdb",  # "questdb", a Sender conf, "parquet:<dir>", "null" or "count"
+        "transport": "http",  # ILP over "http" or "tcp" for target "questdb"
+        "tcp_port": 9009,
+        "pool_size": 4,  # QuestDB senders per process
+        "init_buf_size": 1024 * 1024,
+        "max_buf_size": 256 * 1024 * 1024,
+        "retry_timeout": 10_000,  # ms an HTTP flush is retried before it fails
+    },
+    # main.py
+    "main": {
+        "markets": ["futures", "spot"],
+        "metrics_port": 9400,
+        "handoff_wait": 60,  # seconds to wait for every symbol's first live kline
+    },
+}
+
+
+def _read_file(path):
+    if path.endswith(".json"):
+        with open(path) as f:
+            return json.load(f)
+    if tomllib is None:
+        raise RuntimeError(f"{path}: TOML config needs Python 3.11+, use a .json file")
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def _coerce(value, default):
+    """An environment string as the type of its default."""
+    if isinstance(default, bool):
+        return value.lower() in ("1", "true", "yes")
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    if isinstance(default, list):
+        return [v.strip() for v in value.split(",") if v.strip()]
+    return value
+
+
+def load(path=None, environ=os.environ):
+    """Merged settings as {section: {key: value}}."""
+    settings = {section: dict(values) for section, values in DEFAULTS.items()}
+
+    path = path or environ.get(ENV_PREFIX + "CONFIG")
+    if path is None and os.path.exists(CONFIG_FILE):
+        path = CONFIG_FILE
+    if path is not None:
+        for section, values in _read_file(path).items():
+            if section not in settings:
+                raise ValueError(f"{path}: unknown config section [{section}]")
+            settings[section].update(values)
+
+    for section, values in settings.items():
+        for key, value in values.items():
+            env = environ.get(f"{ENV_PREFIX}{section}_{key}".upper())
+            if env is not None:
+                values[key] = _coerce(env, value)
+    return settings
+
+
+settings = load()
+
+
+def get(section, key):
+    return settings[section][key]
+
+
+def date_ms(section, key):
+    """A configured date as epoch ms (UTC)."""
+    value = get(section, key)
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        return int(value)
+    if value == "now":
+        now = int(time.time() * 1000)
+        return now - now % 60_000 - 1
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        value = value.isoformat()  # TOML date literal
+    t = value if isinstance(value, datetime.datetime) else datetime.datetime.fromisoformat(value)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=datetime.timezone.utc)
+    return int(t.timestamp() * 1000)
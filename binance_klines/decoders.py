@@ -0,0 +1,338 @@
+import json
+import re
+from typing import NamedTuple, Optional
+import numpy as np
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ============================================================
+# Kline frame decoders
+#
+# Turn a raw combined-stream frame into a typed Kline record (or None
+# for anything that is not a kline, e.g. SUBSCRIBE acks). Backends:
+#   "msgspec" - decodes straight into a Struct, no intermediate dicts;
+#               numeric strings are converted while parsing
+#   "orjson"  - fast parse to dicts, then one conversion pass
+#   "json"    - stdlib, always available
+# "auto" picks the first one that is installed, in that order.
+# ============================================================
+
+DECODERS = ("auto", "msgspec", "orjson", "json")
+
+
+class Kline(NamedTuple):
+    symbol: str
+    interval: str
+    open_time: int  # ms
+    close_time: int  # ms
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    quote_volume: float
+    trades: int
+    taker_base_volume: float
+    taker_quote_volume: float
+    closed: bool
+    event_time: int = 0  # ms, exchange event time of the frame (0 for derived bars)
+
+
+# ------------------------------------------------------------
+# dict-based backends (stdlib json / orjson)
+# ------------------------------------------------------------
+def kline_from_dict(k, event_time=0):
+    return Kline(
+        k["s"],
+        k["i"],
+        k["t"],
+        k["T"],
+        float(k["o"]),
+        float(k["h"]),
+        float(k["l"]),
+        float(k["c"]),
+        float(k["v"]),
+        float(k["q"]),
+        k["n"],
+        float(k["V"]),
+        float(k["Q"]),
+        k["x"],
+        event_time,
+    )
+
+
+def _dict_decoder(loads):
+    def decode(raw):
+        data = loads(raw).get("data")
+        if data is None or "k" not in data:
+            return None
+        return kline_from_dict(data["k"], data.get("E", 0))
+    return decode
+
+
+# ------------------------------------------------------------
+# msgspec backend
+# ------------------------------------------------------------
+if msgspec is not None:
+
+    class KlineStruct(msgspec.Struct, rename={
+        "symbol": "s", "interval": "i", "open_time": "t", "close_time": "T",
+        "open": "o", "high": "h", "low": "l", "close": "c", "volume": "v",
+        "quote_volume": "q", "trades": "n", "taker_base_volume": "V",
+        "taker_quote_volume": "Q", "closed": "x",
+    }):
+        """Same fields as Kline, decoded directly from the payload."""
+        symbol: str
+        interval: str
+        open_time: int
+        close_time: int
+        open: float
+        high: float
+        low: float
+        close: float
+        volume: float
+        quote_volume: float
+        trades: int
+        taker_base_volume: float
+        taker_quote_volume: float
+        closed: bool
+        event_time: int = 0  # filled from the enclosing event
+
+    class _KlineEvent(msgspec.Struct):
+        E: int = 0
+        k: Optional[KlineStruct] = None
+
+    class _Frame(msgspec.Struct):
+        data: Optional[_KlineEvent] = None
+
+    def _msgspec_decoder():
+        # strict=False converts Binance's numeric strings while parsing
+        decoder = msgspec.json.Decoder(_Frame, strict=False)
+
+        def decode(raw):
+            data = decoder.decode(raw).data
+            if data is None or data.k is None:
+                return None
+            k = data.k
+            k.event_time = data.E
+            return k
+        return decode
+
+
+def make_decoder(name="auto"):
+    """Return decode(raw) -> Kline-like record or None, for the named backend."""
+    if name not in DECODERS:
+        raise ValueError(f"Unknown decoder {name!r}, expected one of {DECODERS}")
+    if name in ("auto", "msgspec") and msgspec is not None:
+        return _msgspec_decoder()
+    if name in ("auto", "orjson") and orjson is not None:
+        return _dict_decoder(orjson.loads)
+    if name in ("auto", "json"):
+        return _dict_decoder(json.loads)
+    raise ValueError(f"Decoder {name!r} is not installed")
+
+
+# ============================================================
+# Batch decoders for aggTrade and depthUpdate frames
+#
+# The high-rate streams (event_streams.py) decode a whole batch of
+# frames per call: msgspec parses them as one newline-delimited
+# buffer straight into Structs; the dict backends loop over loads().
+# Frames that are not events of the kind (SUBSCRIBE acks, or anything
+# malformed) are skipped.
+#
+# Depth diffs carry most of their bytes in the bid/ask level arrays.
+# Decoding every level into a list of tuples costs an allocation per
+# level, and the garbage collector passes those trigger cost more
+# than the parsing. msgspec keeps the arrays as raw JSON instead:
+# level counts come from the commas of each array, and all prices and
+# quantities of the batch are parsed by one np.fromstring() call.
+# ============================================================
+
+EVENT_KINDS = ("aggTrade", "depth")
+_LEVEL_CHARS = bytes.maketrans(b";", b",")
+_EMPTY_FIELDS = re.compile(rb",{2,}")
+
+
+class AggTrade(NamedTuple):
+    symbol: str
+    agg_id: int
+    price: float
+    qty: float
+    first_id: int
+    last_id: int
+    trade_time: int  # ms
+    buyer_maker: bool
+    event_time: int  # ms
+
+
+class DepthUpdate(NamedTuple):
+    symbol: str
+    first_update_id: int
+    final_update_id: int
+    prev_update_id: int  # futures only, -1 on spot
+    event_time: int  # ms
+
+
+class DepthBatch(NamedTuple):
+    """Decoded depth diffs with their levels as columns: each event's bids, then its asks."""
+    events: list  # DepthUpdate-like records
+    bids: np.ndarray  # levels per event
+    asks: np.ndarray
+    levels: np.ndarray  # (2, n): price, qty
+
+
+def agg_trade_from_dict(d):
+    return AggTrade(d["s"], d["a"], float(d["p"]), float(d["q"]), d["f"], d["l"], d["T"], d["m"], d["E"])
+
+
+def _dict_batch_decoder(kind, loads):
+    event_type = "aggTrade" if kind == "aggTrade" else "depthUpdate"
+
+    def decode_data(frames):
+        out = []
+        for raw in frames:
+            try:
+                data = loads(raw).get("data")
+            except (ValueError, AttributeError):
+                continue
+            if isinstance(data, dict) and data.get("e") == event_type:
+                out.append(data)
+        return out
+
+    def decode_trades(frames):
+        events = []
+        for d in decode_data(frames):
+            try:
+                events.append(agg_trade_from_dict(d))
+            except (KeyError, TypeError, ValueError):
+                continue
+        return events
+
+    def decode_depth(frames):
+        events, bids, asks, levels = [], [], [], []
+        for d in decode_data(frames):
+            try:
+                event = DepthUpdate(d["s"], d["U"], d["u"], d.get("pu", -1), d["E"])
+                side = [(float(p), float(q)) for p, q in d["b"] + d["a"]]
+            except (KeyError, TypeError, ValueError):
+                continue
+            events.append(event)
+            bids.append(len(d["b"]))
+            asks.append(len(d["a"]))
+            levels += side
+        return DepthBatch(events, np.array(bids, dtype=np.int64), np.array(asks, dtype=np.int64),
+                          np.array(levels, dtype=np.float64).reshape(-1, 2).T.copy())
+
+    return decode_trades if kind == "aggTrade" else decode_depth
+
+
+if msgspec is not None:
+
+    class AggTradeStruct(msgspec.Struct, gc=False, rename={
+        "symbol": "s", "agg_id": "a", "price": "p", "qty": "q", "first_id": "f",
+        "last_id": "l", "trade_time": "T", "buyer_maker": "m", "event_time": "E",
+    }):
+        """Same fields as AggTrade."""
+        symbol: str
+        agg_id: int
+        price: float
+        qty: float
+        first_id: int
+        last_id: int
+        trade_time: int
+        buyer_maker: bool
+        event_time: int
+
+    class DepthStruct(msgspec.Struct, gc=False, rename={
+        "symbol": "s", "first_update_id": "U", "final_update_id": "u",
+        "prev_update_id": "pu", "event_time": "E", "bids": "b", "asks": "a",
+    }):
+        """DepthUpdate fields plus the level arrays as raw JSON."""
+        symbol: str
+        first_update_id: int
+        final_update_id: int
+        event_time: int
+        bids: msgspec.Raw
+        asks: msgspec.Raw
+        prev_update_id: int = -1
+
+    class _TradeFrame(msgspec.Struct, gc=False):
+        data: Optional[AggTradeStruct] = None
+
+    class _DepthFrame(msgspec.Struct, gc=False):
+        data: Optional[DepthStruct] = None
+
+    _FRAME_TYPES = {"aggTrade": _TradeFrame, "depth": _DepthFrame}
+
+    def _raw_levels(events):
+        """(bids, asks, levels) of DepthStructs, parsed from their raw level arrays."""
+        joined = b";".join([r for e in events for r in (e.bids, e.asks)])
+        chars = np.frombuffer(joined, dtype=np.uint8)
+        starts = np.concatenate(([0], np.flatnonzero(chars == ord(";")) + 1))
+        lengths = np.diff(np.append(starts, len(chars) + 1)) - 1
+        commas = np.add.reduceat((chars == ord(",")).astype(np.int64), starts)
+        # [["p","q"],["p","q"]] has 2n - 1 commas; "[]" has none
+        counts = np.where(lengths > 2, (commas + 1) // 2, 0)
+        text = _EMPTY_FIELDS.sub(b",", joined.translate(_LEVEL_CHARS, b'[]" ')).strip(b",")
+        values = np.fromstring(text, dtype=np.float64, sep=",") if text else np.empty(0)
+        if len(values) != 2 * counts.sum():
+            raise ValueError("unexpected depth level format")
+        return counts[0::2], counts[1::2], values.reshape(-1, 2).T.copy()
+
+    def _msgspec_batch_decoder(kind):
+        decoder = msgspec.json.Decoder(_FRAME_TYPES[kind], strict=False)
+        fallback = _dict_batch_decoder(kind, json.loads)
+
+        def decode_events(frames):
+            if not frames:
+                return []
+            sep = b"\n" if isinstance(frames[0], bytes) else "\n"
+            try:
+                decoded = decoder.decode_lines(sep.join(frames))
+            except msgspec.DecodeError:
+                # one bad frame fails the batch: decode the frames one by one
+                decoded = []
+                for raw in frames:
+                    try:
+                        decoded.append(decoder.decode(raw))
+                    except msgspec.DecodeError:
+                        continue
+            return [f.data for f in decoded if f.data is not None]
+
+        def decode_depth(frames):
+            events = decode_events(frames)
+            if not events:
+                return DepthBatch([], np.empty(0, np.int64), np.empty(0, np.int64), np.empty((2, 0)))
+            try:
+                return DepthBatch(events, *_raw_levels(events))
+            except ValueError:
+                return fallback(frames)
+
+        return decode_events if kind == "aggTrade" else decode_depth
+
+
+def make_event_decoder(kind, name="auto"):
+    """
+    Return decode(frames) for the named backend: a list of AggTrade-like
+    records for "aggTrade", a DepthBatch for "depth".
+    """
+    if kind not in EVENT_KINDS:
+        raise ValueError(f"Unknown event kind {kind!r}, expected one of {EVENT_KINDS}")
+    if name not in DECODERS:
+        raise ValueError(f"Unknown decoder {name!r}, expected one of {DECODERS}")
+    if name in ("auto", "msgspec") and msgspec is not None:
+        return _msgspec_batch_decoder(kind)
+    if name in ("auto", "orjson") and orjson is not None:
+        return _dict_batch_decoder(kind, orjson.loads)
+    if name in ("auto", "json"):
+        return _dict_batch_decoder(kind, json.loads)
+    raise ValueError(f"Decoder {name!r} is not installed")
@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import os
+import time
+import traceback
+import aiohttp
+import numpy as np
+import pandas as pd
+import future_stream
+import spot_stream
+from columnar import ms_to_datetime
+from decoders import EVENT_KINDS, make_event_decoder
+from ws_manager import StreamManager
+from spool import Spool, flush_or_spool, replay_loop
+from sinks import get_sink
+from schema import ensure_tables
+from metrics import EVENT_BATCH_SECONDS, EVENT_DROPPED, EVENT_FRAMES, EVENT_ROWS, serve
+
+# ============================================================
+# High-rate aggTrade and depth-diff streams
+#
+# The same symbol universes as the kline streams, on their own
+# connections (one StreamManager per kind):
+#   aggTrade -> <market>_trades  one row per aggregated trade
+#   depth    -> <market>_depth   one row per changed price level of a
+#                                @depth@100ms diff (qty 0 removes it)
+# These run at 10-100x the kline message rate, so nothing is decoded
+# per message on the event loop: the socket handler only appends the
+# raw frame to a list. Every FLUSH_INTERVAL the list is swapped out
+# and a worker thread decodes the whole batch in one call (see
+# decoders.py), builds typed column arrays, and writes them with one
+# dataframe() call and one flush. One batch is in flight at a time;
+# if writing falls behind by MAX_FRAMES frames, new frames are
+# dropped and counted instead of growing memory.
+#
+#   python event_streams.py futures [aggTrade depth]
+#   python bench_events.py    # replayed-load benchmark
+# ============================================================
+
+MARKETS = {"futures": future_stream, "spot": spot_stream}
+STREAM_SUFFIX = {"aggTrade": "@aggTrade", "depth": "@depth@100ms"}
+TABLE_SUFFIX = {"aggTrade": "trades", "depth": "depth"}
+DECODER = "auto"  # "msgspec", "orjson" or "json" (see decoders.py)
+FLUSH_INTERVAL = 0.25  # seconds between batches
+MAX_FRAMES = 500_000  # frames waiting for the writer before new ones are dropped
+SPOOL_DIR = "spool/events"  # batches that could not reach QuestDB, per table below it
+METRICS_PORT = 9500
+CONNECT_KWARGS = {"timeout": 10, "headers": {"User-Agent": "Mozilla/5.0"}}
+
+
+def table_name(market, kind):
+    return f"{market}_{TABLE_SUFFIX[kind]}"
+
+
+# ============================================================
+# Columns
+# ============================================================
+def trades_frame(events):
+    """Decoded aggTrades as a DataFrame in the <market>_trades layout."""
+    if not events:
+        return pd.DataFrame()
+    categories = {}
+    # one pass over the records, one C-level conversion; ids and ms
+    # timestamps are exact in float64
+    a = np.array([
+        (categories.setdefault(e.symbol, len(categories)), e.agg_id, e.price, e.qty,
+         e.first_id, e.last_id, e.buyer_maker, e.event_time, e.trade_time)
+        for e in events
+    ], dtype=np.float64).T.copy()  # (9, n), each column contiguous
+    return pd.DataFrame({
+        "symbol": pd.Categorical.from_codes(a[0].astype(np.int32), categories=list(categories)),
+        "agg_id": a[1].astype(np.int64),
+        "price": a[2],
+        "qty": a[3],
+        "first_id": a[4].astype(np.int64),
+        "last_id": a[5].astype(np.int64),
+        "buyer_maker": a[6].astype(bool),
+        "event_time": ms_to_datetime(a[7]),
+        "timestamp": ms_to_datetime(a[8]),
+    }, copy=False)
+
+
+def depth_frame(batch):
+    """A decoded DepthBatch as a DataFrame in the <market>_depth layout, one row per level."""
+    events = batch.events
+    if not batch.levels.shape[1]:
+        return pd.DataFrame()
+    categories = {}
+    h = np.array([
+        (categories.setdefault(e.symbol, len(categories)), e.first_update_id,
+         e.final_update_id, e.prev_update_id, e.event_time)
+        for e in events
+    ], dtype=np.int64).T
+    # each event's bids, then its asks
+    event = np.repeat(np.arange(len(events)), batch.bids + batch.asks)
+    sides = np.repeat(np.tile(np.array([0, 1], dtype=np.int8), len(events)),
+                      np.column_stack((batch.bids, batch.asks)).ravel())
+    return pd.DataFrame({
+        "symbol": pd.Categorical.from_codes(h[0][event].astype(np.int32), categories=list(categories)),
+        "side": pd.Categorical.from_codes(sides, categories=["bid", "ask"]),
+        "price": batch.levels[0],
+        "qty": batch.levels[1],
+        "first_update_id": h[1][event],
+        "final_update_id": h[2][event],
+        "prev_update_id": h[3][event],
+        "timestamp": ms_to_datetime(h[4][event]),
+    }, copy=False)
+
+
+FRAME_BUILDERS = {
+    "aggTrade": (trades_frame, ["symbol"]),
+    "depth": (depth_frame, ["symbol", "side"]),
+}
+
+
+# ============================================================
+# Batch writer
+# ============================================================
+class EventWriter:
+    """Collects raw frames of one kind and writes them as columnar batches."""
+
+    def __init__(self, kind, table, sink, spool=None, decoder=DECODER,
+                 flush_interval=FLUSH_INTERVAL, max_frames=MAX_FRAMES):
+        self.table = table
+        self.sink = sink
+        self.spool = spool
+        self.decode = make_event_decoder(kind, decoder)
+        self.build, self.symbols = FRAME_BUILDERS[kind]
+        self.flush_interval = flush_interval
+        self.max_frames = max_frames
+        self.frames = []
+        self.received = EVENT_FRAMES.labels(table)
+        self.rows = EVENT_ROWS.labels(table)
+        self.dropped = EVENT_DROPPED.labels(table)
+        self.batch_seconds = EVENT_BATCH_SECONDS.labels(table)
+
+    def put(self, raw):
+        """Queue one raw frame; returns False (and counts a drop) if the writer is too far behind."""
+        if len(self.frames) >= self.max_frames:
+            self.dropped.inc()
+            return False
+        self.frames.append(raw)
+        return True
+
+    def write(self, frames):
+        """Decode, serialize and flush one batch; returns the number of rows."""
+        started = time.monotonic()
+        df = self.build(self.decode(frames))
+        if len(df):
+            buf = self.sink.new_buffer()
+            buf.dataframe(df, table_name=self.table, symbols=self.symbols, at="timestamp")
+            flush_or_spool(self.sink, buf, self.spool)
+        self.received.inc(len(frames))
+        self.rows.inc(len(df))
+        self.batch_seconds.observe(time.monotonic() - started)
+        return len(df)
+
+    def _write_logged(self, frames):
+        try:
+            self.write(frames)
+        except Exception:
+            print(f"[SINK] {self.table}: batch failed, {len(frames)} frames lost:")
+            traceback.print_exc()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                frames, self.frames = self.frames, []
+                if frames:
+                    # off the loop, so frames keep arriving meanwhile
+                    await loop.run_in_executor(None, self._write_logged, frames)
+        finally:
+            frames, self.frames = self.frames, []
+            if frames:
+                self._write_logged(frames)
+
+
+# ============================================================
+# Streams
+# ============================================================
+def stream_namer(kind):
+    suffix = STREAM_SUFFIX[kind]
+
+    def stream_name(symbol):
+        return symbol.lower() + suffix
+    return stream_name
+
+
+async def run_event_streams(market, kinds, symbols, symbol_updates, spool_dir=SPOOL_DIR):
+    """
+    Stream `kinds` of every symbol of `market` into <market>_trades and
+    <market>_depth. Each list yielded by `symbol_updates` replaces the
+    subscribed set of every kind.
+    """
+    module = MARKETS[market]
+    sink = get_sink()
+    writers = {}
+    background = []
+    for kind in kinds:
+        table = table_name(market, kind)
+        spool = Spool(os.path.join(spool_dir, table))
+        writers[kind] = EventWriter(kind, table, sink, spool=spool)
+        background += [
+            asyncio.create_task(writers[kind].run()),
+            asyncio.create_task(replay_loop(spool, sink.replay_url)),
+        ]
+
+    async with aiohttp.ClientSession() as session:
+        managers = [
+            StreamManager(session, module.WS_URL, stream_namer(kind), writers[kind].put,
+                          connect_kwargs=CONNECT_KWARGS)
+            for kind in kinds
+        ]
+        for manager in managers:
+            await manager.set_symbols(symbols)
+
+        async def follow_updates():
+            async for new_symbols in symbol_updates:
+                for manager in managers:
+                    await manager.set_symbols(new_symbols)
+
+        await asyncio.gather(*background, follow_updates())
+
+
+async def start(market, kinds):
+    serve(METRICS_PORT)
+    for kind in kinds:
+        layout = TABLE_SUFFIX[kind]
+        await asyncio.to_thread(ensure_tables, [table_name(market, kind)], layout)
+    module = MARKETS[market]
+    symbols = await asyncio.to_thread(module.load_symbols)
+    print(f"[SYS] {market}: {', '.join(kinds)} for {len(symbols)} symbols")
+    await run_event_streams(market, kinds, symbols, module.exchange_info_updates())
+
+
+# ============================================================
+# MAIN
+# ============================================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream aggTrade / depth diffs into QuestDB")
+    parser.add_argument("market", choices=sorted(MARKETS))
+    parser.add_argument("kinds", nargs="*", default=list(EVENT_KINDS), choices=EVENT_KINDS)
+    args = parser.parse_args()
+    print(f"=== Binance {args.market} {' + '.join(args.kinds)} → QuestDB ===")
+    try:
+        asyncio.run(start(args.market, args.kinds))
+    except KeyboardInterrupt:
+        print("\n[SYS] Shutting down...")
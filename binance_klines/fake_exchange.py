@@ -0,0 +1,436 @@
+import asyncio
+import json
+import math
+import multiprocessing as mp
+import os
+import queue
+import re
+import time
+import zlib
+import aiohttp
+import requests
+from aiohttp import web
+from capture import SEGMENT_SUFFIX, capture_files, read_frames
+from rate_limit import USED_WEIGHT_HEADER, klines_weight
+from rollups import INTERVAL_MS
+
+# ============================================================
+# Local stand-ins for Binance and QuestDB (benchmarks only)
+#
+# Each runs as an aiohttp app in its own process, so neither competes
+# for CPU with the client being measured:
+#   FakeBinance
+#     /api/v3/klines, /fapi/v1/klines   synthetic, deterministic klines
+#                                       with Binance's per-minute weight
+#                                       accounting, 429s and Retry-After
+#     /api/v3/exchangeInfo, /fapi/...   every configured symbol trading
+#     /stream                           combined-stream WebSocket: honours
+#                                       SUBSCRIBE/UNSUBSCRIBE and pushes
+#                                       synthetic or recorded kline frames
+#                                       (e.g. a capture) at a target rate
+#   FakeQuestDB
+#     /write, /settings                 ILP-over-HTTP sink that parses,
+#                                       validates and counts every row
+# Both serve /_stats and /_reset for the benchmark. Every
+# LATENCY_SAMPLE-th frame is passed to the sink with its send time;
+# the sink matches it to its row by (symbol, open time, trades),
+# which gives frame sent -> row acked latency.
+# Kline payloads repeat every PERIOD minutes per symbol and are built
+# from cached fragments, so the fakes stay well ahead of the client.
+# ============================================================
+
+SYMBOLS = 50
+LISTED_FROM = 1_672_531_200_000  # 2023-01-01, first kline of every symbol
+WEIGHT_LIMIT = 1_000_000  # per minute; lower it to exercise pacing and 429s
+FRAME_RATE = 20_000  # frames/s per WebSocket connection
+UPDATES_PER_CANDLE = 20  # synthetic frames per kline before it closes
+LATENCY_SAMPLE = 10
+TICK = 0.01  # WebSocket send pacing granularity
+PERIOD = 1200  # minutes after which a symbol's synthetic values repeat
+
+REQUIRED_FIELDS = (
+    "open", "high", "low", "close", "volume", "close_time", "quote_volume",
+    "trades", "taker_base_volume", "taker_quote_volume",
+)
+KLINE_PATHS = {"/api/v3/klines": ("spot", 1000), "/fapi/v1/klines": ("futures", 1500)}
+EVENT_TIME = re.compile(rb'"E":\d+')
+
+
+def symbol_names(n):
+    return [f"SYM{i:04d}USDT" for i in range(n)]
+
+
+def percentiles(values, points=(50, 99)):
+    """{p: value} by nearest rank; empty dict without values."""
+    if not values:
+        return {}
+    values = sorted(values)
+    return {p: values[min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1)] for p in points}
+
+
+def make_kline(open_time, interval_ms, seed):
+    """One REST kline array; values depend on the symbol seed and open_time % PERIOD minutes."""
+    step = open_time // 60_000 % PERIOD
+    price = 100 + seed % 900 + (step % 240) * 0.01
+    volume = (step * 7919 + seed) % 200_000 + 0.5
+    return [
+        open_time,
+        f"{price:.2f}",
+        f"{price + 1:.2f}",
+        f"{price - 1:.2f}",
+        f"{price + 0.5:.2f}",
+        f"{volume:.3f}",
+        open_time + interval_ms - 1,
+        f"{volume * price:.4f}",
+        step,
+        f"{volume / 2:.3f}",
+        f"{volume * price / 2:.4f}",
+        "0",
+    ]
+
+
+def _fragments(seed):
+    """Per minute of the period: REST row head and tail, WS price and volume fields."""
+    fragments = []
+    for step in range(PERIOD):
+        k = make_kline(step * 60_000, 0, seed)
+        fragments.append((
+            f'"{k[1]}","{k[2]}","{k[3]}","{k[4]}","{k[5]}"',
+            f'"{k[7]}",{k[8]},"{k[9]}","{k[10]}","0"',
+            f'"o":"{k[1]}","c":"{k[4]}","h":"{k[2]}","l":"{k[3]}","v":"{k[5]}"',
+            f'"q":"{k[7]}","V":"{k[9]}","Q":"{k[10]}","B":"0"',
+        ))
+    return fragments
+
+
+def _json_text(text, status=200, headers=None):
+    return web.Response(text=text, status=status, headers=headers, content_type="application/json")
+
+
+# ============================================================
+# Binance
+# ============================================================
+class FakeBinance:
+
+    def __init__(self, samples, symbols=SYMBOLS, listed_from=LISTED_FROM,
+                 weight_limit=WEIGHT_LIMIT, frame_rate=FRAME_RATE, frames_path=None):
+        self.samples = samples  # (key, sent_at) batches for the sink
+        self.symbols = symbol_names(symbols)
+        self.seeds = {s: zlib.crc32(s.encode()) for s in self.symbols}
+        self.fragments = {}
+        self.listed_from = listed_from
+        self.weight_limit = weight_limit
+        self.frame_rate = frame_rate
+        self.recorded = self._load_frames(frames_path) if frames_path else None
+        self.reset()
+
+    @staticmethod
+    def _load_frames(path):
+        """Raw frames from a capture (see capture.py) or a file with one frame per line."""
+        if os.path.isdir(path) or path.endswith(SEGMENT_SUFFIX):
+            return [raw.encode() for _, raw in read_frames(capture_files(path))]
+        with open(path, "rb") as f:
+            return [line.strip() for line in f if line.strip()]
+
+    def _symbol_fragments(self, symbol):
+        if symbol not in self.fragments:
+            self.fragments[symbol] = _fragments(zlib.crc32(symbol.encode()))
+        return self.fragments[symbol]
+
+    def reset(self):
+        self.minute = None
+        self.used_weight = 0
+        self.stats = {
+            "kline_requests": 0, "kline_rows": 0, "rate_limited": 0, "weight_used": 0,
+            "frames_sent": 0,
+        }
+
+    # ---------------- REST ----------------
+    def _spend(self, weight):
+        minute = int(time.time() // 60)
+        if minute != self.minute:
+            self.minute, self.used_weight = minute, 0
+        self.used_weight += weight
+        self.stats["weight_used"] += weight
+        return self.used_weight <= self.weight_limit
+
+    async def klines(self, request):
+        market, max_limit = KLINE_PATHS[request.path]
+        q = request.query
+        limit = min(int(q.get("limit", 500)), max_limit)
+        ok = self._spend(klines_weight(market, limit))
+        headers = {USED_WEIGHT_HEADER: str(self.used_weight)}
+        if not ok:
+            self.stats["rate_limited"] += 1
+            headers["Retry-After"] = str(math.ceil(60 - time.time() % 60))
+            return _json_text('{"code":-1003,"msg":"Too many requests"}', 429, headers)
+        symbol = q.get("symbol")
+        if symbol not in self.seeds or q.get("interval") not in INTERVAL_MS:
+            return _json_text('{"code":-1121,"msg":"Invalid symbol."}', 400, headers)
+
+        ms = INTERVAL_MS[q["interval"]]
+        end = int(q["endTime"]) if "endTime" in q else int(time.time() * 1000)
+        start = int(q["startTime"]) if "startTime" in q else end - limit * ms
+        if start > end:
+            return _json_text('{"code":-1023,"msg":"Start time is greater than end time."}',
+                              400, headers)
+        first = max(start + (-start) % ms, self.listed_from)
+        fragments = self._symbol_fragments(symbol)
+        rows = []
+        for t in range(first, end + 1, ms)[:limit]:
+            head, tail, _, _ = fragments[t // 60_000 % PERIOD]
+            rows.append(f"[{t},{head},{t + ms - 1},{tail}]")
+        self.stats["kline_requests"] += 1
+        self.stats["kline_rows"] += len(rows)
+        return _json_text("[" + ",".join(rows) + "]", headers=headers)
+
+    async def exchange_info(self, request):
+        futures = request.path.startswith("/fapi")
+        symbols = []
+        for s in self.symbols:
+            info = {"symbol": s, "status": "TRADING", "baseAsset": s[:-4], "quoteAsset": "USDT"}
+            if futures:
+                info.update(contractType="PERPETUAL", onboardDate=self.listed_from)
+            symbols.append(info)
+        return web.json_response({"symbols": symbols}, headers={"ETag": '"fake"'})
+
+    # ---------------- WebSocket ----------------
+    def _synthetic_frame(self, stream, seq, now_ms):
+        symbol = stream.split("@", 1)[0].upper()
+        interval = stream.rsplit("_", 1)[1]
+        ms = INTERVAL_MS[interval]
+        open_time = self.listed_from + (seq // UPDATES_PER_CANDLE) * ms
+        trades = seq % UPDATES_PER_CANDLE + 1
+        _, _, prices, volumes = self._symbol_fragments(symbol)[open_time // 60_000 % PERIOD]
+        frame = (
+            f'{{"stream":"{stream}","data":{{"e":"kline","E":{now_ms},"s":"{symbol}","k":{{'
+            f'"t":{open_time},"T":{open_time + ms - 1},"s":"{symbol}","i":"{interval}",'
+            f'"f":0,"L":0,{prices},"n":{trades},'
+            f'"x":{"true" if trades == UPDATES_PER_CANDLE else "false"},{volumes}}}}}}}'
+        )
+        return frame, (symbol, open_time, trades)
+
+    def _recorded_frame(self, pos, now_ms, subscribed, sample):
+        """The next recorded frame of a subscribed stream, restamped with the send time."""
+        for _ in range(len(self.recorded)):
+            raw = self.recorded[pos[0] % len(self.recorded)]
+            pos[0] += 1
+            data = json.loads(raw)
+            if data.get("stream") in subscribed:
+                break
+        else:
+            return None, None
+        # restamp so event lag stays meaningful
+        frame = EVENT_TIME.sub(b'"E":%d' % now_ms, raw).decode()
+        k = data.get("data", {}).get("k") if sample else None
+        return frame, k and (k["s"], k["t"], k["n"])
+
+    async def stream(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        subscribed = []
+        pusher = asyncio.create_task(self._push(ws, subscribed))
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                command = json.loads(msg.data)
+                params = command.get("params", [])
+                if command.get("method") == "SUBSCRIBE":
+                    subscribed.extend(p for p in params if p not in subscribed)
+                elif command.get("method") == "UNSUBSCRIBE":
+                    subscribed[:] = [p for p in subscribed if p not in params]
+                await ws.send_str(json.dumps({"result": None, "id": command.get("id")}))
+        finally:
+            pusher.cancel()
+        return ws
+
+    async def _push(self, ws, subscribed):
+        seqs = {}
+        pos = [0]
+        owed = 0.0
+        while not ws.closed:
+            await asyncio.sleep(TICK)
+            if not subscribed:
+                continue
+            owed += self.frame_rate * TICK
+            sent_at = time.time()
+            now_ms = int(sent_at * 1000)
+            sampled = []
+            for _ in range(int(owed)):
+                n = self.stats["frames_sent"]
+                if self.recorded is None:
+                    stream = subscribed[n % len(subscribed)]
+                    seq = seqs.get(stream, 0)
+                    seqs[stream] = seq + 1
+                    frame, key = self._synthetic_frame(stream, seq, now_ms)
+                else:
+                    frame, key = self._recorded_frame(pos, now_ms, subscribed,
+                                                      n % LATENCY_SAMPLE == 0)
+                    if frame is None:
+                        break
+                if key and n % LATENCY_SAMPLE == 0:
+                    sampled.append((key, sent_at))
+                await ws.send_str(frame)
+                self.stats["frames_sent"] += 1
+            owed -= int(owed)
+            if sampled:
+                self.samples.put(sampled)
+
+    # ---------------- Control ----------------
+    async def get_stats(self, request):
+        return web.json_response(self.stats)
+
+    async def post_reset(self, request):
+        self.reset()
+        return web.json_response({})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/api/v3/klines", self.klines)
+        app.router.add_get("/fapi/v1/klines", self.klines)
+        app.router.add_get("/api/v3/exchangeInfo", self.exchange_info)
+        app.router.add_get("/fapi/v1/exchangeInfo", self.exchange_info)
+        app.router.add_get("/stream", self.stream)
+        app.router.add_get("/_stats", self.get_stats)
+        app.router.add_post("/_reset", self.post_reset)
+        return app
+
+
+# ============================================================
+# QuestDB
+# ============================================================
+def parse_ilp_line(line):
+    """(table, {tag: value}, {field: raw value}, timestamp) of one ILP text line."""
+    parts = line.rsplit(" ", 2)
+    if len(parts) != 3:
+        raise ValueError("expected '<table,tags> <fields> <timestamp>'")
+    head, fields, ts = parts
+    table, *tags = head.split(",")
+    tags = dict(t.split("=", 1) for t in tags)
+    fields = dict(f.split("=", 1) for f in fields.split(","))
+    return table, tags, fields, int(ts)
+
+
+class FakeQuestDB:
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.reset()
+
+    def reset(self):
+        self.stats = {
+            "write_requests": 0, "write_bytes": 0, "rows": 0, "rows_by_table": {},
+            "invalid_rows": 0, "errors": [],
+        }
+        self.sent = {}  # (symbol, open_time, trades) -> send time
+        self.latencies = []
+        self._collect_samples()
+        self.sent.clear()
+
+    def _collect_samples(self):
+        try:
+            while True:
+                self.sent.update(self.samples.get_nowait())
+        except queue.Empty:
+            pass
+
+    def _check(self, tags, fields):
+        """Validate one parsed row; returns its trades count."""
+        missing = [f for f in REQUIRED_FIELDS if f not in fields]
+        if missing or "symbol" not in tags or "interval" not in tags:
+            raise ValueError(f"missing {missing or 'symbol/interval tags'}")
+        if not fields["trades"].endswith("i") or not fields["close_time"].endswith("t"):
+            raise ValueError("trades/close_time have the wrong type")
+        low, high = float(fields["low"]), float(fields["high"])
+        if not low <= float(fields["open"]) <= high or not low <= float(fields["close"]) <= high:
+            raise ValueError("open/close outside [low, high]")
+        return int(fields["trades"][:-1])
+
+    async def settings(self, request):
+        # text ILP only, so the sink can parse what it receives
+        return web.json_response({"config": {"line.proto.support.versions": [1]}})
+
+    async def write(self, request):
+        body = await request.read()
+        acked = time.time()
+        self._collect_samples()
+        stats = self.stats
+        stats["write_requests"] += 1
+        stats["write_bytes"] += len(body)
+        by_table = stats["rows_by_table"]
+        for line in body.decode().splitlines():
+            if not line:
+                continue
+            try:
+                table, tags, fields, ts = parse_ilp_line(line)
+                trades = self._check(tags, fields)
+            except ValueError as e:
+                stats["invalid_rows"] += 1
+                if len(stats["errors"]) < 5:
+                    stats["errors"].append(f"{e}: {line[:200]}")
+                continue
+            stats["rows"] += 1
+            by_table[table] = by_table.get(table, 0) + 1
+            if self.sent:
+                sent_at = self.sent.pop((tags["symbol"], ts // 1_000_000, trades), None)
+                if sent_at is not None:
+                    self.latencies.append(acked - sent_at)
+        return web.Response(status=204)
+
+    async def get_stats(self, request):
+        return web.json_response(dict(self.stats, latency=percentiles(self.latencies),
+                                      latency_samples=len(self.latencies)))
+
+    async def post_reset(self, request):
+        self.reset()
+        return web.json_response({})
+
+    def app(self):
+        app = web.Application(client_max_size=256 * 1024 * 1024)
+        app.router.add_get("/settings", self.settings)
+        app.router.add_post("/write", self.write)
+        app.router.add_get("/_stats", self.get_stats)
+        app.router.add_post("/_reset", self.post_reset)
+        return app
+
+
+# ============================================================
+# Processes
+# ============================================================
+def _serve(kind, port, samples, options):
+    fake = FakeBinance(samples, **options) if kind == "binance" else FakeQuestDB(samples)
+    web.run_app(fake.app(), host="127.0.0.1", port=port, print=None)
+
+
+def start(binance_port, questdb_port, **options):
+    """
+    Start FakeBinance (with options) and FakeQuestDB in child processes;
+    returns the processes once both answer.
+    """
+    ctx = mp.get_context("spawn")
+    samples = ctx.Queue()
+    procs = [
+        ctx.Process(target=_serve, args=("binance", binance_port, samples, options), daemon=True),
+        ctx.Process(target=_serve, args=("questdb", questdb_port, samples, {}), daemon=True),
+    ]
+    for proc in procs:
+        proc.start()
+    for port in (binance_port, questdb_port):
+        for _ in range(100):
+            try:
+                requests.get(f"http://127.0.0.1:{port}/_stats", timeout=1)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        else:
+            for proc in procs:
+                proc.terminate()
+            raise RuntimeError(f"Fake server did not start on port {port}")
+    return procs
+
+
+if __name__ == "__main__":
+    print("=== Fake Binance on :8765, fake QuestDB on :8766 ===")
+    for proc in start(8765, 8766):
+        proc.join()
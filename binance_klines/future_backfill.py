@@ -1,184 +1,219 @@
-import time
-import datetime
-import json
-import os
-import socket
-import pytz
+import threading
 import requests
-from utils import future_fetch_klines, get_futures_symbols
-from questdb.ingress import Sender, TimestampNanos
-
-QUEST_HOST = "82.29.166.107"
-QUEST_PORT = 9000
-conf = f"http::addr={QUEST_HOST}:{QUEST_PORT};"
+import config
+from utils import future_fetch_klines
+from symbol_registry import get_registry
+from columnar import KlineFrameBuffer, ingest_frame
+from rollups import FrameRollup
+from checkpoint import CheckpointStore
+from questdb_query import latest_timestamps
+from spool import Spool, flush_or_spool
+from sinks import get_sink
+from archive_import import import_archives
+from listing import first_kline_times
+from backfill_engine import PageTuner, make_jobs, run_backfill, window_span
+from rate_limit import best_klines_limit, shared_limiter
+from schema import ensure_kline_tables
+from metrics import serve
+
+QUEST_HOST = config.get("questdb", "host")
+QUEST_PORT = config.get("questdb", "port")
 
 INTERVAL = "1m"
 
-timezone = pytz.timezone("Etc/UTC")
-utc_from = datetime.datetime(2023, 1, 1, tzinfo=timezone)
-utc_to = datetime.datetime(2024, 12, 31, 23, 59, 59, tzinfo=timezone)
-
-DATE_FROM = int(utc_from.timestamp() * 1000)
-DATE_TO   = int(utc_to.timestamp() * 1000)
-
-PROGRESS_FILE = "future_progress.json"
-BATCH_LIMIT = 500
-REQUEST_DELAY = 0.5  # seconds between requests
+# [futures] date_from / date_to in the config (UTC)
+DATE_FROM = config.date_ms("futures", "date_from")
+DATE_TO   = config.date_ms("futures", "date_to")
+
+# "checkpoint": resume from the local range store
+# "questdb":    resume each symbol from max(timestamp) in the table itself
+RESUME_MODE = "checkpoint"
+TABLE = "binance_futures_klines"
+MARKET = "futures"
+BATCH_LIMIT = best_klines_limit(MARKET)  # most rows per request weight; backfills tune it live
+WORKERS = 8  # concurrent fetch threads
+# monthly/daily archive files (mirror URL or local directory), None for REST only
+ARCHIVE_SOURCE = "https://data.binance.vision"
+ROLLUP_INTERVALS = ("5m", "15m", "1h", "1d")  # bars built from the 1m rows, () for none
+SPOOL_DIR = "spool/futures_backfill"  # batches that could not reach QuestDB
+METRICS_PORT = 9300  # Prometheus endpoint (rows, flushes, REST weight and 429s)
 VOLUME_THRESHOLD = 50000  # base volume > 50k
 
 # -------------------------------
 # Helper Functions
 # -------------------------------
 
-def ingest_batch(sender, rows, symbol):
-    ingested_count = 0
-    skipped_count = 0
-    for r in rows:
-        open_time = r[0]
-        if open_time < DATE_FROM or open_time > DATE_TO:
-            continue
+def ingest_batch(buf, frames):
+    """Write the pages collected since the last flush as one frame."""
+    ingested_count, skipped_count = frames.write(buf)
+    print(f"Batch processed: {ingested_count} ingested, {skipped_count} skipped")
 
-        volume = float(r[5])
-        if volume <= VOLUME_THRESHOLD:  # filter: only store volume > 50,000
-            skipped_count += 1
-            continue
+# -------------------------------
+# Fetch with retry (safe)
+# -------------------------------
 
-        sender.row(
-            "binance_futures_klines",
-            symbols={
-                "symbol": symbol,
-                "interval": INTERVAL
-            },
-            columns={
-                "open": float(r[1]),
-                "high": float(r[2]),
-                "low": float(r[3]),
-                "close": float(r[4]),
-                "volume": volume,
-                "close_time": TimestampNanos(int(r[6] * 1_000_000)),
-                "quote_volume": float(r[7]),
-                "trades": int(r[8]),
-                "taker_base_volume": float(r[9]),
-                "taker_quote_volume": float(r[10]),
-            },
-            at=TimestampNanos(int(open_time * 1_000_000)),
+def fetch_with_retry(symbol, interval, start_time, end_time, limit=BATCH_LIMIT, max_retries=5, limiter=None):
+    """
+    One klines page; network errors and rate limits are retried by the HTTP
+    client. Other errors, e.g. a 400, raise: run_backfill then counts the
+    window as failed and nothing of it is checkpointed, so the next run
+    retries it.
+    """
+    try:
+        return future_fetch_klines(
+            symbol, interval, start_time, end_time, limit=limit, limiter=limiter, max_retries=max_retries
         )
-        ingested_count += 1
-    print(f"[{symbol}] Batch processed: {ingested_count} ingested, {skipped_count} skipped")
-
-def load_progress():
-    if not os.path.exists(PROGRESS_FILE):
-        return None, None
-    with open(PROGRESS_FILE, "r") as f:
-        data = json.load(f)
-        return data.get("symbol"), data.get("timestamp")
-
-def save_progress(symbol, timestamp):
-    with open(PROGRESS_FILE, "w") as f:
-        json.dump({"symbol": symbol, "timestamp": timestamp}, f)
+    except requests.exceptions.HTTPError as e:
+        if e.response.status_code == 400:
+            print(f"[{symbol}] Bad Request (400) for {start_time}-{end_time}: {e.response.text}")
+        raise
 
 # -------------------------------
-# Fetch with retry (safe)
+# Resume planning
 # -------------------------------
 
-def fetch_with_retry(symbol, interval, start_time, end_time, limit=BATCH_LIMIT, max_retries=5):
-    BINANCE_FAPI = "https://fapi.binance.com"
-    params = {
-        "symbol": symbol,
-        "interval": interval,
-        "startTime": start_time,
-        "endTime": end_time,
-        "limit": limit
-    }
+def plan_from_checkpoints(store, starts, date_to=DATE_TO):
+    """Fetch plan made of each symbol's ranges missing from the store."""
+    plan = []
+    for symbol, symbol_start in starts.items():
+        missing = store.missing(MARKET, symbol, INTERVAL, symbol_start, date_to)
+        if not missing:
+            print(f"[{symbol}] skipped (already completed)")
+        plan.extend((symbol, start, end) for start, end in missing)
+    return plan
+
+
+def plan_from_questdb(starts, date_to=DATE_TO):
+    """Fetch plan starting every symbol after its latest row in QuestDB."""
+    latest = latest_timestamps(QUEST_HOST, QUEST_PORT, TABLE, INTERVAL)
+    print(f"Resuming from QuestDB: {len(latest)} symbols already have data")
+    plan = []
+    for symbol, symbol_start in starts.items():
+        start_time = max(latest.get(symbol, DATE_FROM - 1) + 1, symbol_start)
+        if start_time > date_to:
+            print(f"[{symbol}] skipped (already completed)")
+            continue
+        plan.append((symbol, start_time, date_to))
+    return plan
+
+
+def plan_backfill(store, starts, date_to=DATE_TO, failed_archives=()):
+    """
+    (plan, window_ms) for make_jobs(): resume from the store, or without
+    one from QuestDB. Archives that failed to import lie below the latest
+    row there, so in that mode their ranges are fetched first; no later
+    run would.
+    """
+    if store is None:
+        plan = list(failed_archives) + plan_from_questdb(starts, date_to)
+        # one window per symbol keeps max(timestamp) an exact resume point
+        return plan, date_to - DATE_FROM + 1
+    # failed archives were never recorded, so the store has them as missing
+    plan = plan_from_checkpoints(store, starts, date_to)
+    # whole pages, several windows per worker (see window_span)
+    return plan, window_span(plan, BATCH_LIMIT, WORKERS)
 
-    for attempt in range(max_retries):
-        try:
-            # Force IPv4 to avoid Windows DNS issues
-            socket.getaddrinfo = lambda host, port, *args, **kwargs: [
-                (socket.AF_INET, socket.SOCK_STREAM, 6, '', (host, port))
-            ]
-
-            r = requests.get(BINANCE_FAPI + "/fapi/v1/klines", params=params, timeout=10)
-            r.raise_for_status()
-            return r.json()
-
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 429:
-                wait = 2 ** attempt
-                print(f"[{symbol}] Rate limited (429). Waiting {wait}s before retry...")
-                time.sleep(wait)
-            elif e.response.status_code == 400:
-                print(f"[{symbol}] Bad Request (400). Likely startTime > endTime. Skipping batch.")
-                return []
-            else:
-                raise
-
-        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, socket.gaierror) as e:
-            wait = 2 ** attempt
-            print(f"[{symbol}] Network/DNS error: {e}. Retrying in {wait}s...")
-            time.sleep(wait)
-
-    raise Exception(f"[{symbol}] Failed after {max_retries} retries due to network/DNS errors")
 
 # -------------------------------
 # Main backfill loop
 # -------------------------------
 
-def futures_backfill_all():
-    symbols = get_futures_symbols()
+def futures_backfill_all(date_to=DATE_TO, hand_over=None):
+    """
+    Backfill every symbol up to `date_to` (ms). hand_over, if given, is
+    called with the rollup bars of buckets that continue past date_to
+    (a live stream completes those, see main.py) and returns the ones
+    it does not take, which are written here as usual.
+    """
+    ensure_kline_tables([TABLE], QUEST_HOST, QUEST_PORT)
+    sink = get_sink()
+    spool = Spool(SPOOL_DIR)
+    url = sink.replay_url
+    # leftovers from an earlier run go first, so resume points see them
+    spool.replay(url)
+
+    # every perpetual, including settled ones, still has history to load
+    symbols = get_registry(MARKET).symbols(status=None, contract_type="PERPETUAL")
     print(f"Found {len(symbols)} futures markets")
 
-    last_symbol, last_timestamp = load_progress()
-    start_resuming = False if last_symbol else True
-    batch_counter = 0
-
-    with Sender.from_conf(conf) as sender:
-        for symbol in symbols:
-            if not start_resuming:
-                if symbol == last_symbol:
-                    start_resuming = True
-                    start_time = last_timestamp
-                else:
-                    print(f"[{symbol}] skipped (already completed)")
-                    continue
-            else:
-                start_time = DATE_FROM
-
-            print(f"[{symbol}] RESUME start_time={start_time}")
-
-            while start_time <= DATE_TO:
-                rows = fetch_with_retry(
-                    symbol,
-                    INTERVAL,
-                    start_time=start_time,
-                    end_time=DATE_TO,
-                    limit=BATCH_LIMIT
-                )
-
-                if not rows:
-                    break
+    limiter = shared_limiter(MARKET)
 
-                ingest_batch(sender, rows, symbol)
-                batch_counter += 1
+    def fetch_page(symbol, start_time, end_time, limit):
+        return fetch_with_retry(symbol, INTERVAL, start_time, end_time, limit=limit, limiter=limiter)
 
-                save_progress(symbol, rows[-1][0])
-
-                if batch_counter % 20 == 0:
-                    sender.flush()
-
-                if len(rows) < BATCH_LIMIT:
-                    break
+    # clamp every symbol to its first kline; symbols without any are skipped
+    first = first_kline_times(MARKET, symbols, INTERVAL, fetch_page, get_registry(MARKET))
+    starts = {
+        symbol: max(DATE_FROM, first[symbol])
+        for symbol in symbols
+        if first[symbol] is not None and first[symbol] <= date_to
+    }
+    print(f"{len(starts)} symbols have klines in range")
+
+    store = None if RESUME_MODE == "questdb" else CheckpointStore()
+    # shared by the archive import and the REST backfill
+    rollup = FrameRollup(ROLLUP_INTERVALS) if ROLLUP_INTERVALS else None
+    failed_archives = []
+    if ARCHIVE_SOURCE:
+        # archives cover all but the trailing days, REST only fills what is left
+        _, failed_archives = import_archives(
+            sink, MARKET, list(starts), INTERVAL, DATE_FROM, date_to, TABLE,
+            ARCHIVE_SOURCE, min_volume=VOLUME_THRESHOLD, store=store, spool=spool,
+            starts=starts, rollup=rollup
+        )
 
-                next_start = rows[-1][6] + 1
-                if next_start > DATE_TO:
-                    break
-                start_time = next_start
+    jobs = make_jobs(*plan_backfill(store, starts, date_to, failed_archives))
+    print(f"Backfilling {len(jobs)} windows with {WORKERS} workers")
 
-                time.sleep(REQUEST_DELAY)
+    # filter: only store volume > 50,000
+    frames = KlineFrameBuffer(
+        TABLE, INTERVAL, DATE_FROM, date_to, min_volume=VOLUME_THRESHOLD, rollup=rollup
+    )
+    lock = threading.Lock()
+    batch_counter = 0
 
-        sender.flush()
+    def flush():
+        spool.replay(url)
+        buf = sink.new_buffer()
+        ingest_batch(buf, frames)
+        delivered = flush_or_spool(sink, buf, spool)
+        # ranges are only recorded once their rows reached QuestDB
+        if store is not None:
+            store.commit_delivered(delivered, spool)
+
+    # workers fetch in parallel, ingest one at a time
+    def on_page(symbol, rows, covered_from, covered_to):
+        nonlocal batch_counter
+        with lock:
+            if rows:
+                frames.add(symbol, rows)
+            if store is not None:
+                store.add(MARKET, symbol, INTERVAL, covered_from, covered_to)
+            batch_counter += 1
+            if batch_counter % 20 == 0:
+                flush()
 
-    print("Historical backfill complete.")
+    try:
+        tuner = PageTuner(MARKET, limiter, WORKERS)
+        failed = run_backfill(jobs, fetch_page, on_page, tuner, WORKERS)
+        flush()
+        # rollup buckets cut off by date_to or by missing minutes
+        buf = sink.new_buffer()
+        if hand_over is not None and rollup is not None:
+            ingest_frame(buf, TABLE, hand_over(rollup.take_open(date_to)))
+        frames.drain(buf)
+        flush_or_spool(sink, buf, spool)
+    finally:
+        if store is not None:
+            store.close()
+        if spool.pending():
+            print(f"QuestDB unavailable: batches left in {SPOOL_DIR}, replayed on the next run")
+        spool.close()
+
+    if failed:
+        print(f"Historical backfill finished with {len(failed)} failed windows.")
+    else:
+        print("Historical backfill complete.")
 
 # -------------------------------
 # Entry point
@@ -186,6 +221,7 @@ def futures_backfill_all():
 
 if __name__ == "__main__":
     print("=== Starting Historical Backfill ===")
+    serve(METRICS_PORT)
     try:
         futures_backfill_all()
     except KeyboardInterrupt:
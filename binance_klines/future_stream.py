@@ -1,87 +1,160 @@
 import asyncio
-import json
 import time
-import traceback
 import aiohttp
-from questdb.ingress import Sender, TimestampNanos
-from utils import get_futures_symbols
+from stream_writer import StreamWriter
+from stream_modes import KlineRouter
+from rollups import StreamRollup
+from decoders import make_decoder
+from ws_manager import StreamManager
+from spool import Spool, replay_loop
+from sinks import get_sink
+from symbol_registry import get_registry
+from capture import FrameCapture
+from recent import RecentKlines, serve_recent
+from schema import ensure_kline_tables
+from metrics import STREAM_EVENT_LAG, STREAM_MESSAGES, serve
 
 # ============================================================
-# QuestDB Sender configuration
+# Configuration (rows go to the [sink] target, see sinks.py)
 # ============================================================
-conf = "http::addr=82.29.166.107:9000;"
-
+WS_URL = "wss://fstream.binance.com/stream"
+TABLE = "futures_klines_v1"
 STREAM_INTERVAL = "1m"
-SYMBOLS_PER_WS = 5  # 5 streams per WS connection
+SYMBOL_REFRESH_SECONDS = 300  # exchangeInfo poll for listings/delistings
+STREAM_MODE = "coalesce"  # "closed", "coalesce" or "all" (see stream_modes.py)
+COALESCE_MS = 1000  # coalesce window per (symbol, interval)
+DECODER = "auto"  # "msgspec", "orjson" or "json" (see decoders.py)
+ROLLUP_INTERVALS = ("5m", "15m", "1h", "1d")  # bars built from closed 1m candles, () for none
+SPOOL_DIR = "spool/futures_stream"  # batches that could not reach QuestDB
+CAPTURE_DIR = None  # e.g. "capture/futures_stream" to record raw frames for replay.py
+METRICS_PORT = 9100  # Prometheus endpoint, sharded runs use METRICS_PORT + 1 + shard
+RECENT_SIZE = 0  # candles kept per (symbol, interval) for the local API (recent.py), 0 for off
+RECENT_PORT = 9150  # recent.py API on 127.0.0.1, sharded runs use RECENT_PORT + 1 + shard
+
+decode_kline = make_decoder(DECODER)
+registry = get_registry("futures")
+messages = STREAM_MESSAGES.labels("futures")
+event_lag = STREAM_EVENT_LAG.labels("futures")
 
 # ============================================================
-# WebSocket worker
+# Message handler
 # ============================================================
-async def ws_worker(session, symbols):
-    """Async WS connection handling a group of symbols."""
-    streams = [f"{s.lower()}@kline_{STREAM_INTERVAL}" for s in symbols]
-    url = f"wss://fstream.binance.com/stream?streams={'/'.join(streams)}"
-    with Sender.from_conf(conf) as sender:
-        while True:
-            try:
-                print(f"[WS] Connecting ({len(symbols)} symbols)...")
-                async with session.ws_connect(url, heartbeat=20) as ws:
-                    print("[WS] Connected:", symbols)
-
-                    async for msg in ws:
-                        if msg.type == aiohttp.WSMsgType.TEXT:
-                            try:
-                                data = json.loads(msg.data)
-                                if "data" in data and "k" in data["data"]:
-                                    k = data["data"]["k"]
-                                    sender.row(
-                                            "futures_klines_v1",
-                                            symbols={"symbol": k["s"], "interval": k["i"]},
-                                            columns={
-                                                "open": float(k["o"]),
-                                                "high": float(k["h"]),
-                                                "low": float(k["l"]),
-                                                "close": float(k["c"]),
-                                                "volume": float(k["v"]),
-                                                "close_time": TimestampNanos(int(k["t"] * 1_000_000)),
-                                                "quote_volume": float(k["q"]),
-                                                "trades": int(k["n"]),
-                                                "taker_base_volume": float(k["V"]),
-                                                "taker_quote_volume": float(k["Q"]),
-                                            },
-                                            at=TimestampNanos(int(k["T"] * 1_000_000))
-                                        )
-                            except Exception:
-                                traceback.print_exc()
-                        elif msg.type == aiohttp.WSMsgType.ERROR:
-                            print("[WS] Error:", msg)
-                            break
-                # Flush after each reconnect iteration
-                sender.flush()
-            except Exception as e:
-                print("[WS] Exception:", e)
+def handle_message(router, raw, counts=None):
+    k = decode_kline(raw)
+    if k is None:
+        return
+    messages.inc()
+    if k.event_time:
+        event_lag.observe(time.time() - k.event_time / 1000)
+    if counts is not None:
+        counts[k.symbol] = counts.get(k.symbol, 0) + 1
+    router.on_kline(k)
+
 
-            print("[WS] Reconnecting in 5s...", symbols)
-            await asyncio.sleep(5)
+def stream_name(symbol):
+    return f"{symbol.lower()}@kline_{STREAM_INTERVAL}"
 
 
 # ============================================================
 # Start all streams
 # ============================================================
-async def start_all_streams():
-    symbols = get_futures_symbols()
-    total = len(symbols)
-    print(f"[SYS] Found {total} futures symbols")
+def load_symbols():
+    return registry.symbols(contract_type="PERPETUAL")
+
+
+async def exchange_info_updates():
+    """
+    Yield the symbol list whenever the registry reports listings or
+    delistings; the registry is revalidated every SYMBOL_REFRESH_SECONDS.
+    """
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+    # refresh() runs in a worker thread, wake the loop from there
+    registry.subscribe(lambda added, removed: loop.call_soon_threadsafe(changed.set))
+    while True:
+        try:
+            await asyncio.wait_for(changed.wait(), SYMBOL_REFRESH_SECONDS)
+        except asyncio.TimeoutError:
+            try:
+                await asyncio.to_thread(registry.refresh)
+            except Exception as e:
+                print("[SYS] Symbol refresh failed:", e)
+            continue
+        changed.clear()
+        yield load_symbols()
+
 
-    # shard symbols into groups
-    groups = [symbols[i:i + SYMBOLS_PER_WS] for i in range(0, total, SYMBOLS_PER_WS)]
-    print(f"[SYS] Creating {len(groups)} async WebSocket tasks")
+def make_router(writer, mode=STREAM_MODE, recent=None):
+    """The router (with rollups) that frames go through; replay.py uses it too."""
+    rollup = StreamRollup(ROLLUP_INTERVALS) if ROLLUP_INTERVALS else None
+    return KlineRouter(writer, TABLE, mode, COALESCE_MS, rollup, recent)
 
-    async with aiohttp.ClientSession() as session:
 
-        # start all WS workers
-        tasks = [asyncio.create_task(ws_worker(session, grp)) for grp in groups]
-        await asyncio.gather(*tasks)
+async def run_streams(symbols, symbol_updates, counts=None, spool_dir=SPOOL_DIR,
+                      capture_dir=CAPTURE_DIR, on_router=None, recent_port=RECENT_PORT):
+    """
+    Stream `symbols` into QuestDB. Each list yielded by the async iterator
+    `symbol_updates` replaces the subscribed set. If `counts` is a dict,
+    messages per symbol are tallied into it. Batches QuestDB does not
+    accept are kept in the spool at `spool_dir` and replayed in order.
+    With `capture_dir`, raw frames are also recorded there (see capture.py).
+    With RECENT_SIZE, the latest klines are served on `recent_port` (see recent.py).
+    on_router is called with the KlineRouter before any frame arrives
+    (main.py steers the backfill handoff through it).
+    """
+    spool = Spool(spool_dir)
+    capture = FrameCapture(capture_dir) if capture_dir else None
+    sink = get_sink()
+    # one writer and flush scheduler shared by all connections
+    writer = StreamWriter(sink, spool=spool)
+    recent = RecentKlines(RECENT_SIZE) if RECENT_SIZE else None
+    router = make_router(writer, recent=recent)
+    if on_router is not None:
+        on_router(router)
+    background = [
+        asyncio.create_task(writer.run()),
+        asyncio.create_task(router.run()),
+        asyncio.create_task(replay_loop(spool, sink.replay_url)),
+    ]
+    if capture is not None:
+        background.append(asyncio.create_task(capture.run()))
+
+    def on_message(raw):
+        if capture is not None:
+            capture.write(raw)
+        handle_message(router, raw, counts)
+
+    runner = await serve_recent(recent, recent_port, interval=STREAM_INTERVAL) if recent else None
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            manager = StreamManager(
+                session,
+                WS_URL,
+                stream_name,
+                on_message,
+            )
+            await manager.set_symbols(symbols)
+
+            async def follow_updates():
+                async for new_symbols in symbol_updates:
+                    await manager.set_symbols(new_symbols)
+
+            await asyncio.gather(*background, follow_updates())
+    finally:
+        if capture is not None:
+            capture.close()
+        if runner is not None:
+            await runner.cleanup()
+
+
+async def start_all_streams():
+    serve(METRICS_PORT)
+    await asyncio.to_thread(ensure_kline_tables, [TABLE])
+    symbols = load_symbols()
+    print(f"[SYS] Found {len(symbols)} futures symbols")
+
+    await run_streams(symbols, exchange_info_updates())
 
 
 # ============================================================
@@ -0,0 +1,327 @@
+import threading
+import time
+import numpy as np
+import pandas as pd
+from utils import spot_fetch_klines, future_fetch_klines
+from symbol_registry import get_registry
+from columnar import KlineFrameBuffer, array_frame, ingest_frame
+from rollups import INTERVAL_MS, ROLLUP_INTERVALS, FrameRollup
+from backfill_engine import DAY_MS, run_backfill
+from sinks import get_sink
+from spool import flush_or_spool
+from questdb_query import query, parse_timestamps, format_timestamp
+from rate_limit import best_klines_limit, shared_limiter
+import config
+
+# ============================================================
+# Gap detection and targeted repair for kline tables
+#
+# Missing open_time slots are found per symbol, merged into as few
+# fetch windows as possible (one page each where the gaps are close
+# together) and re-fetched. Only rows for the missing slots are
+# written back, so existing rows are never duplicated. The stream
+# drops rollup bars of buckets it missed minutes of (see rollups.py),
+# so afterwards every closed rollup bucket holding a missing slot is
+# rebuilt from the 1m rows.
+# ============================================================
+
+QUEST_HOST = config.get("questdb", "host")
+QUEST_PORT = config.get("questdb", "port")
+
+INTERVAL = "1m"
+STEP_MS = 60_000
+SCAN_CHUNK_MS = 7 * DAY_MS  # timestamps fetched per /exec query
+# 1m columns in the (11, n) order of columnar.array_frame
+KLINE_COLUMNS = ("timestamp", "open", "high", "low", "close", "volume", "close_time",
+                 "quote_volume", "trades", "taker_base_volume", "taker_quote_volume")
+WORKERS = 8
+
+# Stream tables hold every candle; binance_futures_klines is volume
+# filtered, so its "gaps" are mostly intentional and not scanned here.
+TARGETS = {
+    "spot": {
+        "table": "spot_klines",
+        "fetch": spot_fetch_klines,
+        "limit": best_klines_limit("spot"),
+        "rollups": ROLLUP_INTERVALS,  # as the stream writes them
+    },
+    "futures": {
+        "table": "futures_klines_v1",
+        "fetch": future_fetch_klines,
+        "limit": best_klines_limit("futures"),  # most rows per request weight
+        "rollups": ROLLUP_INTERVALS,
+    },
+}
+
+
+# ---------------- Gap detection ----------------
+def find_gaps(open_times, start_time, end_time, step_ms=STEP_MS):
+    """
+    Missing slots of the step_ms grid in [start_time, end_time], given
+    the open_times that are present. Returns inclusive (first, last)
+    slot ranges.
+    """
+    first = -(-start_time // step_ms) * step_ms
+    last = end_time // step_ms * step_ms
+    if first > last:
+        return []
+
+    times = np.unique(np.asarray(open_times, dtype=np.int64))
+    times = times[(times >= first) & (times <= last) & (times % step_ms == 0)]
+    # sentinels one step outside the range turn edge gaps into inner ones
+    times = np.concatenate(([first - step_ms], times, [last + step_ms]))
+
+    holes = np.nonzero(np.diff(times) > step_ms)[0]
+    return [(int(times[i] + step_ms), int(times[i + 1] - step_ms)) for i in holes]
+
+
+def covered_ranges(gaps, start_time, end_time, step_ms=STEP_MS):
+    """
+    The inverse of find_gaps(start_time, end_time): inclusive ms ranges
+    of [start_time, end_time] whose slots are all present.
+    """
+    ranges = []
+    start = start_time
+    for gap_start, gap_end in gaps:
+        if gap_start > start:
+            ranges.append((start, gap_start - 1))
+        start = gap_end + step_ms
+    if start <= end_time:
+        ranges.append((start, end_time))
+    return ranges
+
+
+def merge_windows(gaps, limit, step_ms=STEP_MS):
+    """
+    Merge gaps into fetch windows. Neighbouring gaps share a window while
+    it still fits in one page of `limit` klines, since one request costs
+    the same however many of its rows are missing. A gap longer than a
+    page stays a single window and is paged through.
+    """
+    windows = []
+    for start, end in gaps:
+        if windows and (end - windows[-1][0]) // step_ms + 1 <= limit:
+            windows[-1][1] = end
+        else:
+            windows.append([start, end])
+    return [(start, end + step_ms - 1) for start, end in windows]
+
+
+def missing_slots(gaps, step_ms=STEP_MS):
+    slots = set()
+    for start, end in gaps:
+        slots.update(range(start, end + 1, step_ms))
+    return slots
+
+
+# ---------------- Sources ----------------
+def scan_questdb(table, symbol, start_time, end_time, interval=INTERVAL):
+    """open_times present in QuestDB for one symbol, queried in chunks."""
+    chunks = []
+    chunk_start = start_time
+    while chunk_start <= end_time:
+        chunk_end = min(chunk_start + SCAN_CHUNK_MS - 1, end_time)
+        rows = query(
+            QUEST_HOST,
+            QUEST_PORT,
+            f"SELECT DISTINCT timestamp FROM {table}"
+            f" WHERE symbol = '{symbol}' AND interval = '{interval}'"
+            f" AND timestamp BETWEEN '{format_timestamp(chunk_start)}'"
+            f" AND '{format_timestamp(chunk_end)}'",
+        )
+        if rows:
+            chunks.append(parse_timestamps([r[0] for r in rows]))
+        chunk_start = chunk_end + 1
+    if not chunks:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(chunks)
+
+
+def scan_questdb_symbols(table, start_time, end_time, interval=INTERVAL):
+    """open_times present in QuestDB per symbol, in one query (keep the range short)."""
+    rows = query(
+        QUEST_HOST,
+        QUEST_PORT,
+        f"SELECT symbol, timestamp FROM {table}"
+        f" WHERE interval = '{interval}'"
+        f" AND timestamp BETWEEN '{format_timestamp(start_time)}'"
+        f" AND '{format_timestamp(end_time)}'",
+    )
+    by_symbol = {}
+    for symbol, ts in rows:
+        by_symbol.setdefault(symbol, []).append(ts)
+    return {symbol: parse_timestamps(values) for symbol, values in by_symbol.items()}
+
+
+def scan_klines(table, symbol, start_time, end_time, interval=INTERVAL):
+    """One symbol's klines in QuestDB as an (11, n) float64 column array, queried in chunks."""
+    blocks = []
+    chunk_start = start_time
+    while chunk_start <= end_time:
+        chunk_end = min(chunk_start + SCAN_CHUNK_MS - 1, end_time)
+        rows = query(
+            QUEST_HOST,
+            QUEST_PORT,
+            f"SELECT {', '.join(KLINE_COLUMNS)} FROM {table}"
+            f" WHERE symbol = '{symbol}' AND interval = '{interval}'"
+            f" AND timestamp BETWEEN '{format_timestamp(chunk_start)}'"
+            f" AND '{format_timestamp(chunk_end)}'",
+        )
+        if rows:
+            columns = list(zip(*rows))
+            block = np.empty((len(KLINE_COLUMNS), len(rows)), dtype=np.float64)
+            for i, values in enumerate(columns):
+                block[i] = parse_timestamps(values) if i in (0, 6) else values
+            blocks.append(block)
+        chunk_start = chunk_end + 1
+    if not blocks:
+        return np.empty((len(KLINE_COLUMNS), 0), dtype=np.float64)
+    return np.concatenate(blocks, axis=1)
+
+
+def scan_export(path):
+    """
+    open_times per symbol from a local CSV export of a kline table
+    (QuestDB /exp output with at least `symbol` and `timestamp` columns).
+    """
+    df = pd.read_csv(path, usecols=["symbol", "timestamp"])
+    ts = pd.to_datetime(df["timestamp"], utc=True).astype("datetime64[ns, UTC]")
+    df["open_time"] = ts.astype(np.int64) // 1_000_000
+    return {symbol: grp["open_time"].to_numpy() for symbol, grp in df.groupby("symbol")}
+
+
+# ---------------- Rollup rebuild ----------------
+def touched_buckets(slots, intervals, end_time):
+    """{(interval, bucket)} of the rollup buckets holding any of `slots` that closed by end_time."""
+    buckets = set()
+    for interval in intervals:
+        ms = INTERVAL_MS[interval]
+        for slot in slots:
+            bucket = slot - slot % ms
+            if bucket + ms - 1 <= end_time:
+                buckets.add((interval, bucket))
+    return buckets
+
+
+def rebuild_rollups(sink, table, symbol, buckets, repaired=()):
+    """
+    Rewrite the bars of `buckets` ({(interval, bucket)}) from the 1m rows
+    in QuestDB plus `repaired`, raw rows just written that QuestDB may not
+    show yet. Returns the number of bars written.
+    """
+    if not buckets:
+        return 0
+    start = min(bucket for _, bucket in buckets)
+    end = max(bucket + INTERVAL_MS[interval] - 1 for interval, bucket in buckets)
+    a = scan_klines(table, symbol, start, end)
+    if repaired:
+        a = np.concatenate([a, np.array(repaired, dtype=object)[:, :11].astype(np.float64).T], axis=1)
+    # one row per minute, in time order
+    _, first = np.unique(a[0], return_index=True)
+    df, _ = array_frame(a[:, first], symbol, INTERVAL, start, end)
+
+    rollup = FrameRollup(sorted({interval for interval, _ in buckets}, key=INTERVAL_MS.get))
+    bars = [b for b in (rollup.add(df), rollup.drain()) if len(b)]
+    if not bars:
+        return 0
+    bars = pd.concat(bars, ignore_index=True)
+    opens = bars["timestamp"].to_numpy().astype("datetime64[ms]").astype(np.int64)
+    keep = np.array([(i, t) in buckets for i, t in zip(bars["interval"].astype(object), opens.tolist())])
+    buf = sink.new_buffer()
+    written = ingest_frame(buf, table, bars[keep])
+    flush_or_spool(sink, buf, None)
+    return written
+
+
+# ---------------- Repair ----------------
+def plan_repairs(market, symbols, start_time, end_time, export_path=None):
+    """Return (fetch windows, missing slots per symbol) for one market."""
+    target = TARGETS[market]
+    exported = scan_export(export_path) if export_path else None
+
+    plan = []
+    slots = {}
+    for symbol in symbols:
+        if exported is not None:
+            present = exported.get(symbol, np.empty(0, dtype=np.int64))
+        else:
+            present = scan_questdb(target["table"], symbol, start_time, end_time)
+        if len(present) == 0:
+            # never ingested in this range: a job for the backfill, not a repair
+            print(f"[{symbol}] no rows in range, skipped")
+            continue
+        gaps = find_gaps(present, start_time, end_time)
+        if not gaps:
+            continue
+        windows = merge_windows(gaps, target["limit"])
+        missing = sum((end - start) // STEP_MS + 1 for start, end in gaps)
+        print(f"[{symbol}] {missing} missing slots in {len(gaps)} gaps -> {len(windows)} windows")
+        plan.extend((symbol, start, end) for start, end in windows)
+        slots[symbol] = missing_slots(gaps)
+    return plan, slots
+
+
+def repair_gaps(market, symbols, start_time, end_time, export_path=None):
+    target = TARGETS[market]
+    plan, slots = plan_repairs(market, symbols, start_time, end_time, export_path)
+    print(f"[{market}] {len(plan)} repair windows for {len(slots)} symbols")
+    if not plan:
+        return []
+
+    limiter = shared_limiter(market)
+    frames = KlineFrameBuffer(target["table"], INTERVAL)
+    lock = threading.Lock()
+    repaired = 0
+    repaired_rows = {}  # symbol -> raw rows, for the rollup rebuild
+
+    def fetch_page(symbol, start, end, limit):
+        return target["fetch"](symbol, INTERVAL, start_time=start, end_time=end,
+                               limit=limit, limiter=limiter)
+
+    sink = get_sink()
+
+    def write_frames():
+        buf = sink.new_buffer()
+        frames.write(buf)
+        flush_or_spool(sink, buf, None)
+
+    def on_page(symbol, rows, covered_from, covered_to):
+        nonlocal repaired
+        # keep only the slots that are actually missing
+        wanted = slots[symbol]
+        rows = [r for r in rows if r[0] in wanted]
+        if not rows:
+            return
+        with lock:
+            frames.add(symbol, rows)
+            repaired_rows.setdefault(symbol, []).extend(rows)
+            repaired += len(rows)
+            if len(frames.pages) >= 20:
+                write_frames()
+
+    failed = run_backfill(plan, fetch_page, on_page, target["limit"], WORKERS)
+    write_frames()
+    print(f"[{market}] repaired {repaired} klines, {len(failed)} windows failed")
+
+    # also where the exchange has no rows either: the stream dropped those buckets
+    bars = 0
+    for symbol, missing in slots.items():
+        buckets = touched_buckets(missing, target["rollups"], end_time)
+        bars += rebuild_rollups(sink, target["table"], symbol, buckets, repaired_rows.get(symbol, ()))
+    print(f"[{market}] rebuilt {bars} rollup bars")
+    return failed
+
+
+# ---------------- Main ----------------
+if __name__ == "__main__":
+    print("=== Gap repair (last 24h) ===")
+    now = int(time.time() * 1000)
+    # leave the still-open candle alone
+    repair_to = now - now % STEP_MS - 1
+    repair_from = repair_to + 1 - DAY_MS
+    try:
+        repair_gaps("spot", get_registry("spot").symbols(), repair_from, repair_to)
+        futures_symbols = get_registry("futures").symbols(contract_type="PERPETUAL")
+        repair_gaps("futures", futures_symbols, repair_from, repair_to)
+    except KeyboardInterrupt:
+        print("\n[SYS] Shutting down...")
@@ -0,0 +1,118 @@
+import random
+import socket
+import threading
+import time
+import requests
+import urllib3.util.connection
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from metrics import REST_RATE_LIMITED, REST_REQUESTS, REST_SECONDS, REST_USED_WEIGHT
+from rate_limit import USED_WEIGHT_HEADER
+
+# ============================================================
+# Shared HTTP client
+#
+# One keep-alive session per process, so REST pages reuse pooled
+# TCP/TLS connections instead of handshaking per request. Every
+# Binance call goes through request(), which applies one retry
+# policy: jittered exponential backoff for network errors and 5xx,
+# and Retry-After for 418/429 (fed to the weight limiter, if any).
+# ============================================================
+
+FORCE_IPV4 = True  # resolve A records only (avoids broken IPv6/DNS setups)
+POOL_SIZE = 32  # connections kept per host, >= fetch workers
+TIMEOUT = 10
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+_session = None
+_session_lock = threading.Lock()
+_timing = threading.local()
+
+
+def session():
+    """The process-wide pooled session (created on first use)."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            if FORCE_IPV4:
+                # one-time resolver setting used by every urllib3 connection
+                urllib3.util.connection.allowed_gai_family = lambda: socket.AF_INET
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=POOL_SIZE, max_retries=0)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            s.headers["Accept-Encoding"] = "gzip, deflate"
+            _session = s
+        return _session
+
+
+def last_request_seconds():
+    """Duration of this thread's last completed request, without limiter waits (None before one)."""
+    return getattr(_timing, "seconds", None)
+
+
+def backoff(attempt):
+    """Full-jitter exponential backoff, so parallel workers do not retry in lockstep."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def request(method, url, limiter=None, weight=1, max_retries=MAX_RETRIES, label=None, **kwargs):
+    """
+    Send a request on the shared session, retrying network errors, 5xx and
+    418/429. Returns the final Response without raising for its status;
+    raises the last network error once retries are exhausted. max_retries
+    counts attempts; the request is always sent at least once.
+    """
+    kwargs.setdefault("timeout", TIMEOUT)
+    label = label or url
+    host = urlsplit(url).hostname
+    max_retries = max(1, max_retries)
+    for attempt in range(max_retries):
+        if limiter is not None:
+            limiter.acquire(weight)
+        started = time.monotonic()
+        try:
+            r = session().request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            REST_REQUESTS.labels(host, "error").inc()
+            if attempt == max_retries - 1:
+                raise
+            wait = backoff(attempt)
+            print(f"[{label}] Network/DNS error: {e}. Retrying in {wait:.1f}s...")
+            time.sleep(wait)
+            continue
+
+        _timing.seconds = time.monotonic() - started
+        REST_SECONDS.labels(host).observe(_timing.seconds)
+        REST_REQUESTS.labels(host, r.status_code).inc()
+        used = r.headers.get(USED_WEIGHT_HEADER)
+        if used is not None:
+            REST_USED_WEIGHT.set(int(used))
+        if r.status_code in (418, 429):
+            REST_RATE_LIMITED.labels(host).inc()
+        if limiter is not None:
+            limiter.observe(r.headers)
+        if attempt == max_retries - 1:
+            return r
+        if r.status_code in (418, 429):
+            wait = float(r.headers.get("Retry-After", backoff(attempt)))
+            print(f"[{label}] Rate limited ({r.status_code}). Waiting {wait:.0f}s before retry...")
+            if limiter is not None:
+                limiter.pause(wait)
+            else:
+                time.sleep(wait)
+        elif r.status_code >= 500:
+            wait = backoff(attempt)
+            print(f"[{label}] Server error ({r.status_code}). Retrying in {wait:.1f}s...")
+            time.sleep(wait)
+        else:
+            return r
+
+
+def get_json(url, params=None, **kwargs):
+    """GET with the retry policy; raises HTTPError for a final error status."""
+    r = request("GET", url, params=params, **kwargs)
+    r.raise_for_status()
+    return r.json()
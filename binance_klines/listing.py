@@ -0,0 +1,87 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# ============================================================
+# First available kline per symbol
+#
+# Backfills clamp each symbol's plan to the open time of its first
+# kline, so late listings cost no empty pages before they existed.
+# futures exchangeInfo carries onboardDate; other symbols are probed
+# once with a limit=1 request from startTime=0. A first kline never
+# moves, so results are cached on disk and probed only once.
+# ============================================================
+
+FIRST_KLINES_CACHE = "cache/first_klines.json"
+WORKERS = 8
+
+# spot and futures backfills can share a process (main.py) and the cache file
+_save_lock = threading.Lock()
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save(path, cache):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp, path)
+
+
+def first_kline_times(market, symbols, interval, fetch_page, registry=None,
+                      workers=WORKERS, cache_path=FIRST_KLINES_CACHE):
+    """
+    {symbol: open time (ms) of its first kline, or None if it has none yet}.
+
+    fetch_page(symbol, start_time, end_time, limit) is the backfill's page
+    fetcher, so probes go through the same weight limiter.
+    """
+    cache = _load(cache_path)
+    known = cache.setdefault(f"{market}:{interval}", {})
+
+    first = {}
+    to_probe = []
+    for symbol in symbols:
+        onboard = registry.onboard_date(symbol) if registry is not None else None
+        if symbol in known:
+            first[symbol] = known[symbol]
+        elif onboard is not None:
+            first[symbol] = onboard
+        else:
+            to_probe.append(symbol)
+
+    if to_probe:
+        print(f"[LISTING] Probing first kline of {len(to_probe)} {market} symbols")
+        now = int(time.time() * 1000)
+
+        def probe(symbol):
+            try:
+                rows = fetch_page(symbol, 0, now, 1)
+            except Exception as e:
+                # unknown: fall back to an unclamped plan, probe again next run
+                print(f"[{symbol}] First kline probe failed: {e}")
+                return 0
+            return rows[0][0] if rows else None
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for symbol, open_time in zip(to_probe, pool.map(probe, to_probe)):
+                first[symbol] = open_time
+                # no klines yet is not final, probe again next run
+                if open_time:
+                    known[symbol] = open_time
+        with _save_lock:
+            # merge into the file as it is now, the other market may have saved meanwhile
+            cache = _load(cache_path)
+            cache.setdefault(f"{market}:{interval}", {}).update(known)
+            _save(cache_path, cache)
+
+    return first
@@ -1,13 +1,177 @@
-from spotbackfill import spot_backfill_all
-from futuresbackfill import futures_backfill_all
-from stream import start_stream
+import asyncio
+import time
+import traceback
+import config
+import future_backfill
+import future_stream
+import spot_backfill
+import spot_stream
+from checkpoint import CheckpointStore
+from gaps import covered_ranges, find_gaps, scan_questdb_symbols
+from questdb_query import format_timestamp
+from rollups import frame_klines
+from schema import ensure_kline_tables
+from metrics import serve
 
-if __name__ == "__main__":
-    print("=== Starting Historical Backfill ===")
-    future_backfill_all()
+# ============================================================
+# Pipeline orchestrator: live streams + backfills in one process
+#
+#   1. the streams of every configured market start first; their
+#      routers hold all klines for now
+#   2. once every symbol has delivered a live kline (or HANDOFF_WAIT
+#      has passed) the cutover is fixed at the next minute: the
+#      stream writes klines opening at or after it, the backfill
+#      everything before
+#   3. when the last backfilled minute has closed, the spot and
+#      futures backfills run concurrently up to cutover - 1. REST
+#      weight is budgeted per API by rate_limit.shared_limiter(),
+#      which exchangeInfo refreshes draw from too
+#   4. where the stream writes the backfill's table, rollup bars whose
+#      bucket straddles the cutover are merged from both halves and
+#      written once (see rollups.py)
+# The streams keep running after the backfills finish. Where a stream
+# writes the backfill's table (spot), the streamed minutes are recorded
+# in the checkpoint store once QuestDB has them, so the next run only
+# backfills the downtime and whatever the stream lost (reconnects,
+# dropped rows, failed flushes).
+# Futures streams into futures_klines_v1 and backfills the volume
+# filtered binance_futures_klines; there the cutover just keeps the
+# two timelines contiguous.
+#
+# Settings come from config.py ([main], [questdb], [futures], [spot]).
+# ============================================================
+
+MARKETS = {
+    "futures": (future_stream, future_backfill, future_backfill.futures_backfill_all),
+    "spot": (spot_stream, spot_backfill, spot_backfill.spot_backfill_all),
+}
+HANDOFF_WAIT = config.get("main", "handoff_wait")
+METRICS_PORT = config.get("main", "metrics_port")
+HOLD = 2 ** 63 - 1  # router.since while the cutover is unknown: write nothing
+CLOSE_GRACE = 2  # seconds after the last backfilled minute closes before fetching it
+CHECKPOINT_INTERVAL = 300  # seconds between records of the streamed range
+CHECKPOINT_LAG_MS = 120_000  # streamed minutes are recorded once this old (flushed by then)
+MINUTE_MS = 60_000
+
+
+async def wait_for_live(market, symbols, counts):
+    """Wait until every symbol has streamed (or HANDOFF_WAIT); returns the cutover (ms)."""
+    deadline = time.monotonic() + HANDOFF_WAIT
+    while len(counts) < len(symbols) and time.monotonic() < deadline:
+        await asyncio.sleep(1)
+    silent = len(set(symbols).difference(counts))
+    if silent:
+        # if their streams start late, gaps.py repairs the minutes in between
+        print(f"[MAIN] {market}: {silent} symbols silent after {HANDOFF_WAIT}s")
+    now = int(time.time() * 1000)
+    return now - now % MINUTE_MS + MINUTE_MS
+
+
+async def record_streamed(market, table, interval, counts, cutover):
+    """
+    Add the minutes since `cutover` that QuestDB holds for each streaming
+    symbol to the checkpoint store, up to a little while ago. Minutes the
+    stream did not deliver stay unrecorded, for the next run's backfill.
+    """
+    store = CheckpointStore()
+    checked_to = cutover - 1
+
+    def commit(start, end):
+        present = scan_questdb_symbols(table, start, end, interval)
+        for symbol in list(counts):
+            times = present.get(symbol)
+            if times is None:
+                continue
+            gaps = find_gaps(times, start, end, MINUTE_MS)
+            for covered_from, covered_to in covered_ranges(gaps, start, end, MINUTE_MS):
+                store.add(market, symbol, interval, covered_from, covered_to)
+        store.commit()
+
+    try:
+        while True:
+            await asyncio.sleep(CHECKPOINT_INTERVAL)
+            now = int(time.time() * 1000) - CHECKPOINT_LAG_MS
+            end = now - now % MINUTE_MS - 1
+            if end > checked_to:
+                try:
+                    await asyncio.to_thread(commit, checked_to + 1, end)
+                except Exception as e:
+                    # not recorded now means refetched by the next backfill
+                    print(f"[MAIN] {market}: could not check streamed minutes: {e}")
+                checked_to = end
+    finally:
+        store.close()
+
+
+async def run_market(market):
+    stream, backfill_module, backfill = MARKETS[market]
+    loop = asyncio.get_running_loop()
+    # the backfill bootstraps its own table
+    await asyncio.to_thread(ensure_kline_tables, [stream.TABLE])
+    symbols = await asyncio.to_thread(stream.load_symbols)
+    print(f"[MAIN] {market}: streaming {len(symbols)} symbols")
 
-    print("=== Starting Historical Backfill (Spot) ===")
-    spot_backfill_all()
+    counts = {}
+    routers = []
 
-    print("=== Starting Real-Time Streaming ===")
-    start_stream()
+    def on_router(router):
+        router.since = HOLD
+        routers.append(router)
+
+    live = asyncio.create_task(
+        stream.run_streams(symbols, stream.exchange_info_updates(), counts, on_router=on_router)
+    )
+    cutover = await wait_for_live(market, symbols, counts)
+    if live.done():
+        await live  # raises why the stream could not start
+    router = routers[0]
+    router.start_handoff(cutover)
+    print(f"[MAIN] {market}: cutover at {format_timestamp(cutover)}, "
+          f"backfilled before it, streamed from it")
+
+    tasks = [live]
+    same_table = stream.TABLE == backfill_module.TABLE
+    if same_table and backfill_module.RESUME_MODE == "checkpoint":
+        tasks.append(asyncio.create_task(
+            record_streamed(market, stream.TABLE, backfill_module.INTERVAL, counts, cutover)
+        ))
+
+    def hand_over(bars):
+        """Straddling rollup bars of streaming symbols go to the router; returns the rest."""
+        if router.rollup is None or not len(bars):
+            return bars
+        taken = bars["symbol"].isin(set(counts)).to_numpy()
+        loop.call_soon_threadsafe(router.merge_backfill, frame_klines(bars[taken]))
+        return bars[~taken]
+
+    await asyncio.sleep(max(0.0, cutover / 1000 + CLOSE_GRACE - time.time()))
+    try:
+        # seam bars only merge where both write one table; otherwise the
+        # backfill drains its own into its table
+        await asyncio.to_thread(backfill, cutover - 1, hand_over if same_table else None)
+    except Exception:
+        # the stream is unaffected; the next run resumes the backfill
+        print(f"[MAIN] {market}: backfill failed:")
+        traceback.print_exc()
+    else:
+        print(f"[MAIN] {market}: backfill done, streaming only")
+    finally:
+        router.end_handoff()
+    await asyncio.gather(*tasks)
+
+
+async def main(markets):
+    serve(METRICS_PORT)
+    await asyncio.gather(*(run_market(market) for market in markets))
+
+
+if __name__ == "__main__":
+    markets = config.get("main", "markets")
+    unknown = set(markets).difference(MARKETS)
+    if unknown:
+        raise SystemExit(f"Unknown markets in config: {', '.join(sorted(unknown))}")
+    print(f"=== Binance → QuestDB pipeline: {', '.join(markets)} ===")
+    try:
+        asyncio.run(main(markets))
+    except KeyboardInterrupt:
+        print("\n[SYS] Shutting down...")
@@ -0,0 +1,66 @@
+import datetime
+import numpy as np
+from http_client import session
+
+# ============================================================
+# QuestDB REST query helpers (/exec endpoint)
+# ============================================================
+
+
+class QueryError(Exception):
+    pass
+
+
+def _exec(host, port, sql, timeout):
+    r = session().get(f"http://{host}:{port}/exec", params={"query": sql}, timeout=timeout)
+    try:
+        body = r.json()
+    except ValueError:
+        r.raise_for_status()
+        raise
+    if "error" in body:
+        raise QueryError(body["error"])
+    r.raise_for_status()
+    return body
+
+
+def query(host, port, sql, timeout=30):
+    """Run one SQL statement and return its dataset (list of rows)."""
+    return _exec(host, port, sql, timeout).get("dataset", [])
+
+
+def query_dicts(host, port, sql, timeout=30):
+    """Same as query(), with every row as a {column: value} dict."""
+    body = _exec(host, port, sql, timeout)
+    names = [c["name"] for c in body.get("columns", [])]
+    return [dict(zip(names, row)) for row in body.get("dataset", [])]
+
+
+def parse_timestamp(value):
+    """QuestDB ISO timestamp ('2024-01-01T00:00:00.000000Z') to epoch ms."""
+    dt = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return int(dt.timestamp() * 1000)
+
+
+def parse_timestamps(values):
+    """Vectorized parse_timestamp(): ISO strings to an int64 array of epoch ms."""
+    return np.array([v.rstrip("Z") for v in values], dtype="datetime64[ms]").astype(np.int64)
+
+
+def format_timestamp(ms):
+    """Epoch ms to a QuestDB timestamp literal."""
+    dt = datetime.datetime.fromtimestamp(ms / 1000, tz=datetime.timezone.utc)
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.") + f"{ms % 1000:03d}000Z"
+
+
+def latest_timestamps(host, port, table, interval):
+    """Return {symbol: max(timestamp) in ms} for one kline table."""
+    sql = f"SELECT symbol, max(timestamp) FROM {table} WHERE interval = '{interval}'"
+    try:
+        rows = query(host, port, sql)
+    except QueryError as e:
+        # nothing ingested yet
+        if "does not exist" in str(e):
+            return {}
+        raise
+    return {symbol: parse_timestamp(ts) for symbol, ts in rows if ts is not None}
@@ -0,0 +1,117 @@
+import threading
+import time
+import config
+
+# ============================================================
+# Binance request-weight limits (per IP, per minute)
+#
+# Spot and futures are separate APIs with separate budgets.
+# ============================================================
+SPOT_WEIGHT_LIMIT = config.get("limits", "spot_weight")
+FUTURES_WEIGHT_LIMIT = config.get("limits", "futures_weight")
+HEADROOM = config.get("limits", "headroom")
+
+EXCHANGE_INFO_WEIGHT = {"spot": 20, "futures": 1}
+
+USED_WEIGHT_HEADER = "X-MBX-USED-WEIGHT-1M"
+KLINES_MAX_LIMIT = {"spot": 1000, "futures": 1500}  # rows per klines page
+
+
+def klines_weight(market, limit):
+    """Request weight of one klines call for the given market and limit."""
+    if market == "spot":
+        return 2
+    # /fapi/v1/klines is priced by the requested limit
+    if limit < 100:
+        return 1
+    if limit < 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+
+def klines_limits(market):
+    """The largest limit of each klines weight tier: the only limits worth requesting."""
+    top = KLINES_MAX_LIMIT[market]
+    return [limit for limit in range(1, top + 1)
+            if limit == top or klines_weight(market, limit + 1) > klines_weight(market, limit)]
+
+
+def best_klines_limit(market):
+    """The klines limit with the most rows per unit of weight (the larger one on a tie)."""
+    return max(klines_limits(market), key=lambda limit: (limit / klines_weight(market, limit), limit))
+
+
+# ============================================================
+# Token bucket
+# ============================================================
+class WeightLimiter:
+    """
+    Token bucket over Binance's per-minute request weight.
+
+    Tokens refill continuously at limit/60 per second. After every
+    response the bucket is re-synced with the used weight the exchange
+    reports, so weight spent by other processes on the same IP is
+    accounted for too. Callers block in acquire() instead of sleeping
+    a fixed delay between requests.
+    """
+
+    def __init__(self, limit_per_minute, headroom=HEADROOM):
+        self.capacity = limit_per_minute * headroom
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, weight):
+        """Block until `weight` tokens are available, then take them."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                wait = max(self.paused_until - now, (weight - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def observe(self, headers):
+        """Sync the bucket with the used weight reported by the exchange."""
+        used = headers.get(USED_WEIGHT_HEADER)
+        if used is None:
+            return
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, self.capacity - int(used))
+
+    def pause(self, seconds):
+        """Stop handing out weight for `seconds` (e.g. after a 429/418)."""
+        with self.lock:
+            now = time.monotonic()
+            self.paused_until = max(self.paused_until, now + seconds)
+            self.tokens = 0
+            self.updated = now
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_limiter(market):
+    """
+    The process-wide limiter for one market's API. Backfills, gap repairs
+    and exchangeInfo refreshes running in the same process draw from it,
+    so together they stay within the budget.
+    """
+    with _shared_lock:
+        limiter = _shared.get(market)
+        if limiter is None:
+            limit = SPOT_WEIGHT_LIMIT if market == "spot" else FUTURES_WEIGHT_LIMIT
+            limiter = _shared[market] = WeightLimiter(limit)
+        return limiter
@@ -0,0 +1,214 @@
+import asyncio
+import json
+from aiohttp import web
+from decoders import Kline
+from metrics import RECENT_DROPPED, RECENT_SUBSCRIBERS
+
+# ============================================================
+# Recent klines: in-memory ring buffers + local query API
+#
+# The stream process sees every kline on its way to QuestDB. With
+# RECENT_SIZE set in a stream module, the router also keeps the last
+# RECENT_SIZE candles per (symbol, interval) in a fixed-size ring (a
+# preallocated list, overwritten in place), rollup bars included.
+# Updates to the open candle replace it; a newer candle takes the next
+# slot. Klines are kept as each update arrives, also before a backfill
+# handoff's cutover. Each shard of a sharded run serves its own symbols.
+#
+# Readers in the same process call latest()/last() directly. Other
+# processes use the HTTP API on 127.0.0.1:RECENT_PORT:
+#   GET /latest?symbol=BTCUSDT&interval=1m   one candle (404 if none);
+#                                            without symbol: every symbol
+#   GET /klines?symbol=BTCUSDT&interval=1m&n=100
+#                                            the last n candles, oldest first
+#   GET /subscribe?symbols=BTCUSDT,ETHUSDT&intervals=1m
+#                                            WebSocket, one JSON kline per
+#                                            update; no filter means all
+# A subscriber that falls SUBSCRIBER_QUEUE updates behind loses the
+# newest ones (counted), the stream itself never waits on a reader.
+# ============================================================
+
+SIZE = 1000
+SUBSCRIBER_QUEUE = 10_000
+HOST = "127.0.0.1"
+
+
+class KlineRing:
+    """The last `size` candles of one (symbol, interval), oldest overwritten first."""
+
+    __slots__ = ("klines", "size", "end", "count")
+
+    def __init__(self, size=SIZE):
+        self.klines = [None] * size
+        self.size = size
+        self.end = 0  # next slot to fill
+        self.count = 0
+
+    def update(self, k):
+        """Store k; False if it is older than the newest candle (nothing changed)."""
+        if self.count:
+            last = self.klines[self.end - 1]
+            if k.open_time == last.open_time:
+                self.klines[self.end - 1] = k
+                return True
+            if k.open_time < last.open_time:
+                return False
+        self.klines[self.end] = k
+        self.end = (self.end + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+        return True
+
+    def latest(self):
+        return self.klines[self.end - 1] if self.count else None
+
+    def last(self, n):
+        """Up to n newest candles, oldest first."""
+        n = min(n, self.count)
+        if n <= 0:
+            return []
+        start = self.end - n
+        if start >= 0:
+            return self.klines[start:self.end]
+        return self.klines[start:] + self.klines[:self.end]
+
+
+class Subscription:
+
+    def __init__(self, symbols=None, intervals=None, queue_size=SUBSCRIBER_QUEUE):
+        self.symbols = set(symbols) if symbols else None
+        self.intervals = set(intervals) if intervals else None
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def offer(self, k):
+        if self.symbols is not None and k.symbol not in self.symbols:
+            return
+        if self.intervals is not None and k.interval not in self.intervals:
+            return
+        try:
+            self.queue.put_nowait(k)
+        except asyncio.QueueFull:
+            RECENT_DROPPED.inc()
+
+
+class RecentKlines:
+    """Ring buffers per (symbol, interval). Use from the event loop thread only."""
+
+    def __init__(self, size=SIZE):
+        self.size = size
+        self.rings = {}  # (symbol, interval) -> KlineRing
+        self.subscriptions = set()
+
+    def update(self, k):
+        key = (k.symbol, k.interval)
+        ring = self.rings.get(key)
+        if ring is None:
+            ring = self.rings[key] = KlineRing(self.size)
+        if ring.update(k) and self.subscriptions:
+            for sub in self.subscriptions:
+                sub.offer(k)
+
+    def latest(self, symbol, interval):
+        ring = self.rings.get((symbol, interval))
+        return ring.latest() if ring is not None else None
+
+    def last(self, symbol, interval, n):
+        ring = self.rings.get((symbol, interval))
+        return ring.last(n) if ring is not None else []
+
+    def latest_all(self, interval):
+        """{symbol: newest candle} for every symbol with candles at `interval`."""
+        return {s: ring.latest() for (s, i), ring in self.rings.items() if i == interval}
+
+    def subscribe(self, symbols=None, intervals=None):
+        sub = Subscription(symbols, intervals)
+        self.subscriptions.add(sub)
+        RECENT_SUBSCRIBERS.set(len(self.subscriptions))
+        return sub
+
+    def unsubscribe(self, sub):
+        self.subscriptions.discard(sub)
+        RECENT_SUBSCRIBERS.set(len(self.subscriptions))
+
+
+# ============================================================
+# HTTP API
+# ============================================================
+def _dict(k):
+    # by field name: streamed klines are Kline tuples or msgspec KlineStructs
+    return {f: getattr(k, f) for f in Kline._fields}
+
+
+def _names(value):
+    return [v for v in value.split(",") if v] if value else None
+
+
+class RecentAPI:
+
+    def __init__(self, recent, interval="1m"):
+        self.recent = recent
+        self.interval = interval  # default for requests without one
+
+    async def latest(self, request):
+        q = request.query
+        interval = q.get("interval", self.interval)
+        symbol = q.get("symbol")
+        if symbol is None:
+            return web.json_response({s: _dict(k) for s, k in self.recent.latest_all(interval).items()})
+        k = self.recent.latest(symbol, interval)
+        if k is None:
+            raise web.HTTPNotFound(text=f"no {interval} klines for {symbol}")
+        return web.json_response(_dict(k))
+
+    async def klines(self, request):
+        q = request.query
+        if "symbol" not in q:
+            raise web.HTTPBadRequest(text="symbol is required")
+        try:
+            n = int(q.get("n", self.recent.size))
+        except ValueError:
+            raise web.HTTPBadRequest(text="n must be an integer")
+        klines = self.recent.last(q["symbol"], q.get("interval", self.interval), n)
+        return web.json_response([_dict(k) for k in klines])
+
+    async def subscribe(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        sub = self.recent.subscribe(_names(request.query.get("symbols")),
+                                    _names(request.query.get("intervals")))
+        pusher = asyncio.create_task(self._push(ws, sub))
+        try:
+            async for _ in ws:  # nothing to receive, but a close frame ends the loop
+                pass
+        finally:
+            pusher.cancel()
+            self.recent.unsubscribe(sub)
+        return ws
+
+    async def _push(self, ws, sub):
+        try:
+            while not ws.closed:
+                k = await sub.queue.get()
+                await ws.send_str(json.dumps(_dict(k)))
+        except (asyncio.CancelledError, ConnectionError):
+            raise
+        except Exception as e:
+            # close, so the client does not wait on a subscription that is gone
+            print(f"[RECENT] Subscriber push failed: {e!r}")
+            await ws.close()
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/latest", self.latest)
+        app.router.add_get("/klines", self.klines)
+        app.router.add_get("/subscribe", self.subscribe)
+        return app
+
+
+async def serve_recent(recent, port, host=HOST, interval="1m"):
+    """Serve the API on the running event loop; returns the runner (await runner.cleanup())."""
+    runner = web.AppRunner(RecentAPI(recent, interval).app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"[RECENT] Serving the last {recent.size} klines per symbol on http://{host}:{port}")
+    return runner
@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import datetime
+import importlib
+import os
+import time
+from capture import capture_files, read_frames
+from schema import ensure_kline_tables
+from sharded_runner import STREAM_MODULES
+from spool import Spool
+from sinks import get_sink
+from stream_writer import StreamWriter
+
+# ============================================================
+# Replay captured WebSocket frames into QuestDB
+#
+# Pushes frames recorded by capture.py through the stream module's
+# own handle_message -> KlineRouter (+ rollups) -> StreamWriter path:
+#   - real time (--speed 1, or faster/slower): keeps the recorded
+#     spacing, e.g. to reproduce a production incident
+#   - max speed (--speed 0): as fast as the writer drains, for load
+#     tests or to re-ingest the window of a QuestDB outage
+#     (--since/--until)
+# Re-ingesting is safe: the table is bootstrapped with DEDUP on
+# (timestamp, symbol, interval) first (see schema.py), and rollup bars
+# are only written for buckets the replay saw every minute of (see
+# rollups.py), so the partial buckets at the window's edges never
+# overwrite stored bars.
+#
+#   python replay.py futures capture/futures_stream --since 2024-05-01T10:00 --until 2024-05-01T12:00
+# ============================================================
+
+YIELD_EVERY = 1000  # frames between event loop yields
+REPLAY_SPOOL = "replay"  # under the module's SPOOL_DIR, apart from the live stream's
+
+
+def parse_time(value):
+    """ISO 8601 (UTC unless an offset is given) or epoch ms, as epoch ns."""
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value) * 1_000_000
+    t = datetime.datetime.fromisoformat(value)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=datetime.timezone.utc)
+    return int(t.timestamp() * 1_000_000_000)
+
+
+async def replay(module, frames, speed=0, mode=None):
+    """
+    Ingest (recv_ns, frame) pairs with the module's pipeline. speed is a
+    multiple of the recorded pace, 0 for as fast as possible. Returns the
+    number of frames replayed.
+    """
+    spool = Spool(os.path.join(module.SPOOL_DIR, REPLAY_SPOOL))
+    count = 0
+    sink = get_sink()
+    writer = StreamWriter(sink, spool=spool)
+    router = module.make_router(writer, mode or module.STREAM_MODE)
+    background = [asyncio.create_task(writer.run()), asyncio.create_task(router.run())]
+
+    started = time.monotonic()
+    first_ns = None
+    for recv_ns, raw in frames:
+        if speed:
+            if first_ns is None:
+                first_ns = recv_ns
+            delay = started + (recv_ns - first_ns) / 1e9 / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if count % YIELD_EVERY == 0:
+            # wait for the writer instead of overflowing its queue
+            while writer.queue.qsize() > writer.queue.maxsize // 2:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0)
+        module.handle_message(router, raw)
+        count += 1
+
+    # the router's last tick, then the writer's last batch
+    await asyncio.sleep(router.coalesce_ms / 1000)
+    while not writer.queue.empty():
+        await asyncio.sleep(0.01)
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+
+    spool.replay(sink.replay_url)
+    if spool.pending():
+        print(f"[REPLAY] QuestDB unavailable: batches left in {spool.directory}, "
+              f"run the replay again to deliver them")
+    spool.close()
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay captured kline frames into QuestDB")
+    parser.add_argument("market", choices=sorted(STREAM_MODULES))
+    parser.add_argument("paths", nargs="+", help="capture directories or segment files")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="multiple of the recorded pace, 0 = max speed (default)")
+    parser.add_argument("--since", help="first receive time (ISO 8601 UTC or epoch ms)")
+    parser.add_argument("--until", help="last receive time (ISO 8601 UTC or epoch ms)")
+    parser.add_argument("--mode", help="stream mode, default: the stream module's STREAM_MODE")
+    args = parser.parse_args()
+
+    module = importlib.import_module(STREAM_MODULES[args.market])
+    ensure_kline_tables([module.TABLE])
+    paths = [f for path in args.paths for f in capture_files(path)]
+    frames = read_frames(paths, parse_time(args.since), parse_time(args.until))
+    print(f"=== Replaying {len(paths)} capture segments into {module.TABLE} ===")
+    t0 = time.monotonic()
+    try:
+        n = asyncio.run(replay(module, frames, args.speed, args.mode))
+    except KeyboardInterrupt:
+        print("\n[SYS] Shutting down...")
+    else:
+        elapsed = time.monotonic() - t0
+        print(f"[REPLAY] {n} frames in {elapsed:.1f}s ({n / max(elapsed, 1e-9):,.0f} frames/s)")
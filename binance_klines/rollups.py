@@ -0,0 +1,294 @@
+import numpy as np
+import pandas as pd
+from decoders import Kline
+from columnar import ms_to_datetime
+
+# ============================================================
+# Higher-interval rollups from the 1m feed
+#
+# Bars for ROLLUP_INTERVALS are built from closed 1m klines and
+# written to the same table with `interval` set to the rollup
+# interval. A bar is emitted as soon as its bucket is complete.
+# The tables DEDUP on (timestamp, symbol, interval), so a partial bar
+# would overwrite the complete one already stored:
+#   - the stream emits complete buckets only; one it entered mid-way
+#     or skipped minutes of is dropped, and gaps.py rebuilds it from
+#     the 1m rows once they are repaired
+#   - a backfill emits a bucket with missing minutes at its end
+#     (drain()) only if its first minute was aggregated, so buckets
+#     entered mid-way at a resume seam or range start are dropped
+#
+# StreamRollup  - one closed kline at a time, O(1) per update, one
+#                 small list of running aggregates per (symbol, interval)
+# FrameRollup   - whole backfill frames with pandas groupby; partial
+#                 buckets at a frame's edges are carried over and
+#                 merged with the next frame
+# Buckets are aligned to UTC epoch multiples, so intervals must
+# divide a day.
+#
+# Handoff (main.py): when a backfill ends where a live stream began,
+# buckets that straddle the cutover are split between the two. The
+# stream holds its part of those bars (hold_before), the backfill
+# passes its part over (FrameRollup.take_open), and merge() emits
+# each seam bar once, complete.
+# ============================================================
+
+ROLLUP_INTERVALS = ("5m", "15m", "1h", "1d")
+BASE_INTERVAL = "1m"
+MINUTE_MS = 60_000
+
+INTERVAL_MS = {
+    "1m": 60_000, "3m": 180_000, "5m": 300_000, "15m": 900_000, "30m": 1_800_000,
+    "1h": 3_600_000, "2h": 7_200_000, "4h": 14_400_000, "6h": 21_600_000,
+    "8h": 28_800_000, "12h": 43_200_000, "1d": 86_400_000,
+}
+
+SUM_COLUMNS = ("volume", "quote_volume", "trades", "taker_base_volume", "taker_quote_volume")
+
+
+def _check_intervals(intervals):
+    for interval in intervals:
+        if interval not in INTERVAL_MS or interval == BASE_INTERVAL:
+            raise ValueError(f"Unsupported rollup interval {interval!r}")
+
+
+# ============================================================
+# Streaming
+# ============================================================
+class StreamRollup:
+    """
+    Emits a bar only once its bucket got every minute. A bucket the
+    stream entered mid-way or skipped minutes of is dropped when the
+    stream moves on; gaps.py rebuilds it from the repaired 1m rows.
+    """
+
+    def __init__(self, intervals=ROLLUP_INTERVALS):
+        _check_intervals(intervals)
+        self.intervals = [(i, INTERVAL_MS[i]) for i in intervals]
+        # (symbol, interval) -> [bucket, open, high, low, close, volume, quote_volume,
+        #                        trades, taker_base_volume, taker_quote_volume, minutes]
+        self.state = {}
+        # bars of buckets starting before this are held for merge() instead of emitted
+        self.hold_before = None
+        self.held = {}  # (symbol, interval, bucket) -> (bar, minutes)
+
+    @staticmethod
+    def _bar(symbol, interval, ms, s):
+        return Kline(symbol, interval, s[0], s[0] + ms - 1, s[1], s[2], s[3], s[4], s[5],
+                     s[6], s[7], s[8], s[9], True)
+
+    def update(self, k):
+        """Fold in one closed 1m kline; returns the bars it completed."""
+        if k.interval != BASE_INTERVAL or not k.closed:
+            return []
+        bars = []
+        for interval, ms in self.intervals:
+            bucket = k.open_time - k.open_time % ms
+            key = (k.symbol, interval)
+            s = self.state.get(key)
+            if s is not None and s[0] != bucket:
+                # the stream moved on without the bucket's last minute
+                s = None
+            if s is None:
+                s = self.state[key] = [
+                    bucket, k.open, k.high, k.low, k.close, k.volume, k.quote_volume,
+                    k.trades, k.taker_base_volume, k.taker_quote_volume, 1,
+                ]
+            else:
+                if k.high > s[2]:
+                    s[2] = k.high
+                if k.low < s[3]:
+                    s[3] = k.low
+                s[4] = k.close
+                s[5] += k.volume
+                s[6] += k.quote_volume
+                s[7] += k.trades
+                s[8] += k.taker_base_volume
+                s[9] += k.taker_quote_volume
+                s[10] += 1
+            if k.close_time == bucket + ms - 1:
+                del self.state[key]
+                bar = self._bar(k.symbol, interval, ms, s)
+                if self.hold_before is not None and bucket < self.hold_before:
+                    # merge() may complete it with the backfill's part
+                    self.held[(k.symbol, interval, bucket)] = (bar, s[10])
+                elif s[10] == ms // MINUTE_MS:
+                    bars.append(bar)
+        return bars
+
+    def merge(self, earlier):
+        """
+        Fold in a bar for the part of a bucket before the handoff (from the
+        backfill, which only hands over buckets complete up to it); returns
+        the bars to write now.
+        """
+        key = (earlier.symbol, earlier.interval)
+        ms = INTERVAL_MS[earlier.interval]
+        before = (self.hold_before - earlier.open_time) // MINUTE_MS
+        later, minutes = self.held.pop(key + (earlier.open_time,), (None, 0))
+        if later is not None:
+            if before + minutes != ms // MINUTE_MS:
+                return []  # the stream missed minutes: left for gaps.py
+            return [earlier._replace(
+                high=max(earlier.high, later.high),
+                low=min(earlier.low, later.low),
+                close=later.close,
+                volume=earlier.volume + later.volume,
+                quote_volume=earlier.quote_volume + later.quote_volume,
+                trades=earlier.trades + later.trades,
+                taker_base_volume=earlier.taker_base_volume + later.taker_base_volume,
+                taker_quote_volume=earlier.taker_quote_volume + later.taker_quote_volume,
+            )]
+        s = self.state.get(key)
+        if s is not None and s[0] == earlier.open_time:
+            # still open: the bar goes out when the stream closes it complete
+            s[1] = earlier.open
+            s[2] = max(s[2], earlier.high)
+            s[3] = min(s[3], earlier.low)
+            s[5] += earlier.volume
+            s[6] += earlier.quote_volume
+            s[7] += earlier.trades
+            s[8] += earlier.taker_base_volume
+            s[9] += earlier.taker_quote_volume
+            s[10] += before
+        # else the stream has nothing for this bucket: it stays partial
+        return []
+
+    def release(self):
+        """Stop holding; held bars nothing was merged into are incomplete and dropped."""
+        self.held = {}
+        self.hold_before = None
+        return []
+
+
+# ============================================================
+# Backfill frames
+# ============================================================
+def frame_klines(df):
+    """Kline tuples for the rows of a bars frame, e.g. from FrameRollup.take_open()."""
+    if not len(df):
+        return []
+    open_times = df["timestamp"].to_numpy().astype("datetime64[ms]").astype(np.int64)
+    close_times = df["close_time"].to_numpy().astype("datetime64[ms]").astype(np.int64)
+    columns = [df[c].to_numpy().tolist() for c in (
+        "symbol", "interval", "open", "high", "low", "close", "volume",
+        "quote_volume", "trades", "taker_base_volume", "taker_quote_volume",
+    )]
+    return [
+        Kline(symbol, interval, o_t, c_t, o, h, l, c, v, qv, n, tbv, tqv, True)
+        for o_t, c_t, (symbol, interval, o, h, l, c, v, qv, n, tbv, tqv)
+        in zip(open_times.tolist(), close_times.tolist(), zip(*columns))
+    ]
+
+
+class FrameRollup:
+
+    def __init__(self, intervals=ROLLUP_INTERVALS):
+        _check_intervals(intervals)
+        self.intervals = [(i, INTERVAL_MS[i]) for i in intervals]
+        self.pending = {interval: None for interval in intervals}
+
+    @staticmethod
+    def _aggregate(parts):
+        """Merge rows of (symbol, bucket, first, last, ohlc, sums, n) per bucket."""
+        keys = ["symbol", "bucket"]
+        parts = parts.sort_values("first", kind="stable")
+        grouped = parts.groupby(keys, sort=False)
+        out = grouped.agg(
+            first=("first", "min"), last=("last", "max"),
+            open=("open", "first"), high=("high", "max"), low=("low", "min"),
+            **{c: (c, "sum") for c in SUM_COLUMNS}, n=("n", "sum"),
+        )
+        out["close"] = parts.sort_values("last", kind="stable").groupby(keys, sort=False)["close"].last()
+        return out.reset_index()
+
+    def _bars(self, agg, interval, ms):
+        n = len(agg)
+        bucket = agg["bucket"].to_numpy()
+        return pd.DataFrame({
+            "symbol": pd.Categorical(agg["symbol"].to_numpy()),
+            "interval": pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), categories=[interval]),
+            "open": agg["open"].to_numpy(),
+            "high": agg["high"].to_numpy(),
+            "low": agg["low"].to_numpy(),
+            "close": agg["close"].to_numpy(),
+            "volume": agg["volume"].to_numpy(),
+            "close_time": ms_to_datetime(bucket + ms - 1),
+            "quote_volume": agg["quote_volume"].to_numpy(),
+            "trades": agg["trades"].to_numpy().astype(np.int64),
+            "taker_base_volume": agg["taker_base_volume"].to_numpy(),
+            "taker_quote_volume": agg["taker_quote_volume"].to_numpy(),
+            "timestamp": ms_to_datetime(bucket),
+        })
+
+    def add(self, df):
+        """
+        Fold in a 1m frame in the klines table layout (unfiltered); returns a
+        frame of the bars whose buckets are now complete.
+        """
+        if len(df) == 0:
+            return pd.DataFrame()
+        t = df["timestamp"].to_numpy().astype("datetime64[ms]").astype(np.int64)
+        base = pd.DataFrame({
+            "symbol": df["symbol"].astype(object).to_numpy(),
+            "first": t,
+            "last": t,
+            "open": df["open"].to_numpy(),
+            "high": df["high"].to_numpy(),
+            "low": df["low"].to_numpy(),
+            "close": df["close"].to_numpy(),
+            **{c: df[c].to_numpy() for c in SUM_COLUMNS},
+            "n": np.ones(len(df), dtype=np.int64),
+        })
+
+        bars = []
+        for interval, ms in self.intervals:
+            parts = base.assign(bucket=t - t % ms)
+            if self.pending[interval] is not None:
+                parts = pd.concat([self.pending[interval], parts], ignore_index=True)
+            agg = self._aggregate(parts)
+            complete = agg["n"].to_numpy() >= ms // INTERVAL_MS[BASE_INTERVAL]
+            self.pending[interval] = agg[~complete]
+            if complete.any():
+                bars.append(self._bars(agg[complete], interval, ms))
+        return pd.concat(bars, ignore_index=True) if bars else pd.DataFrame()
+
+    @staticmethod
+    def _started(agg):
+        """Mask of the buckets whose first minute was aggregated."""
+        return agg["first"].to_numpy() == agg["bucket"].to_numpy()
+
+    def take_open(self, after):
+        """
+        Remove the buckets still open that extend past `after` (ms); returns
+        the bars of those with every minute up to `after`, for a stream to
+        merge() at a handoff.
+        """
+        bars = []
+        for interval, ms in self.intervals:
+            agg = self.pending[interval]
+            if agg is None or not len(agg):
+                continue
+            straddles = agg["bucket"].to_numpy() + ms - 1 > after
+            if straddles.any():
+                minutes = (after + 1 - agg["bucket"].to_numpy()) // MINUTE_MS
+                handed = agg[straddles & (agg["n"].to_numpy() == minutes)]
+                if len(handed):
+                    bars.append(self._bars(handed, interval, ms))
+                self.pending[interval] = agg[~straddles]
+        return pd.concat(bars, ignore_index=True) if bars else pd.DataFrame()
+
+    def drain(self):
+        """
+        Bars for the buckets still open (the range's end, or missing minutes)
+        whose first minute was aggregated; buckets entered mid-way are dropped.
+        """
+        bars = []
+        for interval, ms in self.intervals:
+            agg = self.pending[interval]
+            if agg is not None and len(agg):
+                agg = agg[self._started(agg)]
+                if len(agg):
+                    bars.append(self._bars(agg, interval, ms))
+            self.pending[interval] = None
+        return pd.concat(bars, ignore_index=True) if bars else pd.DataFrame()
@@ -0,0 +1,148 @@
+import config
+from sinks import writes_questdb
+from questdb_query import QueryError, query, query_dicts
+
+# ============================================================
+# Table schema bootstrap
+#
+# Tables auto-created by ILP get whatever the server defaults are.
+# Every pipeline table is pre-created here instead: designated
+# timestamp, daily partitions, WAL, and DEDUP UPSERT KEYS of its
+# layout (klines: timestamp, symbol, interval; trades and depth, see
+# LAYOUTS). A row sent twice (page re-fetched on resume,
+# candle re-sent after a reconnect, spool replayed after a flush
+# that did land) then replaces the stored row instead of adding a
+# second one, and the coalesced stream rows of a candle collapse
+# into its latest state.
+#
+# Existing WAL tables get DEDUP enabled. Non-WAL tables are only
+# reported, since converting them needs a QuestDB restart.
+#
+#   python schema.py    # bootstrap every pipeline table
+# ============================================================
+
+DEDUP_KEYS = ("timestamp", "symbol", "interval")
+
+KLINE_COLUMNS = (
+    ("symbol", "SYMBOL"),
+    ("interval", "SYMBOL"),
+    ("open", "DOUBLE"),
+    ("high", "DOUBLE"),
+    ("low", "DOUBLE"),
+    ("close", "DOUBLE"),
+    ("volume", "DOUBLE"),
+    ("close_time", "TIMESTAMP"),
+    ("quote_volume", "DOUBLE"),
+    ("trades", "LONG"),
+    ("taker_base_volume", "DOUBLE"),
+    ("taker_quote_volume", "DOUBLE"),
+    ("timestamp", "TIMESTAMP"),
+)
+
+# aggTrade and depth-diff streams (event_streams.py)
+TRADE_COLUMNS = (
+    ("symbol", "SYMBOL"),
+    ("agg_id", "LONG"),
+    ("price", "DOUBLE"),
+    ("qty", "DOUBLE"),
+    ("first_id", "LONG"),
+    ("last_id", "LONG"),
+    ("buyer_maker", "BOOLEAN"),
+    ("event_time", "TIMESTAMP"),
+    ("timestamp", "TIMESTAMP"),  # trade time
+)
+
+DEPTH_COLUMNS = (
+    ("symbol", "SYMBOL"),
+    ("side", "SYMBOL"),  # "bid" or "ask"
+    ("price", "DOUBLE"),
+    ("qty", "DOUBLE"),  # new quantity at the level, 0 removes it
+    ("first_update_id", "LONG"),
+    ("final_update_id", "LONG"),
+    ("prev_update_id", "LONG"),  # futures only, -1 on spot
+    ("timestamp", "TIMESTAMP"),  # event time
+)
+
+# layout -> (columns, DEDUP keys)
+LAYOUTS = {
+    "klines": (KLINE_COLUMNS, DEDUP_KEYS),
+    "trades": (TRADE_COLUMNS, ("timestamp", "symbol", "agg_id")),
+    "depth": (DEPTH_COLUMNS, ("timestamp", "symbol", "final_update_id", "side", "price")),
+}
+
+
+def _keys(keys=DEDUP_KEYS):
+    # "interval" and "timestamp" are keywords, quote every name
+    return ", ".join(f'"{k}"' for k in keys)
+
+
+def create_table_sql(table, layout="klines"):
+    columns, keys = LAYOUTS[layout]
+    columns = ", ".join(f'"{name}" {kind}' for name, kind in columns)
+    return (
+        f"CREATE TABLE IF NOT EXISTS {table} ({columns})"
+        f' TIMESTAMP("timestamp") PARTITION BY DAY WAL'
+        f" DEDUP UPSERT KEYS({_keys(keys)})"
+    )
+
+
+def table_info(host, port, table):
+    """The tables() row of `table` as a dict, or None if it does not exist."""
+    rows = query_dicts(host, port, f"SELECT * FROM tables() WHERE table_name = '{table}'")
+    return rows[0] if rows else None
+
+
+def ensure_table(host, port, table, layout="klines"):
+    """Create `table` with the layout's schema, or enable DEDUP on it if it exists."""
+    keys = LAYOUTS[layout][1]
+    info = table_info(host, port, table)
+    if info is None:
+        query(host, port, create_table_sql(table, layout))
+        print(f"[SCHEMA] Created {table} (WAL, PARTITION BY DAY, DEDUP on {', '.join(keys)})")
+        return
+    if info.get("designatedTimestamp") != "timestamp":
+        print(f"[SCHEMA] {table} has no designated timestamp column 'timestamp', cannot deduplicate it")
+        return
+    if not info.get("walEnabled"):
+        print(f"[SCHEMA] {table} is not a WAL table, so it cannot deduplicate. Convert it with "
+              f"ALTER TABLE {table} SET TYPE WAL and restart QuestDB")
+        return
+    if not info.get("dedup"):
+        query(host, port, f"ALTER TABLE {table} DEDUP ENABLE UPSERT KEYS({_keys(keys)})")
+        print(f"[SCHEMA] Enabled DEDUP on {table} ({', '.join(keys)})")
+
+
+def ensure_tables(tables, layout="klines", host=None, port=None):
+    """
+    ensure_table() for each table. Failures are reported, not raised:
+    ingestion still works (ILP creates missing tables), only without DEDUP.
+    Nothing to do when the configured sink is not QuestDB.
+    """
+    if not writes_questdb():
+        return
+    host = host or config.get("questdb", "host")
+    port = port or config.get("questdb", "port")
+    for table in dict.fromkeys(tables):
+        try:
+            ensure_table(host, port, table, layout)
+        except (QueryError, OSError, ValueError) as e:
+            print(f"[SCHEMA] Could not bootstrap {table}: {e}")
+
+
+def ensure_kline_tables(tables, host=None, port=None):
+    ensure_tables(tables, "klines", host, port)
+
+
+if __name__ == "__main__":
+    import event_streams
+    import future_backfill
+    import future_stream
+    import spot_backfill
+    import spot_stream
+
+    ensure_kline_tables([
+        spot_backfill.TABLE, spot_stream.TABLE, future_backfill.TABLE, future_stream.TABLE,
+    ])
+    for market in event_streams.MARKETS:
+        for kind, layout in event_streams.TABLE_SUFFIX.items():
+            ensure_tables([event_streams.table_name(market, kind)], layout)
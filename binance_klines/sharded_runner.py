@@ -0,0 +1,222 @@
+import asyncio
+import importlib
+import multiprocessing as mp
+import os
+import queue
+import sys
+import time
+import metrics
+from schema import ensure_kline_tables
+
+# ============================================================
+# Multi-process sharded streaming runner
+#
+# The symbol universe is split across N worker processes (one per
+# core by default). Each shard runs the stream module's run_streams()
+# with its own event loop, connections and sink (sinks.py). The
+# supervisor restarts dead shards, follows exchangeInfo, and moves
+# symbols between shards so their message rates stay balanced.
+# Reassignments are applied with live SUBSCRIBE/UNSUBSCRIBE, so
+# shards never reconnect to change their symbol set.
+# ============================================================
+
+STREAM_MODULES = {"spot": "spot_stream", "futures": "future_stream"}
+
+CHECK_INTERVAL = 5  # seconds between supervisor passes
+STATS_INTERVAL = 10  # seconds between shard rate reports
+REBALANCE_INTERVAL = 300  # seconds between rebalances / exchangeInfo refreshes
+IMBALANCE_TOLERANCE = 1.25  # rebalance when the busiest shard exceeds mean * this
+RATE_DECAY = 0.5  # EWMA weight of the newest rate sample
+
+
+# ============================================================
+# Shard process
+# ============================================================
+async def _control_updates(control_q):
+    """Yield symbol lists sent by the supervisor."""
+    while True:
+        try:
+            yield control_q.get_nowait()
+        except queue.Empty:
+            await asyncio.sleep(1)
+
+
+async def _report_rates(shard_id, counts, stats_q):
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        snapshot = dict(counts)
+        counts.clear()
+        stats_q.put((shard_id, {s: n / STATS_INTERVAL for s, n in snapshot.items()}))
+
+
+async def _shard(module, shard_id, symbols, control_q, stats_q):
+    counts = {}
+    await asyncio.gather(
+        # shards must not share a spool or capture directory
+        module.run_streams(
+            symbols, _control_updates(control_q), counts,
+            spool_dir=os.path.join(module.SPOOL_DIR, f"shard{shard_id}"),
+            capture_dir=module.CAPTURE_DIR and os.path.join(module.CAPTURE_DIR, f"shard{shard_id}"),
+            recent_port=module.RECENT_PORT + 1 + shard_id,
+        ),
+        _report_rates(shard_id, counts, stats_q),
+    )
+
+
+def shard_main(market, shard_id, symbols, control_q, stats_q):
+    module = importlib.import_module(STREAM_MODULES[market])
+    print(f"[SHARD {shard_id}] pid={os.getpid()} starting with {len(symbols)} symbols")
+    metrics.set_constant_labels(shard=shard_id)
+    try:
+        metrics.serve(module.METRICS_PORT + 1 + shard_id)
+    except OSError as e:
+        print(f"[SHARD {shard_id}] Metrics endpoint unavailable: {e}")
+    try:
+        asyncio.run(_shard(module, shard_id, symbols, control_q, stats_q))
+    except KeyboardInterrupt:
+        pass
+
+
+# ============================================================
+# Assignment
+# ============================================================
+def assign_round_robin(symbols, shards):
+    assignment = [[] for _ in range(shards)]
+    for i, symbol in enumerate(sorted(symbols)):
+        assignment[i % shards].append(symbol)
+    return assignment
+
+
+def rebalance(assignment, symbols, rates):
+    """
+    Drop delisted symbols, place new ones on the lightest shard, then move
+    single symbols from the busiest to the lightest shard while that
+    narrows the spread. Returns the new assignment (lists of symbols).
+    """
+    wanted = set(symbols)
+    known = [sym for shard in assignment for sym in shard]
+    default_rate = sum(rates.values()) / len(rates) if rates else 1.0
+
+    def rate(sym):
+        return rates.get(sym, default_rate)
+
+    shards = [[sym for sym in shard if sym in wanted] for shard in assignment]
+    load = [sum(rate(sym) for sym in shard) for shard in shards]
+
+    for sym in sorted(wanted.difference(known)):
+        i = load.index(min(load))
+        shards[i].append(sym)
+        load[i] += rate(sym)
+
+    mean = sum(load) / len(load)
+    for _ in range(len(wanted)):
+        hi = load.index(max(load))
+        lo = load.index(min(load))
+        if mean == 0 or load[hi] <= mean * IMBALANCE_TOLERANCE:
+            break
+        gap = load[hi] - load[lo]
+        # the symbol whose move best halves the gap
+        candidates = [sym for sym in shards[hi] if 0 < rate(sym) < gap]
+        if not candidates:
+            break
+        sym = min(candidates, key=lambda s: abs(gap / 2 - rate(s)))
+        shards[hi].remove(sym)
+        shards[lo].append(sym)
+        load[hi] -= rate(sym)
+        load[lo] += rate(sym)
+
+    return shards
+
+
+# ============================================================
+# Supervisor
+# ============================================================
+class Supervisor:
+
+    def __init__(self, market, shards=None):
+        self.market = market
+        self.module = importlib.import_module(STREAM_MODULES[market])
+        self.shards = shards or os.cpu_count() or 1
+        self.ctx = mp.get_context("spawn")
+        self.stats_q = self.ctx.Queue()
+        self.control_qs = [self.ctx.Queue() for _ in range(self.shards)]
+        self.procs = [None] * self.shards
+        self.assignment = []
+        self.rates = {}
+
+    def _start(self, shard_id):
+        proc = self.ctx.Process(
+            target=shard_main,
+            args=(self.market, shard_id, self.assignment[shard_id],
+                  self.control_qs[shard_id], self.stats_q),
+            daemon=True,
+        )
+        proc.start()
+        self.procs[shard_id] = proc
+
+    def _collect_stats(self):
+        while True:
+            try:
+                _, shard_rates = self.stats_q.get_nowait()
+            except queue.Empty:
+                return
+            for sym, r in shard_rates.items():
+                self.rates[sym] = RATE_DECAY * r + (1 - RATE_DECAY) * self.rates.get(sym, r)
+
+    def _restart_dead(self):
+        for shard_id, proc in enumerate(self.procs):
+            if not proc.is_alive():
+                print(f"[SUP] Shard {shard_id} exited (code {proc.exitcode}), restarting")
+                self._start(shard_id)
+
+    def _rebalance(self):
+        try:
+            symbols = self.module.load_symbols()
+        except Exception as e:
+            print("[SUP] Symbol refresh failed:", e)
+            symbols = [sym for shard in self.assignment for sym in shard]
+
+        new_assignment = rebalance(self.assignment, symbols, self.rates)
+        for shard_id, (old, new) in enumerate(zip(self.assignment, new_assignment)):
+            if set(old) != set(new):
+                self.control_qs[shard_id].put(new)
+        self.assignment = new_assignment
+        live = set(symbols)
+        self.rates = {sym: r for sym, r in self.rates.items() if sym in live}
+
+        loads = [sum(self.rates.get(sym, 0) for sym in shard) for shard in self.assignment]
+        print("[SUP] Shard loads (msg/s):", ", ".join(f"{load:.1f}" for load in loads))
+
+    def run(self):
+        ensure_kline_tables([self.module.TABLE])
+        symbols = self.module.load_symbols()
+        print(f"[SUP] {len(symbols)} {self.market} symbols across {self.shards} shards")
+        self.assignment = assign_round_robin(symbols, self.shards)
+        for shard_id in range(self.shards):
+            self._start(shard_id)
+
+        next_rebalance = time.monotonic() + REBALANCE_INTERVAL
+        while True:
+            time.sleep(CHECK_INTERVAL)
+            self._collect_stats()
+            self._restart_dead()
+            if time.monotonic() >= next_rebalance:
+                self._rebalance()
+                next_rebalance = time.monotonic() + REBALANCE_INTERVAL
+
+
+# ============================================================
+# MAIN
+# ============================================================
+if __name__ == "__main__":
+    market = sys.argv[1] if len(sys.argv) > 1 else "futures"
+    shards = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    print(f"=== Sharded Binance {market} → QuestDB Streamer ===")
+    supervisor = Supervisor(market, shards)
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        print("\n[SYS] Shutting down...")
+        for proc in supervisor.procs:
+            if proc is not None:
+                proc.terminate()
@@ -0,0 +1,340 @@
+import atexit
+import os
+import threading
+import time
+import pandas as pd
+from questdb.ingress import Buffer, Sender, TimestampMicros, TimestampNanos
+import config
+
+# ============================================================
+# Ingest sinks
+#
+# Everything that writes rows goes through a sink with the part of
+# the QuestDB Sender interface the pipeline uses: new_buffer() for a
+# buffer with row()/dataframe(), and flush(buf). Targets (config
+# [sink] target, or get_sink(target)):
+#   "questdb"            - the configured QuestDB, ILP over [sink]
+#                          transport (http or tcp)
+#   "http::addr=...;"    - any QuestDB Sender conf string
+#   "parquet:<dir>"      - one Parquet file per table per flush under
+#                          <dir>/<table>/, to run offline
+#   "null"               - serializes ILP and discards it (client
+#                          cost without a database)
+#   "count"              - counts rows per table, nothing else
+# Sinks are shared per process: get_sink() returns the same one for
+# the same target. A QuestDB sink keeps a pool of at most pool_size
+# senders, so connections stay bounded however many writers (stream
+# writers, backfill threads) use it. Pooled senders have auto-flush
+# off: callers flush their own buffers on their own triggers.
+# ============================================================
+
+TARGET = config.get("sink", "target")
+TRANSPORT = config.get("sink", "transport")
+TCP_PORT = config.get("sink", "tcp_port")
+POOL_SIZE = config.get("sink", "pool_size")
+INIT_BUF_SIZE = config.get("sink", "init_buf_size")
+MAX_BUF_SIZE = config.get("sink", "max_buf_size")  # backfill frames are large
+RETRY_TIMEOUT = config.get("sink", "retry_timeout")  # ms, HTTP only
+ROW_BYTES = 160  # size estimate of one kline row for buffers that do not serialize
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+def _with_defaults(conf, **options):
+    """Append options the conf string does not set already."""
+    conf = conf if conf.endswith(";") else conf + ";"
+    for key, value in options.items():
+        if f"{key}=" not in conf:
+            conf += f"{key}={value};"
+    return conf
+
+
+def questdb_conf(transport=TRANSPORT):
+    """Sender conf for the configured QuestDB over ILP/HTTP or ILP/TCP."""
+    host = config.get("questdb", "host")
+    port = config.get("questdb", "port") if transport == "http" else TCP_PORT
+    return f"{transport}::addr={host}:{port};"
+
+
+# ============================================================
+# QuestDB
+# ============================================================
+class QuestDBSink:
+    """A bounded pool of established senders for one conf."""
+
+    is_questdb = True
+
+    def __init__(self, conf, pool_size=POOL_SIZE):
+        scheme = conf.partition("::")[0]
+        options = {"auto_flush": "off", "init_buf_size": INIT_BUF_SIZE, "max_buf_size": MAX_BUF_SIZE}
+        if scheme.startswith("http"):
+            options["retry_timeout"] = RETRY_TIMEOUT
+        self.conf = _with_defaults(conf, **options)
+        self.pool_size = pool_size
+        self.idle = []  # established senders, most recently used last
+        self.created = 0
+        # guards idle/created; notified whenever a sender or a slot frees up
+        self.available = threading.Condition()
+        self.buffer_options = None  # Buffer() arguments, known once a sender is established
+        addr = dict(p.split("=", 1) for p in self.conf.partition("::")[2].split(";") if p)["addr"]
+        host = addr.rpartition(":")[0]
+        # the spool replays ILP over HTTP, also when rows go out over TCP
+        if scheme.startswith("http"):
+            self.replay_url = f"{scheme}://{addr}/write"
+        else:
+            self.replay_url = f"http://{host}:{config.get('questdb', 'port')}/write"
+
+    def _connect(self):
+        sender = Sender.from_conf(self.conf)
+        sender.establish()
+        if self.buffer_options is None:
+            # HTTP senders learn the protocol version from the server
+            self.buffer_options = {
+                "init_buf_size": sender.init_buf_size,
+                "max_name_len": sender.max_name_len,
+                "protocol_version": sender.protocol_version,
+            }
+        return sender
+
+    def _acquire(self):
+        """An idle sender, or a new one if the pool has room; waits for either."""
+        with self.available:
+            while not self.idle and self.created >= self.pool_size:
+                self.available.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.created += 1
+        try:
+            return self._connect()
+        except Exception:
+            self._free_slot()
+            raise
+
+    def _free_slot(self):
+        with self.available:
+            self.created -= 1
+            # a waiter may connect in its place
+            self.available.notify()
+
+    def _release(self, sender, broken=False):
+        if broken:
+            # connection state unknown after an error: reconnect next time
+            self._free_slot()
+            try:
+                sender.close()
+            except Exception:
+                pass
+            return
+        with self.available:
+            self.idle.append(sender)
+            self.available.notify()
+
+    def new_buffer(self):
+        if self.buffer_options is None:
+            self._release(self._acquire())
+        return Buffer(**self.buffer_options)
+
+    def flush(self, buf):
+        sender = self._acquire()
+        try:
+            sender.flush(buf)
+        except Exception:
+            self._release(sender, broken=True)
+            raise
+        self._release(sender)
+
+    def close(self):
+        with self.available:
+            idle, self.idle = self.idle, []
+        for sender in idle:
+            sender.close()
+
+
+# ============================================================
+# Offline sinks
+# ============================================================
+def _timestamp_ns(value):
+    if isinstance(value, TimestampNanos):
+        return value.value
+    if isinstance(value, TimestampMicros):
+        return value.value * 1000
+    return None
+
+
+class RecordBuffer:
+    """Rows and frames per table, for sinks that are not ILP."""
+
+    def __init__(self):
+        self.rows = {}  # table -> [dict]
+        self.frames = {}  # table -> [DataFrame]
+        self.timestamps = set()  # (table, column) holding ns timestamps
+        self.size = 0
+
+    def row(self, table, symbols=None, columns=None, at=None):
+        record = dict(symbols or {})
+        for name, value in (columns or {}).items():
+            ns = _timestamp_ns(value)
+            if ns is not None:
+                self.timestamps.add((table, name))
+                value = ns
+            record[name] = value
+        record["timestamp"] = _timestamp_ns(at)
+        self.rows.setdefault(table, []).append(record)
+        self.size += ROW_BYTES
+
+    def dataframe(self, df, table_name=None, symbols=None, at=None):
+        if isinstance(at, str) and at != "timestamp":
+            df = df.rename(columns={at: "timestamp"})
+        self.frames.setdefault(table_name, []).append(df)
+        self.size += len(df) * ROW_BYTES
+
+    def tables(self):
+        """{table: DataFrame} of everything buffered."""
+        out = {}
+        for table in set(self.rows) | set(self.frames):
+            parts = list(self.frames.get(table, []))
+            if table in self.rows:
+                df = pd.DataFrame(self.rows[table])
+                for column in ["timestamp"] + [c for t, c in self.timestamps if t == table]:
+                    df[column] = pd.to_datetime(df[column], unit="ns")
+                parts.append(df)
+            out[table] = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+        return out
+
+    def __len__(self):
+        return self.size
+
+
+class ParquetSink:
+    """Writes each flushed buffer as one Parquet file per table."""
+
+    is_questdb = False
+    replay_url = None
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def new_buffer(self):
+        return RecordBuffer()
+
+    def flush(self, buf):
+        for table, df in buf.tables().items():
+            with self.lock:
+                self.seq += 1
+                seq = self.seq
+            path = os.path.join(self.directory, table)
+            os.makedirs(path, exist_ok=True)
+            df.to_parquet(os.path.join(path, f"{time.time_ns()}-{os.getpid()}-{seq:06d}.parquet"),
+                          index=False)
+
+    def close(self):
+        pass
+
+
+class CountingBuffer:
+    """Counts rows per table without keeping them."""
+
+    def __init__(self):
+        self.counts = {}
+        self.size = 0
+
+    def row(self, table, symbols=None, columns=None, at=None):
+        self.counts[table] = self.counts.get(table, 0) + 1
+        self.size += ROW_BYTES
+
+    def dataframe(self, df, table_name=None, symbols=None, at=None):
+        self.counts[table_name] = self.counts.get(table_name, 0) + len(df)
+        self.size += len(df) * ROW_BYTES
+
+    def __len__(self):
+        return self.size
+
+
+class CountingSink:
+
+    is_questdb = False
+    replay_url = None
+
+    def __init__(self):
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def new_buffer(self):
+        return CountingBuffer()
+
+    def flush(self, buf):
+        with self.lock:
+            for table, n in buf.counts.items():
+                self.counts[table] = self.counts.get(table, 0) + n
+        buf.counts = {}
+        buf.size = 0
+
+    @property
+    def rows(self):
+        return sum(self.counts.values())
+
+    def close(self):
+        for table, n in sorted(self.counts.items()):
+            print(f"[SINK] {table}: {n} rows")
+
+
+class NullSink:
+    """Serializes rows as ILP like a QuestDB sink, then drops them."""
+
+    is_questdb = False
+    replay_url = None
+
+    def new_buffer(self):
+        return Buffer(protocol_version=2)
+
+    def flush(self, buf):
+        buf.clear()
+
+    def close(self):
+        pass
+
+
+# ============================================================
+# Shared sinks
+# ============================================================
+def writes_questdb(target=None):
+    """Whether `target` (default: [sink] target) is a QuestDB sink."""
+    target = target or TARGET
+    return target == "questdb" or "::" in target
+
+
+def open_sink(target):
+    """A new sink for `target` (see the header)."""
+    if target == "questdb":
+        return QuestDBSink(questdb_conf())
+    if "::" in target:
+        return QuestDBSink(target)
+    if target.startswith("parquet:"):
+        return ParquetSink(target[len("parquet:"):])
+    if target == "null":
+        return NullSink()
+    if target == "count":
+        return CountingSink()
+    raise ValueError(f"Unknown sink target {target!r}")
+
+
+def get_sink(target=None):
+    """The process-wide sink for `target` (default: [sink] target)."""
+    target = target or TARGET
+    with _sinks_lock:
+        sink = _sinks.get(target)
+        if sink is None:
+            sink = _sinks[target] = open_sink(target)
+        return sink
+
+
+@atexit.register
+def close_sinks():
+    with _sinks_lock:
+        sinks = list(_sinks.values())
+        _sinks.clear()
+    for sink in sinks:
+        sink.close()
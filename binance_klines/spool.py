@@ -0,0 +1,288 @@
+import asyncio
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+import requests
+from http_client import session
+from metrics import FLUSH_BYTES, FLUSH_FAILURES, FLUSH_SECONDS, REPLAYED_BATCHES, SPOOLED_BATCHES
+
+# ============================================================
+# Local write-ahead spool for QuestDB batches
+#
+# When a flush fails, its ILP bytes are appended to an on-disk log
+# instead of being lost. While anything is spooled, new batches are
+# appended behind it too, so QuestDB receives everything in the
+# original order once the spool is replayed to its /write endpoint.
+#
+# Layout: fixed-size, memory-mapped segment files that are written
+# append-only. Each record is [u32 length][u32 crc32][payload]. A
+# zero length or a bad crc marks the end of the valid data, so a torn
+# write from a crash is cut off on restart. A cursor file records how
+# far replay has got. A segment is deleted once it is fully replayed.
+#
+# Eviction: when the segments exceed max_bytes, the oldest segment is
+# deleted, replayed or not, and the dropped bytes are reported. Disk
+# usage stays bounded and the newest data is kept. `losses` counts
+# evictions of unreplayed data and batches QuestDB rejected, so
+# callers can tell that spooled rows never arrived (see
+# CheckpointStore.commit_delivered).
+# ============================================================
+
+SEGMENT_BYTES = 64 * 1024 * 1024
+MAX_BYTES = 2 * 1024 * 1024 * 1024
+REPLAY_TIMEOUT = (3, 60)  # connect, read (seconds)
+REPLAY_BACKOFF = 5  # seconds between replay attempts while QuestDB is down
+
+RECORD_HEADER = struct.Struct("<II")
+
+
+class Spool:
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, max_bytes=MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.evicted_bytes = 0
+        self.losses = 0  # evictions of unreplayed data + rejected batches
+        self.next_attempt = 0.0
+
+        self.segments = sorted(
+            int(name[:-4]) for name in os.listdir(directory) if name.endswith(".seg")
+        )
+        self.read_seg, self.read_off = self._load_cursor()
+        self.read_map = None  # (segment id, file, mmap) of an older segment being replayed
+
+        if self.segments:
+            self._open_active(self.segments[-1])
+        else:
+            self._create_active(1, segment_bytes)
+        if self.read_seg not in self.segments:
+            self.read_seg, self.read_off = self.segments[0], 0
+
+        if self.pending():
+            print(f"[SPOOL] {directory}: {len(self.segments)} segments waiting for replay")
+
+    # ------------------------------------------------------------
+    # segment files
+    # ------------------------------------------------------------
+    def _path(self, seg_id):
+        return os.path.join(self.directory, f"{seg_id:012d}.seg")
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, "cursor")) as f:
+                seg_id, offset = f.read().split()
+                return int(seg_id), int(offset)
+        except (FileNotFoundError, ValueError):
+            return 0, 0
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, "cursor")
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{self.read_seg} {self.read_off}")
+        os.replace(path + ".tmp", path)
+
+    def _create_active(self, seg_id, size):
+        with open(self._path(seg_id), "wb") as f:
+            f.truncate(size)
+        self.segments.append(seg_id)
+        self._open_active(seg_id)
+
+    def _open_active(self, seg_id):
+        self.active = seg_id
+        self.file = open(self._path(seg_id), "r+b")
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        # resume after the last intact record
+        self.write_off = 0
+        for _, end, _ in self._records(self.mm, 0):
+            self.write_off = end
+
+    def _records(self, mm, offset):
+        """Yield (start, end, payload) for intact records from offset on."""
+        while offset + RECORD_HEADER.size <= len(mm):
+            length, crc = RECORD_HEADER.unpack_from(mm, offset)
+            start = offset + RECORD_HEADER.size
+            if length == 0 or start + length > len(mm):
+                return
+            payload = mm[start:start + length]
+            if zlib.crc32(payload) != crc:
+                print(f"[SPOOL] Corrupt record in {self.directory} at offset {offset}, "
+                      "skipping the rest of the segment")
+                return
+            yield offset, start + length, payload
+            offset = start + length
+
+    def _segment_map(self, seg_id):
+        if seg_id == self.active:
+            return self.mm
+        if self.read_map is None or self.read_map[0] != seg_id:
+            self._close_read_map()
+            f = open(self._path(seg_id), "rb")
+            self.read_map = (seg_id, f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        return self.read_map[2]
+
+    def _close_read_map(self):
+        if self.read_map is not None:
+            self.read_map[2].close()
+            self.read_map[1].close()
+            self.read_map = None
+
+    def _drop_segment(self, seg_id):
+        if self.read_map is not None and self.read_map[0] == seg_id:
+            self._close_read_map()
+        self.segments.remove(seg_id)
+        os.remove(self._path(seg_id))
+
+    def _evict(self):
+        while len(self.segments) > 1:
+            sizes = {s: os.path.getsize(self._path(s)) for s in self.segments}
+            if sum(sizes.values()) <= self.max_bytes:
+                return
+            oldest = self.segments[0]
+            if self.read_seg == oldest:
+                lost = sizes[oldest] - self.read_off
+                self.evicted_bytes += lost
+                self.losses += 1
+                print(f"[SPOOL] Spool over {self.max_bytes} bytes: evicted segment {oldest} "
+                      f"with up to {lost} unreplayed bytes")
+                self.read_seg, self.read_off = self.segments[1], 0
+                self._save_cursor()
+            self._drop_segment(oldest)
+
+    # ------------------------------------------------------------
+    # producer side
+    # ------------------------------------------------------------
+    def append(self, payload):
+        payload = bytes(payload)
+        need = RECORD_HEADER.size + len(payload)
+        with self.lock:
+            if self.write_off + need > len(self.mm):
+                # replay reopens the old segment read-only if it still needs it
+                self.mm.flush()
+                self.mm.close()
+                self.file.close()
+                self._create_active(self.active + 1, max(self.segment_bytes, need))
+                self._evict()
+            RECORD_HEADER.pack_into(self.mm, self.write_off, len(payload), zlib.crc32(payload))
+            start = self.write_off + RECORD_HEADER.size
+            self.mm[start:start + len(payload)] = payload
+            self.mm.flush()
+            self.write_off += need
+
+    def pending(self):
+        with self.lock:
+            return self.read_seg != self.active or self.read_off < self.write_off
+
+    # ------------------------------------------------------------
+    # replay side
+    # ------------------------------------------------------------
+    def _next(self):
+        """Next unreplayed (position, payload), dropping consumed segments."""
+        while True:
+            mm = self._segment_map(self.read_seg)
+            if self.read_seg == self.active and self.read_off >= self.write_off:
+                return None
+            record = next(self._records(mm, self.read_off), None)
+            if record is not None:
+                _, end, payload = record
+                return (self.read_seg, end), payload
+            if self.read_seg == self.active:
+                return None
+            consumed = self.read_seg
+            self.read_seg = self.segments[self.segments.index(consumed) + 1]
+            self.read_off = 0
+            self._drop_segment(consumed)
+            self._save_cursor()
+
+    def _ack(self, position):
+        seg_id, offset = position
+        if (seg_id, offset) > (self.read_seg, self.read_off):
+            self.read_seg, self.read_off = seg_id, offset
+            self._save_cursor()
+
+    def replay(self, url):
+        """
+        Post spooled batches to QuestDB in order until the spool is empty or a
+        batch cannot be delivered. Returns the number of batches delivered.
+        """
+        if url is None or time.monotonic() < self.next_attempt:
+            return 0
+        sent = 0
+        while True:
+            with self.lock:
+                record = self._next()
+            if record is None:
+                break
+            position, payload = record
+            try:
+                r = session().post(url, data=payload, timeout=REPLAY_TIMEOUT)
+                if r.status_code >= 500:
+                    r.raise_for_status()
+            except requests.RequestException as e:
+                print(f"[SPOOL] Replay paused, QuestDB unavailable: {e}")
+                self.next_attempt = time.monotonic() + REPLAY_BACKOFF
+                break
+            if r.status_code >= 400:
+                # a rejected batch would block the spool forever
+                print(f"[SPOOL] QuestDB rejected a spooled batch ({r.status_code}), dropping it: "
+                      f"{r.text[:200]}")
+                self.losses += 1
+            with self.lock:
+                self._ack(position)
+            REPLAYED_BATCHES.inc()
+            sent += 1
+        if sent:
+            print(f"[SPOOL] Replayed {sent} batches from {self.directory}")
+        return sent
+
+    def close(self):
+        with self.lock:
+            self._close_read_map()
+            self.mm.flush()
+            self.mm.close()
+            self.file.close()
+
+
+def flush_or_spool(sink, buf, spool):
+    """
+    Flush buf to the sink (see sinks.py). If earlier batches are still
+    spooled, or the flush fails, append buf to the spool instead. Without a
+    spool, or for sinks that are not QuestDB, errors propagate. Returns True
+    if buf was sent directly.
+    """
+    if not len(buf):
+        return True
+    if sink.replay_url is None:
+        spool = None  # only ILP batches bound for QuestDB can be replayed
+    size = len(buf)
+    if spool is not None and spool.pending():
+        spool.append(bytes(buf))
+        SPOOLED_BATCHES.inc()
+        return False
+    started = time.monotonic()
+    try:
+        sink.flush(buf)
+    except Exception as e:
+        FLUSH_FAILURES.inc()
+        if spool is None:
+            raise
+        print(f"[SPOOL] Flush failed ({e}), spooling {len(buf)} bytes")
+        spool.append(bytes(buf))
+        SPOOLED_BATCHES.inc()
+        return False
+    FLUSH_SECONDS.observe(time.monotonic() - started)
+    FLUSH_BYTES.observe(size)
+    return True
+
+
+async def replay_loop(spool, url, interval=REPLAY_BACKOFF):
+    """Keep draining the spool from a thread so the event loop never waits on QuestDB."""
+    while True:
+        await asyncio.sleep(interval)
+        if spool.pending():
+            await asyncio.to_thread(spool.replay, url)
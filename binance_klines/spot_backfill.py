@@ -1,144 +1,198 @@
-import datetime
-import time
-import json
-import os
-from questdb.ingress import Sender, TimestampNanos
-from utils import spot_fetch_klines, get_spot_symbols
-
-QUEST_HOST = "82.29.166.107"
-QUEST_PORT = 9000
-conf = f"http::addr={QUEST_HOST}:{QUEST_PORT};"
+import threading
+import config
+from utils import spot_fetch_klines
+from symbol_registry import get_registry
+from columnar import KlineFrameBuffer, ingest_frame
+from rollups import FrameRollup
+from checkpoint import CheckpointStore
+from questdb_query import latest_timestamps
+from spool import Spool, flush_or_spool
+from sinks import get_sink
+from archive_import import import_archives
+from listing import first_kline_times
+from backfill_engine import PageTuner, make_jobs, run_backfill, window_span
+from rate_limit import best_klines_limit, shared_limiter
+from schema import ensure_kline_tables
+from metrics import serve
+
+QUEST_HOST = config.get("questdb", "host")
+QUEST_PORT = config.get("questdb", "port")
 
 INTERVAL = "1m"
 
-# Date boundaries
-DATE_FROM = int(datetime.datetime(2022, 1, 1).timestamp() * 1000)
-DATE_TO   = int(datetime.datetime(2024, 12, 31, 23, 59, 59).timestamp() * 1000)
-
-PROGRESS_FILE = "spot_progress.json"
-
+# Date boundaries: [spot] date_from / date_to in the config (UTC)
+DATE_FROM = config.date_ms("spot", "date_from")
+DATE_TO   = config.date_ms("spot", "date_to")
 
-# ---------------- Progress helpers ----------------
-def load_progress():
-    if not os.path.exists(PROGRESS_FILE):
-        return None, None
-    with open(PROGRESS_FILE, "r") as f:
-        data = json.load(f)
-        ts = data.get("timestamp")
-        # Fix for accidentally saved seconds
-        if ts is not None and ts < 10_000_000_000:
-            ts *= 1000
-        return data.get("symbol"), ts
-
-
-def save_progress(symbol, timestamp):
-    with open(PROGRESS_FILE, "w") as f:
-        json.dump({"symbol": symbol, "timestamp": timestamp}, f)
+# "checkpoint": resume from the local range store
+# "questdb":    resume each symbol from max(timestamp) in the table itself
+RESUME_MODE = "checkpoint"
+TABLE = "spot_klines"
+MARKET = "spot"
+BATCH_LIMIT = best_klines_limit(MARKET)  # most rows per request weight; backfills tune it live
+WORKERS = 8  # concurrent fetch threads
+# monthly/daily archive files (mirror URL or local directory), None for REST only
+ARCHIVE_SOURCE = "https://data.binance.vision"
+ROLLUP_INTERVALS = ("5m", "15m", "1h", "1d")  # bars built from the 1m rows, () for none
+SPOOL_DIR = "spool/spot_backfill"  # batches that could not reach QuestDB
+METRICS_PORT = 9301  # Prometheus endpoint (rows, flushes, REST weight and 429s)
 
 
 # ---------------- Ingest batch ----------------
-def ingest_batch(sender, rows, symbol, interval):
-    for r in rows:
-        open_time = r[0]
-
-        # Safety filter
-        if open_time < DATE_FROM or open_time > DATE_TO:
+def ingest_batch(buf, frames):
+    # Safety filter on open_time is applied as a mask when the frame is built
+    frames.write(buf)
+
+
+# ---------------- Resume planning ----------------
+def plan_from_checkpoints(store, starts, date_to=DATE_TO):
+    """Fetch plan made of each symbol's ranges missing from the store."""
+    plan = []
+    for symbol, symbol_start in starts.items():
+        missing = store.missing(MARKET, symbol, INTERVAL, symbol_start, date_to)
+        if not missing:
+            print(f"[{symbol}] SKIPPED (already completed before)")
+        plan.extend((symbol, start, end) for start, end in missing)
+    return plan
+
+
+def plan_from_questdb(starts, date_to=DATE_TO):
+    """Fetch plan starting every symbol after its latest row in QuestDB."""
+    latest = latest_timestamps(QUEST_HOST, QUEST_PORT, TABLE, INTERVAL)
+    print(f"Resuming from QuestDB: {len(latest)} symbols already have data")
+    plan = []
+    for symbol, symbol_start in starts.items():
+        start_time = max(latest.get(symbol, DATE_FROM - 1) + 1, symbol_start)
+        if start_time > date_to:
+            print(f"[{symbol}] SKIPPED (already completed before)")
             continue
-
-        sender.row(
-            "spot_klines",
-            symbols={"symbol": symbol, "interval": interval},
-            columns={
-                "open": float(r[1]),
-                "high": float(r[2]),
-                "low": float(r[3]),
-                "close": float(r[4]),
-                "volume": float(r[5]),
-                "close_time": TimestampNanos(int(r[6] * 1_000_000)),
-                "quote_volume": float(r[7]),
-                "trades": int(r[8]),
-                "taker_base_volume": float(r[9]),
-                "taker_quote_volume": float(r[10]),
-            },
-            at=TimestampNanos(int(open_time * 1_000_000)),
-        )
+        plan.append((symbol, start_time, date_to))
+    return plan
+
+
+def plan_backfill(store, starts, date_to=DATE_TO, failed_archives=()):
+    """
+    (plan, window_ms) for make_jobs(): resume from the store, or without
+    one from QuestDB. Archives that failed to import lie below the latest
+    row there, so in that mode their ranges are fetched first; no later
+    run would.
+    """
+    if store is None:
+        plan = list(failed_archives) + plan_from_questdb(starts, date_to)
+        # one window per symbol keeps max(timestamp) an exact resume point
+        return plan, date_to - DATE_FROM + 1
+    # failed archives were never recorded, so the store has them as missing
+    plan = plan_from_checkpoints(store, starts, date_to)
+    # whole pages, several windows per worker (see window_span)
+    return plan, window_span(plan, BATCH_LIMIT, WORKERS)
 
 
 # ---------------- Spot backfill ----------------
-def spot_backfill_all():
-    symbols = get_spot_symbols()
+def spot_backfill_all(date_to=DATE_TO, hand_over=None):
+    """
+    Backfill every symbol up to `date_to` (ms). hand_over, if given, is
+    called with the rollup bars of buckets that continue past date_to
+    (a live stream completes those, see main.py) and returns the ones
+    it does not take, which are written here as usual.
+    """
+    ensure_kline_tables([TABLE], QUEST_HOST, QUEST_PORT)
+    sink = get_sink()
+    spool = Spool(SPOOL_DIR)
+    url = sink.replay_url
+    # leftovers from an earlier run go first, so resume points see them
+    spool.replay(url)
+
+    symbols = get_registry(MARKET).symbols()
     print(f"Found {len(symbols)} spot markets")
 
-    last_symbol, last_timestamp = load_progress()
-    resuming = last_symbol is not None
-    batch_counter = 0
-
-    print("Resume mode:", resuming)
-    if resuming:
-        print("Last symbol:", last_symbol)
-        print("Last timestamp:", last_timestamp)
-
-    with Sender.from_conf(conf) as sender:
-        for symbol in symbols:
+    limiter = shared_limiter(MARKET)
 
-            # Skip symbols until we reach the last one (if resuming)
-            if resuming:
-                if symbol != last_symbol:
-                    print(f"[{symbol}] SKIPPED (already completed before)")
-                    continue
-                else:
-                    print(f"[{symbol}] RESUMING...")
-                    # Ensure resume timestamp is within DATE_FROM
-                    start_time = max(last_timestamp, DATE_FROM)
-                    resuming = False
-            else:
-                start_time = DATE_FROM
-
-            print(f"[{symbol}] start_time={datetime.datetime.fromtimestamp(start_time/1000)}")
-
-            while True:
-                rows = spot_fetch_klines(
-                    symbol,
-                    INTERVAL,
-                    start_time=start_time,
-                    end_time=DATE_TO,
-                    limit=1500
-                )
-
-                if not rows:
-                    print(f"[{symbol}] no rows returned (start_time={start_time})")
-                    break
-
-                ingest_batch(sender, rows, symbol, INTERVAL)
-                batch_counter += 1
-
-                # Save resume point based on close_time + 1 ms
-                resume_point = rows[-1][6] + 1
-                save_progress(symbol, resume_point)
-
-                if batch_counter % 20 == 0:
-                    sender.flush()
-
-                # If fewer than 1500 rows → done with this symbol
-                if len(rows) < 1500:
-                    break
+    def fetch_page(symbol, start_time, end_time, limit):
+        return spot_fetch_klines(
+            symbol,
+            INTERVAL,
+            start_time=start_time,
+            end_time=end_time,
+            limit=limit,
+            limiter=limiter
+        )
 
-                start_time = resume_point
+    # clamp every symbol to its first kline; symbols without any are skipped
+    first = first_kline_times(MARKET, symbols, INTERVAL, fetch_page, get_registry(MARKET))
+    starts = {
+        symbol: max(DATE_FROM, first[symbol])
+        for symbol in symbols
+        if first[symbol] is not None and first[symbol] <= date_to
+    }
+    print(f"{len(starts)} symbols have klines in range")
+
+    store = None if RESUME_MODE == "questdb" else CheckpointStore()
+    # shared by the archive import and the REST backfill
+    rollup = FrameRollup(ROLLUP_INTERVALS) if ROLLUP_INTERVALS else None
+    failed_archives = []
+    if ARCHIVE_SOURCE:
+        # archives cover all but the trailing days, REST only fills what is left
+        _, failed_archives = import_archives(
+            sink, MARKET, list(starts), INTERVAL, DATE_FROM, date_to, TABLE,
+            ARCHIVE_SOURCE, store=store, spool=spool, starts=starts,
+            rollup=rollup
+        )
 
-                # Stop if we reached DATE_TO
-                if start_time > DATE_TO:
-                    break
+    jobs = make_jobs(*plan_backfill(store, starts, date_to, failed_archives))
+    print(f"Backfilling {len(jobs)} windows with {WORKERS} workers")
 
-                time.sleep(0.05)
+    frames = KlineFrameBuffer(TABLE, INTERVAL, DATE_FROM, date_to, rollup=rollup)
+    lock = threading.Lock()
+    batch_counter = 0
 
-        sender.flush()
+    def flush():
+        spool.replay(url)
+        buf = sink.new_buffer()
+        ingest_batch(buf, frames)
+        delivered = flush_or_spool(sink, buf, spool)
+        # ranges are only recorded once their rows reached QuestDB
+        if store is not None:
+            store.commit_delivered(delivered, spool)
+
+    # workers fetch in parallel, ingest one at a time
+    def on_page(symbol, rows, covered_from, covered_to):
+        nonlocal batch_counter
+        with lock:
+            if rows:
+                frames.add(symbol, rows)
+            if store is not None:
+                store.add(MARKET, symbol, INTERVAL, covered_from, covered_to)
+            batch_counter += 1
+            if batch_counter % 20 == 0:
+                flush()
 
-    print("Historical spot backfill complete.")
+    try:
+        tuner = PageTuner(MARKET, limiter, WORKERS)
+        failed = run_backfill(jobs, fetch_page, on_page, tuner, WORKERS)
+        flush()
+        # rollup buckets cut off by date_to or by missing minutes
+        buf = sink.new_buffer()
+        if hand_over is not None and rollup is not None:
+            ingest_frame(buf, TABLE, hand_over(rollup.take_open(date_to)))
+        frames.drain(buf)
+        flush_or_spool(sink, buf, spool)
+    finally:
+        if store is not None:
+            store.close()
+        if spool.pending():
+            print(f"QuestDB unavailable: batches left in {SPOOL_DIR}, replayed on the next run")
+        spool.close()
+
+    if failed:
+        print(f"Historical spot backfill finished with {len(failed)} failed windows.")
+    else:
+        print("Historical spot backfill complete.")
 
 
 # ---------------- Main ----------------
 if __name__ == "__main__":
     print("=== Starting Historical Backfill (Spot) ===")
+    serve(METRICS_PORT)
     try:
         spot_backfill_all()
     except KeyboardInterrupt:
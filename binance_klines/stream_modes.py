@@ -0,0 +1,142 @@
+import asyncio
+from questdb.ingress import TimestampNanos
+from metrics import STREAM_DUPLICATES
+
+# ============================================================
+# Stream ingestion modes
+#
+# Binance pushes a kline update for every trade. What reaches the
+# writer depends on the mode:
+#   "closed"   - only final candles (k["x"] is true)
+#   "coalesce" - at most one row per (symbol, interval) per window,
+#                carrying the latest state; closed candles are
+#                written immediately
+#   "all"      - every update is written. The kline tables DEDUP on
+#                (timestamp, symbol, interval) (schema.py), so each
+#                write upserts the candle's row: the table ends up
+#                with the same one row per candle as "coalesce", only
+#                fresher, at the cost of one write per trade. Use it to
+#                load-test the writer or to feed a table without DEDUP.
+# Klines opening before `since` are dropped: a backfill covers them
+# (see main.py).
+#
+# Watermark: the last row written per (symbol, interval) is kept as
+# (open_time, trades, volume, closed). A kline for an older candle, or
+# one identical to the last row (a candle re-sent after a reconnect, a
+# coalesce tick without new trades), is not sent again. The table's
+# DEDUP keys (schema.py) catch what a single process cannot see.
+#
+# With a RecentKlines (recent.py), every kline update (whatever the mode
+# and `since`) and every rollup bar written is also kept in memory for
+# local readers.
+# ============================================================
+
+STREAM_MODES = ("closed", "coalesce", "all")  # "all" stores no more than "coalesce" under DEDUP
+COALESCE_MS = 1000
+
+
+def kline_row(k):
+    """Convert a decoded Kline (see decoders.py) into (symbols, columns, at) for the writer."""
+    return (
+        {"symbol": k.symbol, "interval": k.interval},
+        {
+            "open": k.open,
+            "high": k.high,
+            "low": k.low,
+            "close": k.close,
+            "volume": k.volume,
+            "close_time": TimestampNanos(k.close_time * 1_000_000),
+            "quote_volume": k.quote_volume,
+            "trades": k.trades,
+            "taker_base_volume": k.taker_base_volume,
+            "taker_quote_volume": k.taker_quote_volume,
+        },
+        TimestampNanos(k.open_time * 1_000_000),
+    )
+
+
+class KlineRouter:
+    """Applies the stream mode between the WS workers and the writer."""
+
+    def __init__(self, writer, table, mode="closed", coalesce_ms=COALESCE_MS, rollup=None,
+                 recent=None):
+        if mode not in STREAM_MODES:
+            raise ValueError(f"Unknown stream mode {mode!r}, expected one of {STREAM_MODES}")
+        self.writer = writer
+        self.table = table
+        self.mode = mode
+        self.coalesce_ms = coalesce_ms
+        self.rollup = rollup  # StreamRollup fed with closed candles
+        self.recent = recent  # RecentKlines kept for local readers
+        self.since = 0  # open_time (ms) of the first kline to write
+        self.sent = {}  # (symbol, interval) -> (open_time, trades, volume, closed) last written
+        self.duplicates = STREAM_DUPLICATES.labels(table)
+        # (symbol, interval) -> latest Kline since the last tick
+        self.latest = {}
+
+    def _write(self, k):
+        symbols, columns, at = kline_row(k)
+        self.writer.put(self.table, symbols, columns, at)
+
+    def _write_bar(self, bar):
+        self._write(bar)
+        if self.recent is not None:
+            self.recent.update(bar)
+
+    def _write_kline(self, k):
+        """_write() for streamed klines, behind the watermark; False if it was a duplicate."""
+        key = (k.symbol, k.interval)
+        sent = self.sent.get(key)
+        mark = (k.open_time, k.trades, k.volume, k.closed)
+        if sent is not None and (k.open_time < sent[0] or mark == sent):
+            self.duplicates.inc()
+            return False
+        self.sent[key] = mark
+        self._write(k)
+        return True
+
+    def on_kline(self, k):
+        if self.recent is not None:
+            self.recent.update(k)
+        if k.open_time < self.since:
+            return
+        if not k.closed:
+            if self.mode == "all":
+                self._write_kline(k)
+            elif self.mode == "coalesce":
+                self.latest[(k.symbol, k.interval)] = k
+            return
+        self.latest.pop((k.symbol, k.interval), None)
+        # a re-sent closed candle must not be counted into its rollup bars twice
+        if self._write_kline(k) and self.rollup is not None:
+            for bar in self.rollup.update(k):
+                self._write_bar(bar)
+
+    async def run(self):
+        """Emit the coalesced table every coalesce_ms (no-op in other modes)."""
+        if self.mode != "coalesce":
+            return
+        while True:
+            await asyncio.sleep(self.coalesce_ms / 1000)
+            latest, self.latest = self.latest, {}
+            for k in latest.values():
+                self._write_kline(k)
+
+    # ---------------- Handoff from a backfill ----------------
+    def start_handoff(self, cutover):
+        """Write klines from `cutover` (ms) on, holding rollup bars that started before it."""
+        self.since = cutover
+        if self.rollup is not None:
+            self.rollup.hold_before = cutover
+
+    def merge_backfill(self, bars):
+        """Complete the held rollup bars with the backfill's part of their buckets."""
+        for bar in bars:
+            for merged in self.rollup.merge(bar):
+                self._write_bar(merged)
+
+    def end_handoff(self):
+        """Write the held bars the backfill had nothing for."""
+        if self.rollup is not None:
+            for bar in self.rollup.release():
+                self._write_bar(bar)
@@ -0,0 +1,120 @@
+import asyncio
+import time
+import traceback
+from spool import flush_or_spool
+from metrics import WRITER_ACK_AGE, WRITER_DROPPED, WRITER_QUEUE, WRITER_ROWS
+
+# ============================================================
+# Stream writer: bounded queue -> ILP buffer -> off-loop flush
+#
+# WebSocket workers hand rows to put(), which never blocks: when the
+# queue is full the row is dropped and counted. A single consumer task
+# serializes rows into a buffer and flushes it when any of the row,
+# byte or latency limits is hit. The blocking HTTP flush runs in a
+# thread on a swapped-out buffer, so frame reading and serialization
+# continue while it is in flight. With a spool, batches that cannot
+# reach QuestDB are written to disk instead (see spool.py).
+# ============================================================
+
+FLUSH_ROWS = 10_000
+FLUSH_BYTES = 4 * 1024 * 1024
+FLUSH_INTERVAL = 0.2  # seconds, max latency of a buffered row
+QUEUE_SIZE = 100_000
+DRAIN_BATCH = 1_000  # rows taken from the queue per wake-up
+
+
+class StreamWriter:
+
+    def __init__(self, sink, flush_rows=FLUSH_ROWS, flush_bytes=FLUSH_BYTES,
+                 flush_interval=FLUSH_INTERVAL, queue_size=QUEUE_SIZE, spool=None):
+        self.sink = sink
+        self.spool = spool
+        self.flush_rows = flush_rows
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.flush_errors = 0
+        self.inflight = None
+
+    def put(self, table, symbols, columns, at):
+        """Queue one row; returns False (and counts a drop) if the queue is full."""
+        try:
+            self.queue.put_nowait((table, symbols, columns, at))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            WRITER_DROPPED.inc()
+            return False
+
+    def _flush_sync(self, buf, started=None):
+        try:
+            flush_or_spool(self.sink, buf, self.spool)
+            if started is not None:
+                # spooled batches count too: they are durable from here on
+                WRITER_ACK_AGE.observe(time.monotonic() - started)
+        except Exception:
+            self.flush_errors += 1
+            print(f"[SINK] Flush failed, {len(buf)} bytes lost:")
+            traceback.print_exc()
+
+    async def _flush(self, buf, started):
+        # one flush in flight at a time; waiting here is the backpressure
+        if self.inflight is not None:
+            await self.inflight
+        loop = asyncio.get_running_loop()
+        self.inflight = loop.run_in_executor(None, self._flush_sync, buf, started)
+        WRITER_QUEUE.set(self.queue.qsize())
+
+        if self.dropped != self.reported_dropped:
+            print(f"[SINK] Queue full: {self.dropped - self.reported_dropped} rows dropped")
+            self.reported_dropped = self.dropped
+
+    async def run(self):
+        buf = self.sink.new_buffer()
+        rows = 0
+        started = None  # when the buffer's first row was taken
+        deadline = None
+
+        try:
+            while True:
+                try:
+                    if deadline is None:
+                        item = await self.queue.get()
+                    else:
+                        timeout = max(deadline - time.monotonic(), 0)
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    item = None
+
+                if item is not None:
+                    if deadline is None:
+                        started = time.monotonic()
+                        deadline = started + self.flush_interval
+                    batch = [item]
+                    while len(batch) < DRAIN_BATCH and not self.queue.empty():
+                        batch.append(self.queue.get_nowait())
+                    for table, symbols, columns, at in batch:
+                        try:
+                            buf.row(table, symbols=symbols, columns=columns, at=at)
+                            rows += 1
+                        except Exception:
+                            traceback.print_exc()
+
+                if not rows:
+                    deadline = None
+                elif (rows >= self.flush_rows
+                      or len(buf) >= self.flush_bytes
+                      or time.monotonic() >= deadline):
+                    WRITER_ROWS.inc(rows)
+                    await self._flush(buf, started)
+                    buf = self.sink.new_buffer()
+                    rows = 0
+                    deadline = None
+        finally:
+            if self.inflight is not None:
+                await self.inflight
+            if rows:
+                WRITER_ROWS.inc(rows)
+                self._flush_sync(buf, started)
@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+from http_client import request
+from rate_limit import EXCHANGE_INFO_WEIGHT, shared_limiter
+from utils import BINANCE_FAPI, BINANCE_SPOT
+
+# ============================================================
+# exchangeInfo symbol registry
+#
+# exchangeInfo is several MB for spot. The registry keeps a compact
+# per-symbol index on disk and reuses it while it is younger than
+# the TTL. After that it revalidates with If-None-Match /
+# If-Modified-Since, so an unchanged payload costs a 304. Each
+# refresh is diffed against the previous index, and subscribers are
+# told which symbols were listed or delisted.
+# ============================================================
+
+EXCHANGE_INFO_URL = {
+    "spot": BINANCE_SPOT + "/api/v3/exchangeInfo",
+    "futures": BINANCE_FAPI + "/fapi/v1/exchangeInfo",
+}
+CACHE_DIR = "cache"
+TTL_SECONDS = 300
+
+
+class SymbolInfo(NamedTuple):
+    symbol: str
+    status: str  # "TRADING", "BREAK", "SETTLING", ...
+    base_asset: str
+    quote_asset: str
+    onboard_date: Optional[int]  # ms, futures only
+    contract_type: Optional[str]  # "PERPETUAL", ..., futures only
+
+
+def parse_exchange_info(market, payload):
+    """{symbol: SymbolInfo} from an exchangeInfo response body."""
+    index = {}
+    for s in payload["symbols"]:
+        index[s["symbol"]] = SymbolInfo(
+            s["symbol"],
+            s["status"],
+            s["baseAsset"],
+            s["quoteAsset"],
+            s.get("onboardDate"),
+            s.get("contractType"),
+        )
+    return index
+
+
+class SymbolRegistry:
+
+    def __init__(self, market, cache_dir=CACHE_DIR, ttl=TTL_SECONDS):
+        self.market = market
+        self.ttl = ttl
+        self.path = os.path.join(cache_dir, f"exchange_info_{market}.json")
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.index = {}
+        self.etag = None
+        self.last_modified = None
+        self.fetched_at = 0.0
+        self._load_cache()
+
+    def _load_cache(self):
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        self.index = {s[0]: SymbolInfo(*s) for s in cached["symbols"]}
+        self.etag = cached.get("etag")
+        self.last_modified = cached.get("last_modified")
+        self.fetched_at = cached.get("fetched_at", 0.0)
+
+    def _save_cache(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({
+                "etag": self.etag,
+                "last_modified": self.last_modified,
+                "fetched_at": self.fetched_at,
+                "symbols": list(self.index.values()),
+            }, f)
+        os.replace(tmp, self.path)
+
+    def subscribe(self, callback):
+        """Call callback(added, removed) with symbol lists whenever a refresh changes the index."""
+        self.subscribers.append(callback)
+
+    def refresh(self, force=False):
+        """
+        Revalidate the index if it is older than the TTL (or force is set).
+        Returns (added, removed); a symbol counts as removed once it stops
+        trading, i.e. delistings and settlements.
+        """
+        with self.lock:
+            if not force and self.index and time.time() - self.fetched_at < self.ttl:
+                return [], []
+
+            headers = {}
+            if self.index and self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.index and self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+            r = request("GET", EXCHANGE_INFO_URL[self.market], headers=headers,
+                        limiter=shared_limiter(self.market),
+                        weight=EXCHANGE_INFO_WEIGHT[self.market])
+            self.fetched_at = time.time()
+            if r.status_code == 304:
+                self._save_cache()
+                return [], []
+            r.raise_for_status()
+
+            old = self.index
+            self.index = parse_exchange_info(self.market, r.json())
+            self.etag = r.headers.get("ETag")
+            self.last_modified = r.headers.get("Last-Modified")
+            self._save_cache()
+
+        trading_before = {s for s, info in old.items() if info.status == "TRADING"}
+        trading_now = {s for s, info in self.index.items() if info.status == "TRADING"}
+        added = sorted(trading_now - trading_before)
+        removed = sorted(trading_before - trading_now)
+        if old and (added or removed):
+            print(f"[SYMBOLS] {self.market}: listed {added[:10]}, delisted {removed[:10]}"
+                  f" ({len(added)} / {len(removed)})")
+            for callback in self.subscribers:
+                callback(added, removed)
+        return added, removed
+
+    def symbols(self, status="TRADING", quote_assets=None, contract_type=None):
+        """Sorted symbols matching the filters; None matches anything."""
+        self.refresh()
+        return sorted(
+            info.symbol for info in self.index.values()
+            if (status is None or info.status == status)
+            and (quote_assets is None or info.quote_asset in quote_assets)
+            and (contract_type is None or info.contract_type == contract_type)
+        )
+
+    def onboard_date(self, symbol):
+        info = self.index.get(symbol)
+        return None if info is None else info.onboard_date
+
+
+_registries = {}
+
+
+def get_registry(market):
+    """The process-wide registry for "spot" or "futures"."""
+    if market not in _registries:
+        _registries[market] = SymbolRegistry(market)
+    return _registries[market]
@@ -1,20 +1,13 @@
-import requests
+from http_client import MAX_RETRIES, get_json
+from rate_limit import klines_weight
 
 BINANCE_SPOT = "https://api.binance.com"
 
 BINANCE_FAPI = "https://fapi.binance.com"
 
-def get_spot_symbols():
-    """Return all spot trading symbols."""
-    r = requests.get(BINANCE_SPOT + "/api/v3/exchangeInfo")
-    r.raise_for_status()
-    data = r.json()["symbols"]
-
-    # filter to active trading markets only
-    return [s["symbol"] for s in data if s["status"] == "TRADING"]
-
-def spot_fetch_klines(symbol, interval, start_time=None, end_time=None, limit=1500):
-    """Fetch one batch of klines."""
+def spot_fetch_klines(symbol, interval, start_time=None, end_time=None, limit=1000, limiter=None,
+                      max_retries=MAX_RETRIES, base_url=BINANCE_SPOT):
+    """Fetch one batch of klines (base_url points elsewhere for mirrors and benchmarks)."""
     params = {
         "symbol": symbol,
         "interval": interval,
@@ -25,20 +18,18 @@ def spot_fetch_klines(symbol, interval, start_time=None, end_time=None, limit=15
     if end_time is not None:
         params["endTime"] = end_time
 
-    r = requests.get(BINANCE_SPOT + "/api/v3/klines", params=params)
-    r.raise_for_status()
-    return r.json()
-
-def get_futures_symbols():
-    """Return all USDT-M Futures symbols."""
-    r = requests.get(BINANCE_FAPI + "/fapi/v1/exchangeInfo")
-    r.raise_for_status()
-    symbols = r.json()["symbols"]
-    return [s["symbol"] for s in symbols if s["contractType"] == "PERPETUAL"]
-
-
-def future_fetch_klines(symbol, interval, start_time=None, end_time=None, limit=1500):
-    """Fetch one batch of klines."""
+    return get_json(
+        base_url + "/api/v3/klines",
+        params,
+        limiter=limiter,
+        weight=klines_weight("spot", limit),
+        max_retries=max_retries,
+        label=symbol,
+    )
+
+def future_fetch_klines(symbol, interval, start_time=None, end_time=None, limit=1500, limiter=None,
+                        max_retries=MAX_RETRIES, base_url=BINANCE_FAPI):
+    """Fetch one batch of klines (base_url points elsewhere for mirrors and benchmarks)."""
     params = {
         "symbol": symbol,
         "interval": interval,
@@ -49,6 +40,11 @@ def future_fetch_klines(symbol, interval, start_time=None, end_time=None, limit=
     if end_time is not None:
         params["endTime"] = end_time
 
-    r = requests.get(BINANCE_FAPI + "/fapi/v1/klines", params=params)
-    r.raise_for_status()
-    return r.json()
+    return get_json(
+        base_url + "/fapi/v1/klines",
+        params,
+        limiter=limiter,
+        weight=klines_weight("futures", limit),
+        max_retries=max_retries,
+        label=symbol,
+    )
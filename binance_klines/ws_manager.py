@@ -0,0 +1,149 @@
+import asyncio
+import json
+import traceback
+import aiohttp
+from metrics import WS_RECONNECTS
+
+# ============================================================
+# Multiplexed WebSocket connections with live SUBSCRIBE
+#
+# Streams are packed into as few combined-stream connections as the
+# per-connection limit allows. Streams are added and removed with
+# SUBSCRIBE/UNSUBSCRIBE messages on the open socket, so symbol list
+# changes never force a reconnect, and a reconnect re-subscribes the
+# connection's current streams.
+# ============================================================
+
+STREAMS_PER_CONN = 1000  # Binance allows 1024 streams per connection
+SUBSCRIBE_BATCH = 100  # stream names per SUBSCRIBE message
+CONTROL_MSGS_PER_SEC = 4  # spot allows 5 incoming messages/s, futures 10
+RECONNECT_DELAY = 5
+
+
+class StreamConnection:
+    """One combined-stream socket and the set of streams it should carry."""
+
+    def __init__(self, session, url, on_message, name, connect_kwargs=None):
+        self.session = session
+        self.url = url
+        self.on_message = on_message
+        self.name = name
+        self.connect_kwargs = connect_kwargs or {}
+        self.streams = set()
+        self.ws = None
+        self.resubscribe = None  # the paced SUBSCRIBE of the current connection
+        self.next_id = 1
+        self.send_lock = asyncio.Lock()
+        self.connects = WS_RECONNECTS.labels(url)
+
+    async def _send(self, method, streams):
+        ws = self.ws
+        if ws is None or ws.closed:
+            # applied on the next (re)connect
+            return
+        async with self.send_lock:
+            try:
+                for i in range(0, len(streams), SUBSCRIBE_BATCH):
+                    await ws.send_str(json.dumps({
+                        "method": method,
+                        "params": streams[i:i + SUBSCRIBE_BATCH],
+                        "id": self.next_id,
+                    }))
+                    self.next_id += 1
+                    await asyncio.sleep(1 / CONTROL_MSGS_PER_SEC)
+            except (ConnectionError, aiohttp.ClientError) as e:
+                # the socket dropped; the reconnect subscribes self.streams again
+                print(f"[WS {self.name}] {method} interrupted: {e}")
+
+    async def subscribe(self, streams):
+        self.streams.update(streams)
+        await self._send("SUBSCRIBE", sorted(streams))
+
+    async def unsubscribe(self, streams):
+        self.streams.difference_update(streams)
+        await self._send("UNSUBSCRIBE", sorted(streams))
+
+    async def run(self):
+        while True:
+            try:
+                print(f"[WS {self.name}] Connecting ({len(self.streams)} streams)...")
+                self.connects.inc()
+                async with self.session.ws_connect(self.url, heartbeat=20, **self.connect_kwargs) as ws:
+                    self.ws = ws
+                    print(f"[WS {self.name}] Connected")
+                    # paced in the background so frames are read meanwhile
+                    self.resubscribe = asyncio.create_task(self._send("SUBSCRIBE", sorted(self.streams)))
+
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            try:
+                                self.on_message(msg.data)
+                            except Exception:
+                                traceback.print_exc()
+                        elif msg.type == aiohttp.WSMsgType.ERROR:
+                            print(f"[WS {self.name}] Error:", msg)
+                            break
+            except Exception as e:
+                print(f"[WS {self.name}] Exception:", e)
+            finally:
+                self.ws = None
+                if self.resubscribe is not None:
+                    self.resubscribe.cancel()
+                    self.resubscribe = None
+
+            print(f"[WS {self.name}] Reconnecting in {RECONNECT_DELAY}s...")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+
+class StreamManager:
+    """Assigns streams to connections and keeps them in sync with a symbol list."""
+
+    def __init__(self, session, url, stream_name, on_message,
+                 streams_per_conn=STREAMS_PER_CONN, connect_kwargs=None):
+        self.session = session
+        self.url = url
+        self.stream_name = stream_name
+        self.on_message = on_message
+        self.streams_per_conn = streams_per_conn
+        self.connect_kwargs = connect_kwargs
+        self.connections = []
+        self.tasks = []
+        self.assigned = {}  # stream name -> StreamConnection
+
+    def _connection_with_room(self):
+        for conn in self.connections:
+            if len(conn.streams) < self.streams_per_conn:
+                return conn
+        conn = StreamConnection(
+            self.session, self.url, self.on_message,
+            name=str(len(self.connections)), connect_kwargs=self.connect_kwargs,
+        )
+        self.connections.append(conn)
+        self.tasks.append(asyncio.create_task(conn.run()))
+        return conn
+
+    async def set_symbols(self, symbols):
+        """Subscribe new symbols and unsubscribe dropped ones, without reconnecting."""
+        wanted = {self.stream_name(s) for s in symbols}
+        removed = [s for s in self.assigned if s not in wanted]
+        added = sorted(wanted.difference(self.assigned))
+
+        by_conn = {}
+        for stream in removed:
+            by_conn.setdefault(self.assigned.pop(stream), []).append(stream)
+        for conn, streams in by_conn.items():
+            await conn.unsubscribe(streams)
+
+        by_conn = {}
+        for stream in added:
+            conn = self._connection_with_room()
+            # reserve the slot before the (paced) SUBSCRIBE is sent
+            conn.streams.add(stream)
+            self.assigned[stream] = conn
+            by_conn.setdefault(conn, []).append(stream)
+        for conn, streams in by_conn.items():
+            await conn.subscribe(streams)
+
+        if added or removed:
+            print(f"[SYS] Streams: +{len(added)} -{len(removed)}, "
+                  f"{len(self.assigned)} on {len(self.connections)} connections")
@@ -0,0 +1,45 @@
+import os
+import sys
+import pandas as pd
+import pytest
+
+# the modules are flat scripts that import each other by name
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "binance_klines"))
+
+from sinks import RecordBuffer  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+class RecordSink:
+    """Keeps flushed buffers in memory (not QuestDB, so nothing is spooled)."""
+
+    replay_url = None
+
+    def __init__(self):
+        self.flushed = []
+
+    def new_buffer(self):
+        return RecordBuffer()
+
+    def flush(self, buf):
+        self.flushed.append(buf)
+
+    def tables(self):
+        """{table: DataFrame} of everything flushed."""
+        parts = {}
+        for buf in self.flushed:
+            for table, df in buf.tables().items():
+                parts.setdefault(table, []).append(df)
+        return {table: pd.concat(dfs, ignore_index=True) for table, dfs in parts.items()}
+
+
+@pytest.fixture
+def record_sink():
+    return RecordSink()
+
+
+@pytest.fixture
+def archive_dir():
+    """Local mirror layout: data/<market>/monthly/klines/<symbol>/1m/*.zip"""
+    return os.path.join(FIXTURES, "archives")
@@ -0,0 +1,126 @@
+import io
+import os
+import zipfile
+import numpy as np
+import archive_import
+import future_backfill
+from archive_import import import_archives, open_archive, read_archive
+from checkpoint import CheckpointStore
+
+M = 60_000
+JAN = 1_704_067_200_000  # 2024-01-01T00:00Z, first row of every fixture
+JAN_END = 1_706_745_600_000 - 1  # 2024-01-31T23:59:59.999Z
+FEB_END = 1_709_251_200_000 - 1
+SPOT_BTC = "data/spot/monthly/klines/BTCUSDT/1m/BTCUSDT-1m-2024-01.zip"
+FUTURES_ETH = "data/futures/um/monthly/klines/ETHUSDT/1m/ETHUSDT-1m-2024-01.zip"
+
+
+def open_times(df):
+    return (df["timestamp"].astype("int64") // 1_000_000).tolist()
+
+
+# ---------------- read_archive / open_archive ----------------
+def test_read_archive_without_header(archive_dir):
+    a = read_archive(os.path.join(archive_dir, SPOT_BTC))
+    assert a.shape == (11, 10)
+    assert a[0, 0] == JAN and a[6, 0] == JAN + M - 1
+    assert a[5].tolist() == [10.0 * (i + 1) for i in range(10)]
+
+
+def test_read_archive_with_header_row(archive_dir):
+    a = read_archive(os.path.join(archive_dir, FUTURES_ETH))
+    assert a.shape == (11, 10)
+    assert a[0].tolist() == [JAN + i * M for i in range(10)]
+    assert a[8].tolist() == list(range(1, 11))
+
+
+def test_read_archive_microsecond_timestamps():
+    src = io.BytesIO()
+    with zipfile.ZipFile(src, "w") as zf:
+        zf.writestr("x.csv", f"{JAN * 1000},1,2,0.5,1.5,3,{(JAN + M - 1) * 1000},4,5,6,7,0\n")
+    a = read_archive(src)
+    assert a[0, 0] == JAN and a[6, 0] == JAN + M - 1
+
+
+def test_open_archive_local_directory(archive_dir):
+    assert open_archive(archive_dir, SPOT_BTC) == os.path.join(archive_dir, SPOT_BTC)
+    assert open_archive(archive_dir, SPOT_BTC.replace("2024-01", "2023-12")) is None
+
+
+# ---------------- import_archives ----------------
+def test_import_clamps_range_and_filters_volume(archive_dir, record_sink, tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.db"))
+    start = JAN + 2 * M
+    total, failed = import_archives(
+        record_sink, "spot", ["BTCUSDT"], "1m", start, JAN_END, "spot_klines",
+        archive_dir, min_volume=50, store=store,
+    )
+    # minutes 2-9 are in range; of their volumes 30..100, 30, 40 and 50 are not > 50
+    assert (total, failed) == (5, [])
+    assert open_times(record_sink.tables()["spot_klines"]) == [JAN + m * M for m in range(5, 10)]
+    # the whole archive range is complete, filtered rows included
+    assert store.completed("spot", "BTCUSDT", "1m") == [(start, JAN_END)]
+
+    # nothing left to import on the next run
+    again = type(record_sink)()
+    assert import_archives(again, "spot", ["BTCUSDT"], "1m", start, JAN_END, "spot_klines",
+                           archive_dir, store=store) == (0, [])
+    store.close()
+
+
+def test_import_skips_missing_months(archive_dir, record_sink, tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.db"))
+    total, failed = import_archives(
+        record_sink, "spot", ["BTCUSDT"], "1m", JAN, FEB_END, "spot_klines",
+        archive_dir, store=store,
+    )
+    # no February file: not a failure, and left unrecorded for REST
+    assert (total, failed) == (10, [])
+    assert store.completed("spot", "BTCUSDT", "1m") == [(JAN, JAN_END)]
+    store.close()
+
+
+def test_import_returns_failed_ranges(archive_dir, record_sink, tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.db"))
+    total, failed = import_archives(
+        record_sink, "spot", ["XRPUSDT", "BTCUSDT"], "1m", JAN, JAN_END, "spot_klines",
+        archive_dir, store=store, starts={"XRPUSDT": JAN + 5 * M},
+    )
+    assert total == 10
+    assert failed == [("XRPUSDT", JAN + 5 * M, JAN_END)]
+    assert store.completed("spot", "XRPUSDT", "1m") == []
+    store.close()
+
+
+def test_failed_archives_lead_the_questdb_resume_plan(monkeypatch):
+    # QuestDB already has rows up to the end of February
+    monkeypatch.setattr(future_backfill, "latest_timestamps", lambda *args: {"ETHUSDT": FEB_END})
+    monkeypatch.setattr(future_backfill, "DATE_FROM", JAN)
+    date_to = FEB_END + 10 * M
+    failed = [("ETHUSDT", JAN, JAN_END)]
+    plan, window_ms = future_backfill.plan_backfill(None, {"ETHUSDT": JAN}, date_to, failed)
+    assert plan == [("ETHUSDT", JAN, JAN_END), ("ETHUSDT", FEB_END + 1, date_to)]
+    assert window_ms == date_to - JAN + 1
+
+
+def test_failed_archives_stay_missing_in_checkpoint_mode(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.db"))
+    store.add("futures", "ETHUSDT", "1m", JAN_END + 1, FEB_END)
+    store.commit()
+    plan, _ = future_backfill.plan_backfill(store, {"ETHUSDT": JAN}, FEB_END, [("ETHUSDT", JAN, JAN_END)])
+    assert plan == [("ETHUSDT", JAN, JAN_END)]
+    store.close()
+
+
+def test_archive_files_covered_ranges():
+    import datetime
+    now = datetime.datetime(2024, 3, 10, 12, tzinfo=datetime.timezone.utc)
+    files = archive_import.archive_files("spot", "BTCUSDT", "1m", JAN + 5 * M, FEB_END + 9 * 86_400_000, now)
+    monthly = [f for f in files if "/monthly/" in f[0]]
+    daily = [f for f in files if "/daily/" in f[0]]
+    assert [(f[1], f[2]) for f in monthly] == [(JAN + 5 * M, JAN_END), (JAN_END + 1, FEB_END)]
+    # February is last month: its days are the fallback if the monthly file is not out yet
+    assert len(monthly[1][3]) == 29 and monthly[0][3] == []
+    # March up to yesterday, by day
+    assert [f[0].rsplit("-", 1)[-1] for f in daily] == [f"{d:02d}.zip" for d in range(1, 10)]
+    assert np.all(np.diff([f[1] for f in daily]) == 86_400_000)
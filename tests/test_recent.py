@@ -0,0 +1,74 @@
+import asyncio
+import json
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from decoders import make_decoder
+from recent import RecentAPI, RecentKlines
+
+msgspec = pytest.importorskip("msgspec")
+
+FRAME = json.dumps({
+    "stream": "btcusdt@kline_1m",
+    "data": {
+        "e": "kline", "E": 1_700_000_060_123, "s": "BTCUSDT",
+        "k": {
+            "t": 1_700_000_000_000, "T": 1_700_000_059_999, "s": "BTCUSDT", "i": "1m",
+            "o": "37000.10", "c": "37010.50", "h": "37020.00", "l": "36990.00",
+            "v": "12.5", "n": 321, "x": True, "q": "462600.0",
+            "V": "6.25", "Q": "231300.0", "B": "0",
+        },
+    },
+})
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def with_client(recent, check):
+    client = TestClient(TestServer(RecentAPI(recent).app()))
+    await client.start_server()
+    try:
+        await check(client)
+    finally:
+        await client.close()
+
+
+def test_msgspec_kline_through_api():
+    k = make_decoder("msgspec")(FRAME)
+    assert isinstance(k, msgspec.Struct)
+    recent = RecentKlines(size=10)
+    recent.update(k)
+
+    async def check(client):
+        r = await client.get("/latest", params={"symbol": "BTCUSDT"})
+        assert r.status == 200
+        latest = await r.json()
+        assert latest["open_time"] == 1_700_000_000_000
+        assert latest["close"] == 37010.5
+        assert latest["event_time"] == 1_700_000_060_123
+
+        r = await client.get("/latest")
+        assert (await r.json())["BTCUSDT"]["trades"] == 321
+
+        r = await client.get("/klines", params={"symbol": "BTCUSDT", "n": "5"})
+        assert r.status == 200
+        assert [row["volume"] for row in await r.json()] == [12.5]
+
+    run(with_client(recent, check))
+
+
+def test_msgspec_kline_pushed_to_subscriber():
+    decode = make_decoder("msgspec")
+    recent = RecentKlines(size=10)
+
+    async def check(client):
+        ws = await client.ws_connect("/subscribe", params={"symbols": "BTCUSDT"})
+        while not recent.subscriptions:
+            await asyncio.sleep(0.01)
+        recent.update(decode(FRAME))
+        msg = await asyncio.wait_for(ws.receive_json(), 5)
+        assert msg["symbol"] == "BTCUSDT" and msg["closed"] is True
+        await ws.close()
+
+    run(with_client(recent, check))
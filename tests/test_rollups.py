@@ -0,0 +1,105 @@
+import numpy as np
+import gaps
+from columnar import array_frame
+from decoders import Kline
+from rollups import FrameRollup, StreamRollup, frame_klines
+
+M = 60_000
+H = 3_600_000
+T0 = 1_700_000_000_000 - 1_700_000_000_000 % H  # an hour boundary
+
+
+def kline(t, volume=10.0):
+    return Kline("BTCUSDT", "1m", t, t + M - 1, 1.0, 2.0, 0.5, 1.5, volume,
+                 volume, 1, volume / 2, volume / 2, True)
+
+
+def minutes_array(minutes, volume=10.0):
+    """(11, n) 1m columns, as from archives or QuestDB."""
+    t = np.array([T0 + m * M for m in minutes], dtype=np.float64)
+    n = len(t)
+    ones = np.ones(n)
+    return np.vstack([t, ones, 2 * ones, 0.5 * ones, 1.5 * ones, volume * ones, t + M - 1,
+                      volume * ones, ones, volume / 2 * ones, volume / 2 * ones])
+
+
+def stream(rollup, minutes):
+    bars = []
+    for m in minutes:
+        bars += rollup.update(kline(T0 + m * M))
+    return bars
+
+
+def test_stream_emits_complete_buckets():
+    bars = stream(StreamRollup(("5m",)), range(10))
+    assert [(b.open_time - T0) // M for b in bars] == [0, 5]
+    assert [b.volume for b in bars] == [50.0, 50.0]
+
+
+def test_stream_drops_bucket_with_skipped_minutes():
+    # a reconnect gap: minutes 2 and 3 never arrive
+    bars = stream(StreamRollup(("5m",)), [0, 1, 4, 5, 6, 7, 8, 9])
+    assert [(b.open_time - T0) // M for b in bars] == [5]
+
+
+def test_stream_drops_bucket_entered_midway():
+    bars = stream(StreamRollup(("1h",)), range(30, 150))
+    assert [(b.open_time - T0) // M for b in bars] == [60]
+    assert bars[0].volume == 600.0
+
+
+def test_handoff_merges_seam_bar():
+    cutover = T0 + 45 * M
+    backfill = FrameRollup(("1h",))
+    df, _ = array_frame(minutes_array(range(45)), "BTCUSDT", "1m")
+    backfill.add(df)
+    rollup = StreamRollup(("1h",))
+    rollup.hold_before = cutover
+    bars = stream(rollup, range(45, 120))
+    for earlier in frame_klines(backfill.take_open(cutover - 1)):
+        bars += rollup.merge(earlier)
+    bars += rollup.release()
+    assert sorted((b.open_time - T0) // M for b in bars) == [0, 60]
+    assert all(b.volume == 600.0 for b in bars)
+
+
+def test_handoff_drops_seam_bar_the_stream_missed_minutes_of():
+    cutover = T0 + 45 * M
+    backfill = FrameRollup(("1h",))
+    df, _ = array_frame(minutes_array(range(45)), "BTCUSDT", "1m")
+    backfill.add(df)
+    rollup = StreamRollup(("1h",))
+    rollup.hold_before = cutover
+    bars = stream(rollup, [m for m in range(45, 60) if m != 50])
+    for earlier in frame_klines(backfill.take_open(cutover - 1)):
+        bars += rollup.merge(earlier)
+    assert bars == [] and rollup.release() == []
+
+
+def test_frame_drain_keeps_started_buckets_only():
+    rollup = FrameRollup(("1h",))
+    df, _ = array_frame(minutes_array(range(30, 150)), "BTCUSDT", "1m")
+    complete = rollup.add(df)
+    drained = rollup.drain()
+    assert list(complete["volume"]) == [600.0]
+    # 02:00 started and is cut off by the range; 00:30 was entered mid-way
+    assert list(drained["timestamp"].astype("int64") // 1_000_000) == [T0 + 2 * H]
+
+
+def test_rebuild_rollups_from_stored_and_repaired_rows(monkeypatch, record_sink):
+    # QuestDB holds minutes 0-59 but 2 and 3 (still being applied), the repair fetched them
+    stored = minutes_array([m for m in range(60) if m not in (2, 3)])
+    monkeypatch.setattr(gaps, "scan_klines", lambda table, symbol, start, end: stored)
+    repaired = [[T0 + m * M, "1", "2", "0.5", "1.5", "10", T0 + m * M + M - 1, "10", 1, "5", "5", "0"]
+                for m in (2, 3)]
+    buckets = gaps.touched_buckets({T0 + 2 * M, T0 + 3 * M}, ("5m", "1h"), T0 + H - 1)
+    assert buckets == {("5m", T0), ("1h", T0)}
+
+    assert gaps.rebuild_rollups(record_sink, "spot_klines", "BTCUSDT", buckets, repaired) == 2
+    bars = record_sink.tables()["spot_klines"].sort_values("volume")
+    assert list(bars["interval"].astype(str)) == ["5m", "1h"]
+    assert list(bars["volume"]) == [50.0, 600.0]
+
+
+def test_touched_buckets_skips_open_buckets():
+    assert gaps.touched_buckets({T0 + 2 * M}, ("5m", "1h"), T0 + 10 * M) == {("5m", T0)}